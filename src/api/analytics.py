@@ -0,0 +1,262 @@
+"""Heavy lab analytics, run by an `api.executor.Executor`.
+
+Operations take a database and an optional lab store either as objects or,
+in worker processes, as a URL and a directory; each process keeps one
+engine and store per database and directory. Large results are packed into
+arrays or bytes, which are cheaper to send back than lists of tuples.
+"""
+
+from collections.abc import Sequence
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+import numpy.typing as npt
+from sqlalchemy import Engine, create_engine
+from sqlalchemy.orm import Session
+
+from dao.lab_dao import LabAggregate, LabDao, LabPoint, PatientLabPoint
+from dao.lab_store import EPOCH, LabStore, to_microseconds
+from dao.lab_windows import HOUR, LabWindowPoint, RollingStats, rolling
+
+engines: dict[str, Engine] = {}
+stores: dict[Path, LabStore] = {}
+
+
+def get_engine(database: Engine | str) -> Engine:
+    """Get an engine, creating one per URL in this process."""
+    if isinstance(database, Engine):
+        return database
+    if database not in engines:
+        engines[database] = create_engine(
+            database, isolation_level="SERIALIZABLE"
+        )
+    return engines[database]
+
+
+def get_store(store: LabStore | Path | None) -> LabStore | None:
+    """Get a lab store, creating one per directory in this process."""
+    if store is None or isinstance(store, LabStore):
+        return store
+    if store not in stores:
+        stores[store] = LabStore(store)
+    return stores[store]
+
+
+class PackedSeries(NamedTuple):
+    """Lab points as arrays."""
+
+    datetimes: npt.NDArray[np.int64]  # microseconds since the epoch
+    values: npt.NDArray[np.float64]
+    units: npt.NDArray[np.int32]  # indexes into `unit_names`
+    unit_names: list[str]
+
+
+def pack_series(points: Sequence[LabPoint]) -> PackedSeries:
+    """Pack lab points into arrays."""
+    unit_names: dict[str, int] = {}
+    return PackedSeries(
+        np.fromiter(
+            (to_microseconds(point.datetime) for point in points),
+            np.int64,
+            len(points),
+        ),
+        np.fromiter(
+            (point.value for point in points), np.float64, len(points)
+        ),
+        np.fromiter(
+            (
+                unit_names.setdefault(point.units, len(unit_names))
+                for point in points
+            ),
+            np.int32,
+            len(points),
+        ),
+        list(unit_names),
+    )
+
+
+def unpack_series(packed: PackedSeries) -> list[LabPoint]:
+    """Unpack lab points from arrays."""
+    return [
+        LabPoint(
+            EPOCH + timedelta(microseconds=time),
+            value,
+            packed.unit_names[units],
+        )
+        for time, value, units in zip(
+            packed.datetimes.tolist(),
+            packed.values.tolist(),
+            packed.units.tolist(),
+            strict=True,
+        )
+    ]
+
+
+def aggregate(
+    database: Engine | str,
+    store: LabStore | Path | None,
+    name: str,
+    start: datetime | None,
+    end: datetime | None,
+    normalize: bool,
+) -> list[LabAggregate]:
+    """Summarize the values of a lab in [start, end), by units."""
+    engine = get_engine(database)
+    lab_store = get_store(store)
+    with Session(engine) as session:
+        if lab_store is None:
+            return list(
+                LabDao(engine)._aggregate(name, start, end, session, normalize)
+            )
+        lab_store.refresh(session)
+    return list(lab_store.aggregate(name, start, end, normalize))
+
+
+def series(
+    database: Engine | str,
+    store: LabStore | Path | None,
+    patient_id: str,
+    name: str,
+    normalize: bool,
+) -> PackedSeries:
+    """Get a patient's values of a lab, oldest first, packed."""
+    engine = get_engine(database)
+    lab_store = get_store(store)
+    with Session(engine) as session:
+        if lab_store is None:
+            return pack_series(
+                LabDao(engine)._series(patient_id, name, session, normalize)
+            )
+        lab_store.refresh(session)
+    return pack_series(lab_store.series(patient_id, name, normalize))
+
+
+def cohort(
+    database: Engine | str,
+    store: LabStore | Path | None,
+    name: str,
+    minimum: float | None,
+    maximum: float | None,
+    start: datetime | None,
+    end: datetime | None,
+    normalize: bool,
+) -> bytes:
+    """Get the ids of patients with a value of a lab in a range, packed.
+
+    Ids are packed one per line.
+    """
+    engine = get_engine(database)
+    lab_store = get_store(store)
+    with Session(engine) as session:
+        if lab_store is None:
+            patient_ids = LabDao(engine)._cohort(
+                name, minimum, maximum, start, end, session, normalize
+            )
+        else:
+            lab_store.refresh(session)
+            patient_ids = lab_store.cohort(
+                name, minimum, maximum, start, end, normalize
+            )
+    return "\n".join(patient_ids).encode()
+
+
+def unpack_cohort(packed: bytes) -> list[str]:
+    """Unpack patient ids."""
+    return packed.decode().split("\n") if packed else []
+
+
+class PackedWindows(NamedTuple):
+    """Lab points of many patients and the statistics of their windows."""
+
+    patient_ids: list[str]
+    patients: npt.NDArray[np.int32]  # indexes into `patient_ids`
+    series: PackedSeries
+    stats: RollingStats
+    threshold: float | None
+
+
+def windows(
+    database: Engine | str,
+    store: LabStore | Path | None,
+    patient_ids: Sequence[str],
+    name: str,
+    window: float,
+    threshold: float | None,
+    normalize: bool,
+) -> PackedWindows:
+    """Compute rolling statistics over patients' series of a lab.
+
+    The window is `window` hours long, and labs are flagged when their
+    value rose by `threshold` or more within it. Labs of a patient in
+    different units form separate series; pass `normalize` to combine them.
+    """
+    engine = get_engine(database)
+    lab_store = get_store(store)
+    with Session(engine) as session:
+        if lab_store is None:
+            points = LabDao(engine)._series_many(
+                patient_ids, name, session, normalize
+            )
+        else:
+            lab_store.refresh(session)
+            points = [
+                PatientLabPoint(patient_id, *point)
+                for patient_id in sorted(set(patient_ids))
+                for point in sorted(
+                    lab_store.series(patient_id, name, normalize),
+                    key=lambda point: point.units,
+                )
+            ]
+    packed = pack_series(
+        [
+            LabPoint(point.datetime, point.value, point.units)
+            for point in points
+        ]
+    )
+    codes: dict[str, int] = {}
+    patients = np.fromiter(
+        (codes.setdefault(point.patient_id, len(codes)) for point in points),
+        np.int32,
+        len(points),
+    )
+    # One series per patient and units.
+    groups = patients.astype(np.int64) * len(packed.unit_names) + packed.units
+    return PackedWindows(
+        list(codes),
+        patients,
+        packed,
+        rolling(packed.datetimes, packed.values, groups, round(window * HOUR)),
+        threshold,
+    )
+
+
+def unpack_windows(
+    packed: PackedWindows,
+) -> dict[str, list[LabWindowPoint]]:
+    """Unpack lab points and their windows' statistics, by patient."""
+    points = unpack_series(packed.series)
+    stats = [column.tolist() for column in packed.stats]
+    by_patient: dict[str, list[LabWindowPoint]] = {
+        patient_id: [] for patient_id in packed.patient_ids
+    }
+    for index, (patient, point) in enumerate(
+        zip(packed.patients.tolist(), points, strict=True)
+    ):
+        mean, minimum, maximum, delta, rise, slope = (
+            column[index] for column in stats
+        )
+        by_patient[packed.patient_ids[patient]].append(
+            LabWindowPoint(
+                *point,
+                mean,
+                minimum,
+                maximum,
+                delta,
+                rise,
+                None if slope != slope else slope,  # NaN
+                packed.threshold is not None and rise >= packed.threshold,
+            )
+        )
+    return by_patient
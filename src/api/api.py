@@ -1,19 +1,78 @@
 """HTTP API."""
 
-from collections.abc import AsyncIterator, Generator
+import asyncio
+import contextlib
+import hashlib
+import logging
+import os
+import threading
+import uuid
+from collections.abc import AsyncIterator, Callable, Generator
 from contextlib import asynccontextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, TypeVar
 
-from fastapi import Depends, FastAPI, HTTPException
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
 from sqlalchemy import Engine, create_engine
 from sqlalchemy.orm import Session, sessionmaker
 
 import database
-from api.models import InputLab, InputPatient, Lab, Patient
-from dao import NotFoundError
+from api import analytics
+from api.events import LabHub, OverflowPolicy, stream_events
+from api.executor import Executor, OverloadedError
+from api.exports import (
+    ByteRange,
+    Exporter,
+    ExportFilter,
+    ExportStatus,
+    ExportStore,
+    export_directory,
+    parse_range,
+    read_range,
+)
+from api.instrumentation import (
+    InstrumentationMiddleware,
+    Metrics,
+    TimedRoute,
+    install_query_hooks,
+    timed_stream,
+)
+from api.models import (
+    Admission,
+    Change,
+    ChangePage,
+    Export,
+    InputAdmission,
+    InputExport,
+    InputLab,
+    InputLabWindows,
+    InputPatient,
+    Lab,
+    LabAggregate,
+    LabName,
+    LabPoint,
+    LabWindowPoint,
+    Patient,
+)
+from api.profiling import ProfilingMiddleware, profile_path
+from api.rate_limits import RateLimiter, RateLimitMiddleware, RouteLimit
+from dao import ConflictError, NotFoundError
+from dao.admission_dao import AdmissionDao
+from dao.change_dao import ChangeDao
+from dao.idempotency_dao import IdempotencyDao, KeyCache
+from dao.lab_catalogue import LabCatalogueCache
 from dao.lab_dao import LabDao
+from dao.lab_name_dao import LabNameDao
+from dao.lab_store import LabStore
 from dao.models import (
     Gender as StorageGender,
 )
+from dao.models import (
+    Lab as StorageLab,
+)
 from dao.models import (
     Language as StorageLanguage,
 )
@@ -24,34 +83,242 @@ from dao.models import (
     Race as StorageRace,
 )
 from dao.patient_dao import PatientDao
+from dao.patient_filter import PatientFilter
+from database import SlowQueryLog
 
-database_path = "sqlite:///my_db.db"
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+database_path = database.database_url()
+# Log queries slower than this many milliseconds, if set.
+slow_query_ms = os.environ.get("EHR_API_SLOW_QUERY_MS")
+slow_query_log = (
+    SlowQueryLog(float(slow_query_ms) / 1000) if slow_query_ms else None
+)
+# Save profiles of requests with an X-Profile header here, if set.
+profile_directory = (
+    Path(os.environ["EHR_API_PROFILE_DIR"])
+    if "EHR_API_PROFILE_DIR" in os.environ
+    else None
+)
+# Answer analytical lab queries from a columnar snapshot here, if set.
+lab_store = (
+    LabStore(Path(os.environ["EHR_API_LAB_STORE_DIR"]))
+    if "EHR_API_LAB_STORE_DIR" in os.environ
+    else None
+)
+# Run analytics in this many worker processes, or in threads if 0.
+analytics_workers = int(os.environ.get("EHR_API_ANALYTICS_WORKERS", "0"))
+executor = Executor(
+    analytics_workers,
+    limits={"aggregate": 2, "cohort": 2, "series": 4, "windows": 2},
+)
+# Write export jobs and their output here.
+exporter = Exporter(ExportStore(export_directory()))
+# Delete expired export jobs this often, in seconds.
+export_purge_interval = 60 * 60
+# Answer lookups of unknown patients from a filter of patient ids, if set,
+# catching up with other writers at most this many seconds late.
+patient_filter = (
+    PatientFilter(
+        sync_interval=float(
+            os.environ.get("EHR_API_PATIENT_FILTER_SYNC_INTERVAL", "1")
+        )
+    )
+    if os.environ.get("EHR_API_PATIENT_FILTER")
+    else None
+)
+# Limit each client to this many request tokens per second, if set.
+rate_limit = os.environ.get("EHR_API_RATE_LIMIT")
+rate_limiter = (
+    RateLimiter(
+        float(rate_limit),
+        float(
+            os.environ.get("EHR_API_RATE_LIMIT_BURST", 10 * float(rate_limit))
+        ),
+        routes={
+            # Requests reading many rows take more tokens than single reads.
+            "GET /patients": RouteLimit(cost=20, client_concurrency=2),
+            "GET /patients/{patient_id}/labs": RouteLimit(cost=5),
+            "GET /patients/{patient_id}/admissions/{number}/labs": (
+                RouteLimit(cost=5)
+            ),
+            "POST /patients/{patient_id}/labs/bulk": RouteLimit(cost=10),
+            "GET /changes": RouteLimit(cost=10),
+            "GET /labs/aggregate": RouteLimit(cost=10, client_concurrency=2),
+            "GET /labs/cohort": RouteLimit(cost=10, client_concurrency=2),
+            "POST /labs/windows": RouteLimit(cost=20, client_concurrency=2),
+            "GET /labs/events": RouteLimit(client_concurrency=4),
+            # Jobs outlive their request, so the exporter caps them instead.
+            "POST /exports": RouteLimit(cost=50),
+            "GET /exports/{export_id}/data": RouteLimit(
+                cost=20, client_concurrency=2
+            ),
+            "GET /metrics": RouteLimit(cost=0),
+        },
+    )
+    if rate_limit
+    else None
+)
+# Addresses of proxies whose X-Client-Id headers identify their clients.
+trusted_proxies = [
+    address.strip()
+    for address in os.environ.get("EHR_API_TRUSTED_PROXIES", "").split(",")
+    if address.strip()
+]
+lab_hub = LabHub()
+idempotency_cache = KeyCache(max_size=10_000, ttl=24 * 60 * 60)
+# Delete expired idempotency records this often, in seconds.
+idempotency_purge_interval = 60 * 60
+# Recount the labs of each lab name this often, in seconds.
+lab_count_interval = 5 * 60
+lab_catalogue = LabCatalogueCache()
+metrics = Metrics()
+# Engines by process id: engines and their pools must not cross a fork.
+engines: dict[int, Engine] = {}
+engines_lock = threading.Lock()
+
+
+async def run_periodically(
+    function: Callable[[], object], interval: float
+) -> None:
+    """Run a maintenance task now and every `interval` seconds, in a thread."""
+    while True:
+        try:
+            await asyncio.to_thread(function)
+        except Exception:  # retried at the next interval
+            logger.exception("Could not run %s", function.__qualname__)
+        await asyncio.sleep(interval)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI) -> AsyncIterator[None]:
-    """Set up and tear down database."""
-    database.setup(database_path)
+    """Set up and tear down database.
+
+    Servers with several workers set up the schema, and fail the export jobs
+    a previous server left unfinished, once before starting them (see
+    `server.py`) rather than in each worker.
+    """
+    if database.SCHEMA_READY not in os.environ:
+        database.setup(database_path, slow_query_log).dispose()
+        exporter.store.fail_interrupted()
+    tasks = [
+        asyncio.create_task(run_periodically(function, interval))
+        for function, interval in [
+            (
+                IdempotencyDao(get_engine(), idempotency_cache).purge,
+                idempotency_purge_interval,
+            ),
+            (LabNameDao(get_engine()).refresh_counts, lab_count_interval),
+            (exporter.store.purge, export_purge_interval),
+        ]
+    ]
     yield
-    pass
+    for task in tasks:
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+    executor.shutdown()
+    exporter.shutdown()
+    with engines_lock:
+        engine = engines.pop(os.getpid(), None)
+    if engine is not None:
+        engine.dispose()
 
 
+install_query_hooks()
 app = FastAPI(lifespan=lifespan)
+app.router.route_class = TimedRoute
+if rate_limiter is not None:
+    # Inside instrumentation, so that refused requests are counted.
+    app.add_middleware(
+        RateLimitMiddleware,
+        limiter=rate_limiter,
+        trusted_proxies=trusted_proxies,
+    )
+app.add_middleware(InstrumentationMiddleware, metrics=metrics)
+if profile_directory is not None:
+    app.add_middleware(ProfilingMiddleware, directory=profile_directory)
 
 
 def get_engine() -> Engine:
-    """Generate database engine."""
-    return create_engine(database_path, isolation_level="SERIALIZABLE")
+    """Get this process's database engine, creating it on first use."""
+    with engines_lock:
+        engine = engines.get(os.getpid())
+        if engine is None:
+            engine = create_engine(
+                database_path, isolation_level="SERIALIZABLE"
+            )
+            if slow_query_log is not None:
+                slow_query_log.attach(engine)
+            engines[os.getpid()] = engine
+        return engine
+
+
+def get_patient_filter() -> PatientFilter | None:
+    """Get the filter of patient ids, if one is configured."""
+    return patient_filter
 
 
-def get_patient_dao(engine: Engine = Depends(get_engine)) -> PatientDao:
+def get_patient_dao(
+    engine: Engine = Depends(get_engine),
+    patient_filter: PatientFilter | None = Depends(get_patient_filter),
+) -> PatientDao:
     """Generate patient DAO."""
-    return PatientDao(engine)
+    return PatientDao(engine, patient_filter)
 
 
 def get_lab_dao(engine: Engine = Depends(get_engine)) -> LabDao:
     """Generate lab DAO."""
-    return LabDao(engine)
+    return LabDao(engine, lab_catalogue)
+
+
+def get_lab_name_dao(engine: Engine = Depends(get_engine)) -> LabNameDao:
+    """Generate lab name search DAO."""
+    return LabNameDao(engine)
+
+
+def get_admission_dao(engine: Engine = Depends(get_engine)) -> AdmissionDao:
+    """Generate admission DAO."""
+    return AdmissionDao(engine)
+
+
+def get_change_dao(engine: Engine = Depends(get_engine)) -> ChangeDao:
+    """Generate change log DAO."""
+    return ChangeDao(engine)
+
+
+def get_idempotency_dao(
+    engine: Engine = Depends(get_engine),
+) -> IdempotencyDao:
+    """Generate idempotency record DAO."""
+    return IdempotencyDao(engine, idempotency_cache)
+
+
+def get_lab_hub() -> LabHub:
+    """Get the hub that newly created labs are published to."""
+    return lab_hub
+
+
+def get_profile_directory() -> Path | None:
+    """Get the directory profiles are saved in, if profiling is enabled."""
+    return profile_directory
+
+
+def get_lab_store() -> LabStore | None:
+    """Get the columnar lab snapshot, if one is configured."""
+    return lab_store
+
+
+def get_executor() -> Executor:
+    """Get the executor of heavy operations."""
+    return executor
+
+
+def get_exporter() -> Exporter:
+    """Get the runner of export jobs."""
+    return exporter
 
 
 def get_session(
@@ -63,14 +330,96 @@ def get_session(
         yield session
 
 
+async def run_heavy(
+    executor: Executor,
+    operation: str,
+    function: Callable[..., T],
+    *args: Any,
+) -> T:
+    """Run a heavy operation in the executor, or fail with 503 if busy."""
+    try:
+        return await executor.run(operation, function, *args)
+    except OverloadedError as e:
+        raise HTTPException(
+            status_code=503, detail=str(e), headers={"Retry-After": "1"}
+        ) from e
+
+
+def fingerprint(body: InputPatient | InputLab) -> str:
+    """Digest a request body, to detect reuse of an idempotency key."""
+    return hashlib.sha256(body.json().encode()).hexdigest()
+
+
+# Detail of the 409 for a key reused with another body, however detected.
+KEY_REUSED = "Idempotency-Key was already used with a different body"
+
+
+def read_idempotent_response(
+    scope: str,
+    key: str | None,
+    body: InputPatient | InputLab,
+    idempotency_dao: IdempotencyDao,
+    session: Session,
+) -> str | None:
+    """Get the response recorded for an idempotency key, if any."""
+    if key is None:
+        return None
+    record = idempotency_dao._read(scope, key, session)
+    if record is None:
+        return None
+    if record.fingerprint != fingerprint(body):
+        raise HTTPException(status_code=409, detail=KEY_REUSED)
+    return record.response
+
+
+def commit_idempotent_response(
+    scope: str,
+    key: str | None,
+    body: InputPatient | InputLab,
+    response: BaseModel,
+    idempotency_dao: IdempotencyDao,
+    session: Session,
+) -> str | None:
+    """Commit a request's writes together with the record of its response.
+
+    Returns None once committed, or, if a concurrent request with the same
+    idempotency key committed first, its response in place of this one's
+    rolled back writes.
+    """
+    if key is not None:
+        try:
+            idempotency_dao._create(
+                scope, key, fingerprint(body), response.json(), session
+            )
+        except ConflictError as e:
+            record = idempotency_dao._read(scope, key, session)
+            if record is None or record.fingerprint != fingerprint(body):
+                raise HTTPException(status_code=409, detail=KEY_REUSED) from e
+            return record.response
+    session.commit()
+    return None
+
+
 @app.post("/patients")
 async def create_patient(
     patient: InputPatient,
+    idempotency_key: str | None = Header(None, alias="Idempotency-Key"),
     patient_dao: PatientDao = Depends(get_patient_dao),
+    idempotency_dao: IdempotencyDao = Depends(get_idempotency_dao),
     session: Session = Depends(get_session),
 ) -> Patient:
-    """Create a patient."""
-    return Patient.from_storage(
+    """Create a patient.
+
+    Retrying with the same `Idempotency-Key` header returns the original
+    response instead of creating another patient.
+    """
+    scope = "POST /patients"
+    response = read_idempotent_response(
+        scope, idempotency_key, patient, idempotency_dao, session
+    )
+    if response is not None:
+        return Patient.parse_raw(response)
+    created = Patient.from_storage(
         patient_dao._create(
             date_of_birth=patient.date_of_birth,
             gender=StorageGender(patient.gender),
@@ -80,32 +429,112 @@ async def create_patient(
             session=session,
         )
     )
+    response = commit_idempotent_response(
+        scope, idempotency_key, patient, created, idempotency_dao, session
+    )
+    if response is not None:
+        return Patient.parse_raw(response)
+    return created
 
 
 @app.post("/patients/{patient_id}/labs")
 async def create_lab(
     patient_id: str,
     lab: InputLab,
+    upsert: bool = False,
+    idempotency_key: str | None = Header(None, alias="Idempotency-Key"),
     patient_dao: PatientDao = Depends(get_patient_dao),
     lab_dao: LabDao = Depends(get_lab_dao),
+    idempotency_dao: IdempotencyDao = Depends(get_idempotency_dao),
+    hub: LabHub = Depends(get_lab_hub),
     session: Session = Depends(get_session),
 ) -> Lab:
-    """Create a lab."""
+    """Create a lab.
+
+    A lab with the same patient, admission, datetime and name as an
+    existing one is rejected with 409, or updates it if `upsert` is set.
+    Retrying with the same `Idempotency-Key` header returns the original
+    response instead of creating another lab.
+    """
+    scope = f"POST /patients/{patient_id}/labs"
+    response = read_idempotent_response(
+        scope, idempotency_key, lab, idempotency_dao, session
+    )
+    if response is not None:
+        return Lab.parse_raw(response)
     try:
-        storage_patient = patient_dao._read(patient_id, session)
+        patient_dao._check(patient_id, session)
     except NotFoundError as e:
         raise HTTPException(status_code=404, detail=str(e)) from e
-    storage_lab = lab_dao._create(
-        patient_id=patient_id,
-        admission_number=lab.admission_number,
-        datetime=lab.datetime,
-        name=lab.name,
-        value=lab.value,
-        units=lab.units,
-        session=session,
+    lab_id = str(uuid.uuid4())
+    try:
+        storage_lab = lab_dao._create(
+            patient_id=patient_id,
+            admission_number=lab.admission_number,
+            datetime=lab.datetime,
+            name=lab.name,
+            value=lab.value,
+            units=lab.units,
+            session=session,
+            upsert=upsert,
+            lab_id=lab_id,
+        )
+    except ConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e)) from e
+    created = Lab.from_storage(storage_lab)
+    response = commit_idempotent_response(
+        scope, idempotency_key, lab, created, idempotency_dao, session
     )
-    storage_patient.labs.append(storage_lab)
-    return Lab.from_storage(storage_lab)
+    if response is not None:
+        return Lab.parse_raw(response)
+    # Labs that `upsert` updated are not new.
+    if created.id == lab_id:
+        hub.publish(created)
+    return created
+
+
+@app.post("/patients/{patient_id}/labs/bulk")
+async def create_labs(
+    patient_id: str,
+    labs: list[InputLab],
+    upsert: bool = False,
+    patient_dao: PatientDao = Depends(get_patient_dao),
+    lab_dao: LabDao = Depends(get_lab_dao),
+    hub: LabHub = Depends(get_lab_hub),
+    session: Session = Depends(get_session),
+) -> list[Lab]:
+    """Create many labs for a patient in one statement.
+
+    Natural-key conflicts are handled as in `create_lab`, all or nothing.
+    """
+    try:
+        patient_dao._check(patient_id, session)
+    except NotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e)) from e
+    new_labs = [
+        StorageLab(
+            id=str(uuid.uuid4()),
+            patient_id=patient_id,
+            admission_number=lab.admission_number,
+            datetime=lab.datetime,
+            name=lab.name,
+            value=lab.value,
+            units=lab.units,
+        )
+        for lab in labs
+    ]
+    try:
+        storage_labs = lab_dao._create_many(new_labs, session, upsert)
+    except ConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e)) from e
+    session.commit()
+    created = [Lab.from_storage(lab) for lab in storage_labs]
+    # Labs that `upsert` updated keep their ids, and are not new.
+    lab_ids = {lab.id for lab in new_labs}
+    for lab in created:
+        if lab.id in lab_ids:
+            hub.publish(lab)
+    return created
 
 
 @app.get("/patients")
@@ -127,39 +556,374 @@ async def read_patient(
     session: Session = Depends(get_session),
 ) -> Patient:
     """Get a patient by id."""
-    print(f"Is verbose: {verbose}")
     try:
         return Patient.from_storage(patient_dao._read(patient_id, session))
     except NotFoundError as e:
         raise HTTPException(status_code=404, detail=str(e)) from e
 
 
-@app.get("/patients/{patient_id}/labs")
+@app.delete("/patients/{patient_id}", status_code=204)
+async def delete_patient(
+    patient_id: str,
+    patient_dao: PatientDao = Depends(get_patient_dao),
+    session: Session = Depends(get_session),
+) -> None:
+    """Delete a patient and their labs."""
+    try:
+        patient_dao._delete(patient_id, session)
+    except NotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e)) from e
+    session.commit()
+
+
+@app.get("/patients/{patient_id}/labs", response_model=list[Lab])
 async def list_labs(
     patient_id: str,
+    normalize: bool = False,
     patient_dao: PatientDao = Depends(get_patient_dao),
+    lab_dao: LabDao = Depends(get_lab_dao),
     session: Session = Depends(get_session),
-) -> list[Lab]:
-    """List patients."""
+) -> Response:
+    """List a patient's labs, oldest first.
+
+    With `normalize`, values are converted to each lab's normalized units.
+    """
+    try:
+        patient_dao._check(patient_id, session)
+    except NotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e)) from e
+    return StreamingResponse(
+        timed_stream(
+            Lab.json_from_storage_batch(
+                lab_dao._batch(patient_id, None, session), normalize
+            )
+        ),
+        media_type="application/json",
+    )
+
+
+@app.get("/patients/{patient_id}/labs/series")
+async def read_lab_series(
+    patient_id: str,
+    name: str,
+    normalize: bool = False,
+    engine: Engine = Depends(get_engine),
+    patient_dao: PatientDao = Depends(get_patient_dao),
+    store: LabStore | None = Depends(get_lab_store),
+    executor: Executor = Depends(get_executor),
+    session: Session = Depends(get_session),
+) -> list[LabPoint]:
+    """Get a patient's values of a lab, oldest first.
+
+    With `normalize`, values are converted to the lab's normalized units.
+    """
     try:
-        return [
-            Lab.from_storage(lab)
-            for lab in patient_dao._read(patient_id, session).labs
+        patient_dao._check(patient_id, session)
+    except NotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e)) from e
+    packed = await run_heavy(
+        executor,
+        "series",
+        analytics.series,
+        engine,
+        store,
+        patient_id,
+        name,
+        normalize,
+    )
+    return [
+        LabPoint.from_storage(point)
+        for point in analytics.unpack_series(packed)
+    ]
+
+
+@app.get("/patients/{patient_id}/labs/windows")
+async def read_lab_windows(
+    patient_id: str,
+    name: str,
+    window: float = Query(24.0, gt=0),
+    threshold: float | None = None,
+    normalize: bool = False,
+    engine: Engine = Depends(get_engine),
+    patient_dao: PatientDao = Depends(get_patient_dao),
+    store: LabStore | None = Depends(get_lab_store),
+    executor: Executor = Depends(get_executor),
+    session: Session = Depends(get_session),
+) -> list[LabWindowPoint]:
+    """Get a patient's values of a lab with rolling statistics, oldest first.
+
+    Each lab's window is the labs of the same units taken in the `window`
+    hours up to it. Labs whose value rose by `threshold` or more within
+    their window are flagged. With `normalize`, labs taken in different
+    units are converted to normalized units and form one series.
+    """
+    try:
+        patient_dao._check(patient_id, session)
+    except NotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e)) from e
+    packed = await run_heavy(
+        executor,
+        "windows",
+        analytics.windows,
+        engine,
+        store,
+        [patient_id],
+        name,
+        window,
+        threshold,
+        normalize,
+    )
+    return [
+        LabWindowPoint.from_storage(point)
+        for point in analytics.unpack_windows(packed).get(patient_id, [])
+    ]
+
+
+@app.post("/labs/windows")
+async def compute_lab_windows(
+    body: InputLabWindows,
+    engine: Engine = Depends(get_engine),
+    store: LabStore | None = Depends(get_lab_store),
+    executor: Executor = Depends(get_executor),
+) -> dict[str, list[LabWindowPoint]]:
+    """Get many patients' values of a lab with rolling statistics.
+
+    As `GET /patients/{id}/labs/windows`, by patient id; patients without
+    labs of the name, or that do not exist, have none.
+    """
+    packed = await run_heavy(
+        executor,
+        "windows",
+        analytics.windows,
+        engine,
+        store,
+        body.patient_ids,
+        body.name,
+        body.window,
+        body.threshold,
+        body.normalize,
+    )
+    by_patient = analytics.unpack_windows(packed)
+    return {
+        patient_id: [
+            LabWindowPoint.from_storage(point)
+            for point in by_patient.get(patient_id, [])
         ]
+        for patient_id in body.patient_ids
+    }
+
+
+@app.get("/labs/aggregate")
+async def aggregate_labs(
+    name: str,
+    start: datetime | None = None,
+    end: datetime | None = None,
+    normalize: bool = False,
+    engine: Engine = Depends(get_engine),
+    store: LabStore | None = Depends(get_lab_store),
+    executor: Executor = Depends(get_executor),
+) -> list[LabAggregate]:
+    """Summarize the values of a lab taken in [start, end), by units.
+
+    With `normalize`, values are converted to the lab's normalized units
+    first, so that labs taken in different units are summarized together.
+    """
+    aggregates = await run_heavy(
+        executor,
+        "aggregate",
+        analytics.aggregate,
+        engine,
+        store,
+        name,
+        start,
+        end,
+        normalize,
+    )
+    return [LabAggregate.from_storage(aggregate) for aggregate in aggregates]
+
+
+@app.get("/labs/cohort")
+async def find_cohort(
+    name: str,
+    minimum: float | None = None,
+    maximum: float | None = None,
+    start: datetime | None = None,
+    end: datetime | None = None,
+    normalize: bool = False,
+    engine: Engine = Depends(get_engine),
+    store: LabStore | None = Depends(get_lab_store),
+    executor: Executor = Depends(get_executor),
+) -> list[str]:
+    """Get the ids of patients with a value of a lab in a range.
+
+    The range is inclusive, and only labs taken in [start, end) count. With
+    `normalize`, the range is in the lab's normalized units, and labs taken
+    in any units are compared with it.
+    """
+    packed = await run_heavy(
+        executor,
+        "cohort",
+        analytics.cohort,
+        engine,
+        store,
+        name,
+        minimum,
+        maximum,
+        start,
+        end,
+        normalize,
+    )
+    return analytics.unpack_cohort(packed)
+
+
+@app.get("/labs/names")
+async def search_lab_names(
+    q: str = Query(min_length=2),
+    limit: int = Query(10, ge=1, le=100),
+    lab_name_dao: LabNameDao = Depends(get_lab_name_dao),
+    session: Session = Depends(get_session),
+) -> list[LabName]:
+    """Get the lab names with a word starting with each word of `q`.
+
+    Names with the most labs come first, each with its labs by units.
+    """
+    names = lab_name_dao._search(q, limit, session)
+    return [LabName.from_storage(name) for name in names]
+
+
+@app.get("/labs/events")
+async def stream_labs(
+    patient_id: str | None = None,
+    name: str | None = None,
+    buffer_size: int = Query(100, ge=1, le=10000),
+    policy: OverflowPolicy = OverflowPolicy.drop_oldest,
+    hub: LabHub = Depends(get_lab_hub),
+) -> StreamingResponse:
+    """Stream newly created labs as server-sent events.
+
+    Each subscriber has a bounded buffer; when a slow consumer lets it fill
+    up, `policy` decides whether the oldest or newest lab is dropped or the
+    stream is ended with an `overflow` event.
+    """
+    subscription = hub.subscribe(patient_id, name, buffer_size, policy)
+    return StreamingResponse(
+        stream_events(hub, subscription),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+@app.get("/patients/{patient_id}/admissions")
+async def list_admissions(
+    patient_id: str,
+    patient_dao: PatientDao = Depends(get_patient_dao),
+    admission_dao: AdmissionDao = Depends(get_admission_dao),
+    session: Session = Depends(get_session),
+) -> list[Admission]:
+    """List a patient's admissions."""
+    try:
+        patient_dao._check(patient_id, session)
+    except NotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e)) from e
+    return [
+        Admission.from_storage(admission)
+        for admission in admission_dao._list(patient_id, session)
+    ]
+
+
+@app.get("/patients/{patient_id}/admissions/{number}")
+async def read_admission(
+    patient_id: str,
+    number: int,
+    admission_dao: AdmissionDao = Depends(get_admission_dao),
+    session: Session = Depends(get_session),
+) -> Admission:
+    """Get an admission."""
+    try:
+        admission = admission_dao._read(patient_id, number, session)
+    except NotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e)) from e
+    return Admission.from_storage(admission)
+
+
+@app.put("/patients/{patient_id}/admissions/{number}")
+async def update_admission(
+    patient_id: str,
+    number: int,
+    body: InputAdmission,
+    patient_dao: PatientDao = Depends(get_patient_dao),
+    admission_dao: AdmissionDao = Depends(get_admission_dao),
+    session: Session = Depends(get_session),
+) -> Admission:
+    """Supply an admission's start and end, creating it if needed.
+
+    Either may be left out, in which case the admission's first or last lab
+    stands in for it; fails with 422 if the admission would then end before
+    it starts.
+    """
+    try:
+        patient_dao._check(patient_id, session)
     except NotFoundError as e:
         raise HTTPException(status_code=404, detail=str(e)) from e
+    admission = Admission.from_storage(
+        admission_dao._update(
+            patient_id, number, body.start, body.end, session
+        )
+    )
+    if (
+        admission.start is not None
+        and admission.end is not None
+        and admission.start > admission.end
+    ):
+        session.rollback()
+        raise HTTPException(
+            status_code=422, detail="An admission cannot end before it starts"
+        )
+    session.commit()
+    return admission
+
+
+@app.get(
+    "/patients/{patient_id}/admissions/{number}/labs",
+    response_model=list[Lab],
+)
+async def list_admission_labs(
+    patient_id: str,
+    number: int,
+    normalize: bool = False,
+    admission_dao: AdmissionDao = Depends(get_admission_dao),
+    lab_dao: LabDao = Depends(get_lab_dao),
+    session: Session = Depends(get_session),
+) -> Response:
+    """List the labs of an admission, oldest first."""
+    try:
+        admission_dao._read(patient_id, number, session)
+    except NotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e)) from e
+    return StreamingResponse(
+        timed_stream(
+            Lab.json_from_storage_batch(
+                lab_dao._batch(patient_id, number, session), normalize
+            )
+        ),
+        media_type="application/json",
+    )
 
 
 @app.get("/patients/{patient_id}/labs/{lab_id}")
 async def read_lab(
     patient_id: str,
     lab_id: str,
+    normalize: bool = False,
     lab_dao: LabDao = Depends(get_lab_dao),
     session: Session = Depends(get_session),
 ) -> Lab:
-    """Get a lab by id."""
+    """Get a lab by id.
+
+    With `normalize`, its value is converted to the lab's normalized units.
+    """
     try:
-        lab = Lab.from_storage(lab_dao._read(lab_id, session))
+        lab = Lab.from_storage(lab_dao._read(lab_id, session), normalize)
     except NotFoundError as e:
         raise HTTPException(status_code=404, detail=str(e)) from e
     if lab.patient_id != patient_id:
@@ -167,3 +931,143 @@ async def read_lab(
             status_code=404, detail="Such a lab does not exist"
         )
     return lab
+
+
+@app.post("/exports", status_code=202)
+async def create_export(
+    body: InputExport,
+    response: Response,
+    engine: Engine = Depends(get_engine),
+    exporter: Exporter = Depends(get_exporter),
+) -> Export:
+    """Start exporting labs in the background.
+
+    Poll the returned job's `Location` until it is done, then download the
+    labs from its `/data`. Fails with 503 if too many jobs are queued.
+    """
+    try:
+        job = exporter.start(
+            engine,
+            ExportFilter(body.name, body.start, body.end, body.normalize),
+        )
+    except OverloadedError as e:
+        raise HTTPException(
+            status_code=503, detail=str(e), headers={"Retry-After": "1"}
+        ) from e
+    response.headers["Location"] = f"/exports/{job.id}"
+    return Export.from_storage(job)
+
+
+@app.get("/exports/{export_id}")
+async def read_export(
+    export_id: str, exporter: Exporter = Depends(get_exporter)
+) -> Export:
+    """Get an export job and its progress."""
+    job = exporter.store.read(export_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="No such export")
+    return Export.from_storage(job)
+
+
+@app.get("/exports/{export_id}/data")
+async def read_export_data(
+    export_id: str,
+    range_header: str | None = Header(None, alias="Range"),
+    if_range: str | None = Header(None),
+    exporter: Exporter = Depends(get_exporter),
+) -> Response:
+    """Download the labs of a finished export, as tab-delimited text.
+
+    A `Range` header fetches part of the file, to resume an interrupted
+    download. The file never changes once written, so its ETag is the id.
+    """
+    job = exporter.store.read(export_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="No such export")
+    if job.status != ExportStatus.done:
+        raise HTTPException(
+            status_code=409, detail=f"Export is {job.status.value}"
+        )
+    path = exporter.store.output_path(job.id)
+    size = path.stat().st_size
+    headers = {"Accept-Ranges": "bytes", "ETag": f'"{job.id}"'}
+    try:
+        byte_range = (
+            parse_range(range_header, size)
+            if range_header is not None and if_range in (None, headers["ETag"])
+            else None
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=416,
+            detail=str(e),
+            headers={"Content-Range": f"bytes */{size}"},
+        ) from e
+    status_code = 200
+    if byte_range is None:
+        byte_range = ByteRange(0, size - 1)
+    else:
+        status_code = 206
+        headers["Content-Range"] = (
+            f"bytes {byte_range.first}-{byte_range.last}/{size}"
+        )
+    headers["Content-Length"] = str(byte_range.last - byte_range.first + 1)
+    return StreamingResponse(
+        read_range(path, byte_range),
+        status_code=status_code,
+        media_type="text/tab-separated-values",
+        headers=headers,
+    )
+
+
+@app.get("/changes")
+async def list_changes(
+    since: int = Query(0, ge=0),
+    limit: int = Query(1000, ge=1, le=10000),
+    change_dao: ChangeDao = Depends(get_change_dao),
+    session: Session = Depends(get_session),
+) -> ChangePage:
+    """List changes after a sequence number, oldest first.
+
+    Passing `next_since` back is only sure to miss no changes on SQLite
+    (see `dao.models.Change`).
+    """
+    changes = [
+        Change.from_storage(change)
+        for change in change_dao._list(since, limit, session)
+    ]
+    return ChangePage(
+        changes=changes,
+        next_since=changes[-1].seq if changes else since,
+        has_more=len(changes) == limit,
+    )
+
+
+@app.get("/metrics")
+async def read_metrics(
+    patient_filter: PatientFilter | None = Depends(get_patient_filter),
+) -> PlainTextResponse:
+    """Get request metrics in the Prometheus text format."""
+    text = metrics.render()
+    if patient_filter is not None:
+        text += patient_filter.render()
+    if rate_limiter is not None:
+        text += rate_limiter.render()
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
+
+@app.get("/profiles/{profile_id}")
+async def read_profile(
+    profile_id: str,
+    directory: Path | None = Depends(get_profile_directory),
+) -> PlainTextResponse:
+    """Get a saved request profile, as folded stacks for flame graphs."""
+    try:
+        path = (
+            None if directory is None else profile_path(directory, profile_id)
+        )
+    except ValueError:
+        path = None
+    if path is None or not path.exists():
+        raise HTTPException(status_code=404, detail="No such profile")
+    return PlainTextResponse(path.read_text())
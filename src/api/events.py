@@ -0,0 +1,141 @@
+"""In-process publish/subscribe hub for newly created labs."""
+
+import asyncio
+import enum
+import threading
+from collections.abc import AsyncIterator
+
+from api.models import Lab
+
+
+class OverflowPolicy(enum.StrEnum):
+    """What to do when a subscriber's buffer is full."""
+
+    drop_oldest = "drop_oldest"
+    drop_newest = "drop_newest"
+    disconnect = "disconnect"
+
+
+class Subscription:
+    """Bounded buffer of labs for one subscriber."""
+
+    def __init__(
+        self,
+        patient_id: str | None,
+        name: str | None,
+        buffer_size: int,
+        policy: OverflowPolicy,
+    ) -> None:
+        """Initialize. Must be called from the subscriber's event loop."""
+        self.patient_id = patient_id
+        self.name = name
+        self.policy = policy
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue[Lab] = asyncio.Queue(maxsize=buffer_size)
+        self.dropped = 0
+        self.overflowed = False
+
+    def matches(self, lab: Lab) -> bool:
+        """Check whether the subscriber wants a lab."""
+        return (
+            self.patient_id is None or lab.patient_id == self.patient_id
+        ) and (self.name is None or lab.name == self.name)
+
+    def offer(self, lab: Lab) -> None:
+        """Buffer a lab, applying the overflow policy if the buffer is full.
+
+        Must be called from the subscriber's event loop.
+        """
+        if self.overflowed:
+            return
+        if self.queue.full():
+            self.dropped += 1
+            if self.policy == OverflowPolicy.drop_newest:
+                return
+            if self.policy == OverflowPolicy.disconnect:
+                self.overflowed = True
+                return
+            self.queue.get_nowait()
+        self.queue.put_nowait(lab)
+
+    async def get(self) -> Lab | None:
+        """Wait for the next lab, or None once disconnected for overflow."""
+        if self.overflowed:
+            return None
+        return await self.queue.get()
+
+
+class LabHub:
+    """Fan newly created labs out to subscribers."""
+
+    def __init__(self) -> None:
+        """Initialize."""
+        self.subscriptions: set[Subscription] = set()
+        self.lock = threading.Lock()
+
+    def subscribe(
+        self,
+        patient_id: str | None = None,
+        name: str | None = None,
+        buffer_size: int = 100,
+        policy: OverflowPolicy = OverflowPolicy.drop_oldest,
+    ) -> Subscription:
+        """Subscribe to labs, optionally filtered by patient and name."""
+        subscription = Subscription(patient_id, name, buffer_size, policy)
+        with self.lock:
+            self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """Stop delivering labs to a subscriber."""
+        with self.lock:
+            self.subscriptions.discard(subscription)
+
+    def publish(self, lab: Lab) -> None:
+        """Deliver a lab to matching subscribers without blocking.
+
+        Safe to call from any thread; delivery to subscribers on other event
+        loops is scheduled onto those loops.
+        """
+        try:
+            running_loop: asyncio.AbstractEventLoop | None = (
+                asyncio.get_running_loop()
+            )
+        except RuntimeError:
+            running_loop = None
+        with self.lock:
+            subscriptions = list(self.subscriptions)
+        for subscription in subscriptions:
+            if not subscription.matches(lab):
+                continue
+            if subscription.loop is running_loop:
+                subscription.offer(lab)
+                continue
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.offer, lab)
+            except RuntimeError:  # subscriber's event loop has shut down
+                self.unsubscribe(subscription)
+
+
+async def stream_events(
+    hub: LabHub,
+    subscription: Subscription,
+    keepalive: float = 15.0,
+) -> AsyncIterator[str]:
+    """Format a subscription as a server-sent events stream."""
+    try:
+        while True:
+            try:
+                lab = await asyncio.wait_for(subscription.get(), keepalive)
+            except TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if lab is None:
+                yield (
+                    "event: overflow\n"
+                    f'data: {{"dropped": {subscription.dropped}}}\n\n'
+                )
+                return
+            yield f"id: {lab.id}\nevent: lab\ndata: {lab.json()}\n\n"
+    finally:
+        hub.unsubscribe(subscription)
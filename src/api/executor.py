@@ -0,0 +1,128 @@
+"""Run heavy operations off the event loop, with limits per operation."""
+
+import asyncio
+import functools
+import threading
+from collections.abc import Callable, Mapping
+from concurrent.futures import Executor as PoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, TypeVar
+
+from sqlalchemy import Engine
+
+from dao.lab_store import LabStore
+
+T = TypeVar("T")
+
+
+class OverloadedError(Exception):
+    """Too many requests are already waiting for an operation."""
+
+
+class Limiter:
+    """Concurrency limit and bounded queue of one operation."""
+
+    def __init__(self, limit: int, queue_size: int) -> None:
+        """Initialize. Must be called from the event loop it is used on."""
+        self.semaphore = asyncio.Semaphore(limit)
+        self.queue_size = queue_size
+        self.waiting = 0
+
+
+class Executor:
+    """Run heavy operations in a bounded pool of worker processes.
+
+    At most `limits[operation]` runs of each operation execute at once, and
+    at most `queue_size` more wait for a turn; further requests are refused
+    with OverloadedError. With no worker processes, operations run in
+    threads instead, which keeps them off the event loop but not out of
+    the GIL.
+
+    Worker processes cannot share engines or lab stores, so arguments of
+    those types are passed as database URLs and store directories; the
+    operations accept either.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        limits: Mapping[str, int],
+        queue_size: int = 16,
+    ) -> None:
+        """Initialize."""
+        self.workers = workers
+        self.limits = limits
+        self.queue_size = queue_size
+        self.pool: PoolExecutor | None = None
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.limiters: dict[str, Limiter] = {}
+        self.lock = threading.Lock()
+
+    def get_pool(self) -> PoolExecutor:
+        """Get the pool, starting it on first use."""
+        with self.lock:
+            if self.pool is None and self.workers:
+                # Imported here, to keep multiprocessing out of startup.
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+
+                self.pool = ProcessPoolExecutor(
+                    self.workers,
+                    # Forking a threaded server can copy held locks.
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            elif self.pool is None:
+                self.pool = ThreadPoolExecutor(sum(self.limits.values()))
+            return self.pool
+
+    def shutdown(self) -> None:
+        """Stop the pool, waiting for running operations."""
+        with self.lock:
+            if self.pool is not None:
+                self.pool.shutdown()
+                self.pool = None
+
+    def limiter(self, operation: str) -> Limiter:
+        """Get the limiter of an operation on the running event loop."""
+        loop = asyncio.get_running_loop()
+        if loop is not self.loop:
+            self.loop = loop
+            self.limiters = {}
+        if operation not in self.limiters:
+            self.limiters[operation] = Limiter(
+                self.limits[operation], self.queue_size
+            )
+        return self.limiters[operation]
+
+    def portable(self, argument: Any) -> Any:
+        """Convert an argument to a form worker processes can receive."""
+        if not self.workers:
+            return argument
+        if isinstance(argument, Engine):
+            return argument.url.render_as_string(hide_password=False)
+        if isinstance(argument, LabStore):
+            return argument.directory
+        return argument
+
+    async def run(
+        self, operation: str, function: Callable[..., T], *args: Any
+    ) -> T:
+        """Run an operation in the pool, once it is its turn."""
+        limiter = self.limiter(operation)
+        if (
+            limiter.semaphore.locked()
+            and limiter.waiting >= limiter.queue_size
+        ):
+            raise OverloadedError(f"Too many {operation} requests")
+        limiter.waiting += 1
+        try:
+            await limiter.semaphore.acquire()
+        finally:
+            limiter.waiting -= 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.get_pool(),
+                functools.partial(function, *map(self.portable, args)),
+            )
+        finally:
+            limiter.semaphore.release()
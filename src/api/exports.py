@@ -0,0 +1,314 @@
+"""Background export jobs, written to files in a local directory.
+
+Each job has a directory holding its state, `job.json`, and its output,
+`labs.tsv`, a tab-delimited file in the format `loader.py` reads, with
+tabs, line breaks and backslashes in lab names and units escaped. Jobs run
+in a background thread, a chunk of labs per transaction, and record their
+progress after each chunk. Finished jobs are removed once they expire.
+"""
+
+import enum
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import NamedTuple
+
+from sqlalchemy import Engine
+
+from api.executor import OverloadedError
+from dao.lab_dao import LabDao
+
+RANGE_PATTERN = re.compile(r"bytes=(\d*)-(\d*)")
+
+
+def export_directory() -> Path:
+    """Get the directory of export jobs, from `EHR_API_EXPORT_DIR`."""
+    return Path(os.environ.get("EHR_API_EXPORT_DIR", "exports"))
+
+
+class ExportStatus(enum.StrEnum):
+    """State of an export job."""
+
+    pending = "pending"
+    running = "running"
+    done = "done"
+    failed = "failed"
+
+
+class ExportFilter(NamedTuple):
+    """Labs to export."""
+
+    name: str | None = None
+    start: datetime | None = None
+    end: datetime | None = None
+    normalize: bool = False
+
+
+class ExportJob(NamedTuple):
+    """Export job and its progress."""
+
+    id: str
+    status: ExportStatus
+    rows: int  # exported so far
+    total: int | None  # to export, once counted
+    error: str | None = None
+
+
+class ExportStore:
+    """Export jobs and their output, kept in a directory.
+
+    Jobs are kept for `ttl` seconds after they finish.
+    """
+
+    def __init__(self, directory: Path, ttl: float = 24 * 60 * 60) -> None:
+        """Initialize."""
+        self.directory = directory
+        self.ttl = ttl
+
+    def job_directory(self, job_id: str) -> Path:
+        """Get a job's directory, rejecting ids that are not UUIDs."""
+        return self.directory / str(uuid.UUID(job_id))
+
+    def output_path(self, job_id: str) -> Path:
+        """Get the path of a job's output."""
+        return self.job_directory(job_id) / "labs.tsv"
+
+    def create(self) -> ExportJob:
+        """Create a pending job."""
+        job = ExportJob(str(uuid.uuid4()), ExportStatus.pending, 0, None)
+        self.job_directory(job.id).mkdir(parents=True)
+        self.write(job)
+        return job
+
+    def read(self, job_id: str) -> ExportJob | None:
+        """Get a job, or None if there is no such job."""
+        try:
+            state = json.loads(
+                (self.job_directory(job_id) / "job.json").read_text()
+            )
+        except (ValueError, FileNotFoundError):
+            return None
+        return ExportJob(**{**state, "status": ExportStatus(state["status"])})
+
+    def write(self, job: ExportJob) -> None:
+        """Save a job's state, replacing the previous state atomically."""
+        path = self.job_directory(job.id) / "job.json"
+        temporary = path.with_suffix(".tmp")
+        temporary.write_text(json.dumps(job._asdict()))
+        os.replace(temporary, path)
+
+    def jobs(self) -> Iterator[ExportJob]:
+        """Get every job."""
+        if not self.directory.is_dir():
+            return
+        for path in self.directory.iterdir():
+            job = self.read(path.name)
+            if job is not None:
+                yield job
+
+    def purge(self) -> int:
+        """Delete jobs that finished over `ttl` seconds ago, and their output.
+
+        A job's state is last written as it finishes, so that is when it
+        finished. Returns how many were deleted.
+        """
+        expired = time.time() - self.ttl
+        purged = 0
+        for job in self.jobs():
+            directory = self.job_directory(job.id)
+            if (
+                job.status in (ExportStatus.done, ExportStatus.failed)
+                and (directory / "job.json").stat().st_mtime < expired
+            ):
+                # Other processes may be deleting it too.
+                shutil.rmtree(directory, ignore_errors=True)
+                purged += 1
+        return purged
+
+    def fail_interrupted(self) -> int:
+        """Mark jobs left pending or running by a stopped server as failed.
+
+        Only to be called before any job is started, as running jobs are
+        indistinguishable from interrupted ones. Returns how many there were.
+        """
+        interrupted = 0
+        for job in self.jobs():
+            if job.status in (ExportStatus.pending, ExportStatus.running):
+                self.output_path(job.id).with_suffix(".part").unlink(
+                    missing_ok=True
+                )
+                self.write(
+                    job._replace(
+                        status=ExportStatus.failed,
+                        error="Interrupted by a server restart",
+                    )
+                )
+                interrupted += 1
+        return interrupted
+
+
+def export_labs(
+    engine: Engine,
+    store: ExportStore,
+    job: ExportJob,
+    export_filter: ExportFilter,
+    chunk_size: int,
+) -> ExportJob:
+    """Run an export job, returning it once done or failed.
+
+    The output is written to a temporary file and renamed when complete, so
+    it is never served half-written. Each chunk is read in its own
+    transaction, which keeps them short but means labs changed while the job
+    runs may or may not be included.
+    """
+    # The loader, with its process pool, is only imported if exporting.
+    from loader import LAB_COLUMNS, escape
+
+    lab_dao = LabDao(engine)
+    name, start, end, normalize = export_filter
+    output = store.output_path(job.id)
+    temporary = output.with_suffix(".part")
+    try:
+        with lab_dao.Session.begin() as session:
+            total = lab_dao._count(name, start, end, session)
+        job = job._replace(status=ExportStatus.running, total=total)
+        store.write(job)
+        with temporary.open("w", encoding="utf-8", newline="") as file:
+            file.write("\t".join(LAB_COLUMNS.values()) + "\n")
+            after = None
+            while True:
+                labs = lab_dao.page(after, chunk_size, name, start, end)
+                file.writelines(
+                    "\t".join(
+                        (
+                            lab.patient_id,
+                            str(lab.admission_number),
+                            escape(lab.name),
+                            str(lab.value),
+                            escape(lab.units),
+                            lab.datetime.isoformat(sep=" "),
+                        )
+                    )
+                    + "\n"
+                    for lab in labs.records(normalize)
+                )
+                job = job._replace(rows=job.rows + len(labs))
+                store.write(job)
+                if len(labs) < chunk_size:
+                    break
+                after = labs.ids[-1]
+        os.replace(temporary, output)
+        job = job._replace(status=ExportStatus.done, total=job.rows)
+    except Exception as e:
+        job = job._replace(status=ExportStatus.failed, error=str(e))
+    store.write(job)
+    return job
+
+
+class Exporter:
+    """Run export jobs in background threads.
+
+    At most `workers` jobs run at once, and at most `queue_size` more wait
+    for a turn; further jobs are refused with OverloadedError.
+    """
+
+    def __init__(
+        self,
+        store: ExportStore,
+        workers: int = 2,
+        chunk_size: int = 10_000,
+        queue_size: int = 8,
+    ) -> None:
+        """Initialize."""
+        self.store = store
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.pool: ThreadPoolExecutor | None = None
+        self.lock = threading.Lock()
+        # Held by each job from its creation until it is done or failed.
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+
+    def start(self, engine: Engine, export_filter: ExportFilter) -> ExportJob:
+        """Create a job and start running it in the background."""
+        if not self.slots.acquire(blocking=False):
+            raise OverloadedError("Too many exports")
+        try:
+            job = self.store.create()
+            with self.lock:
+                if self.pool is None:
+                    self.pool = ThreadPoolExecutor(self.workers)
+                future = self.pool.submit(
+                    export_labs,
+                    engine,
+                    self.store,
+                    job,
+                    export_filter,
+                    self.chunk_size,
+                )
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return job
+
+    def shutdown(self) -> None:
+        """Stop, waiting for running jobs."""
+        with self.lock:
+            if self.pool is not None:
+                self.pool.shutdown()
+                self.pool = None
+
+
+class ByteRange(NamedTuple):
+    """Inclusive range of byte offsets."""
+
+    first: int
+    last: int
+
+
+def parse_range(header: str, size: int) -> ByteRange | None:
+    """Parse a Range header for a file of `size` bytes.
+
+    Returns None, to serve the whole file, for headers that are malformed or
+    ask for several ranges. Raises ValueError if the range is unsatisfiable.
+    """
+    match = RANGE_PATTERN.fullmatch(header.strip())
+    if match is None or match.group(1) == match.group(2) == "":
+        return None
+    first, last = match.groups()
+    if first == "":
+        # A suffix: the last `last` bytes.
+        length = min(int(last), size)
+        if length == 0:
+            raise ValueError("Empty suffix range")
+        return ByteRange(size - length, size - 1)
+    if last != "" and int(last) < int(first):
+        return None
+    if int(first) >= size:
+        raise ValueError("Range starts after the end of the file")
+    return ByteRange(
+        int(first), size - 1 if last == "" else min(int(last), size - 1)
+    )
+
+
+def read_range(
+    path: Path, byte_range: ByteRange, chunk_size: int = 64 * 1024
+) -> Iterator[bytes]:
+    """Read a range of a file in chunks."""
+    with path.open("rb") as file:
+        file.seek(byte_range.first)
+        remaining = byte_range.last - byte_range.first + 1
+        while remaining > 0:
+            chunk = file.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
@@ -0,0 +1,358 @@
+"""Per-request timing, query counting and Prometheus-style metrics."""
+
+import bisect
+import functools
+import inspect
+import threading
+import time
+from collections.abc import Callable, Iterator, Sequence
+from contextvars import ContextVar
+from typing import Any
+
+from fastapi.routing import APIRoute
+from sqlalchemy import Engine, event
+from sqlalchemy.engine import ExceptionContext
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+import dao
+from dao.models import Base
+
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+class RequestStats:
+    """Where the time of one request went."""
+
+    def __init__(self) -> None:
+        """Initialize, starting the request clock."""
+        self.start = time.perf_counter()
+        self.db_seconds = 0.0
+        self.queries = 0
+        self.rows = 0
+        self.endpoint_end: float | None = None
+        self.response_start: float | None = None
+        # Whether the body is encoded as it is sent (see `timed_stream`).
+        self.streamed = False
+        self.stream_seconds = 0.0
+
+    def serialization_seconds(self) -> float:
+        """Get the time spent validating and encoding the response.
+
+        That is the time from the endpoint returning to the response start,
+        and for streamed bodies the time spent encoding their chunks.
+        """
+        seconds = self.stream_seconds
+        if self.endpoint_end is not None and self.response_start is not None:
+            seconds += max(self.response_start - self.endpoint_end, 0.0)
+        return seconds
+
+    def server_timing(self) -> str:
+        """Format as a Server-Timing header value.
+
+        Streamed bodies are encoded after the header is sent, so their
+        serialization is left out of it, and only reported in the metrics.
+        """
+        end = self.response_start or time.perf_counter()
+        total = end - self.start
+        serialization = self.serialization_seconds()
+        app = max(total - self.db_seconds - serialization, 0.0)
+        return ", ".join(
+            [
+                f"db;dur={1000 * self.db_seconds:.3f};"
+                f'desc="{self.queries} queries {self.rows} rows"',
+                f"app;dur={1000 * app:.3f}",
+                *(
+                    []
+                    if self.streamed
+                    else [f"ser;dur={1000 * serialization:.3f}"]
+                ),
+                f"total;dur={1000 * total:.3f}",
+            ]
+        )
+
+
+current_stats: ContextVar[RequestStats | None] = ContextVar(
+    "current_stats", default=None
+)
+
+
+def before_cursor_execute(
+    conn: Any,
+    cursor: Any,
+    statement: str,
+    parameters: Any,
+    context: Any,
+    executemany: bool,
+) -> None:
+    """Start timing a query."""
+    conn.info.setdefault("query_start", {})[context] = time.perf_counter()
+
+
+def after_cursor_execute(
+    conn: Any,
+    cursor: Any,
+    statement: str,
+    parameters: Any,
+    context: Any,
+    executemany: bool,
+) -> None:
+    """Attribute a query's time to the current request."""
+    start = conn.info["query_start"].pop(context)
+    stats = current_stats.get()
+    if stats is not None:
+        stats.db_seconds += time.perf_counter() - start
+        stats.queries += 1
+
+
+def handle_error(exception_context: ExceptionContext) -> None:
+    """Stop timing a query that failed."""
+    if exception_context.connection is not None:
+        exception_context.connection.info.get("query_start", {}).pop(
+            exception_context.execution_context, None
+        )
+
+
+def count_loaded_row(target: Any, context: Any) -> None:
+    """Count an ORM row loaded for the current request."""
+    count_fetched_rows(1)
+
+
+def count_fetched_rows(count: int) -> None:
+    """Count rows fetched for the current request."""
+    stats = current_stats.get()
+    if stats is not None:
+        stats.rows += count
+
+
+def install_query_hooks() -> None:
+    """Time queries and count rows on every engine.
+
+    Rows are counted as ORM entities are loaded, and as the DAOs fetch rows
+    without the ORM (see `dao.record_rows`).
+    """
+    if not event.contains(
+        Engine, "before_cursor_execute", before_cursor_execute
+    ):
+        event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", after_cursor_execute)
+        event.listen(Engine, "handle_error", handle_error)
+        event.listen(Base, "load", count_loaded_row, propagate=True)
+        dao.row_listeners.append(count_fetched_rows)
+
+
+class TimedRoute(APIRoute):
+    """Route that records when its endpoint returns.
+
+    The time between that and the start of the response is spent validating
+    and serializing the endpoint's return value.
+    """
+
+    def __init__(
+        self, path: str, endpoint: Callable[..., Any], **kwargs: Any
+    ) -> None:
+        """Initialize."""
+        super().__init__(path, timed(endpoint), **kwargs)
+
+
+def timed(endpoint: Callable[..., Any]) -> Callable[..., Any]:
+    """Wrap an endpoint to record when it returns."""
+
+    def record_end() -> None:
+        stats = current_stats.get()
+        if stats is not None:
+            stats.endpoint_end = time.perf_counter()
+
+    if inspect.iscoroutinefunction(endpoint):
+
+        @functools.wraps(endpoint)
+        async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                record_end()
+
+        return async_wrapper
+
+    @functools.wraps(endpoint)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            record_end()
+
+    return wrapper
+
+
+def timed_stream(chunks: Iterator[str]) -> Iterator[str]:
+    """Wrap a streamed body to count its encoding as serialization time."""
+    stats = current_stats.get()
+    if stats is None:
+        return chunks
+    stats.streamed = True
+    return timed_chunks(chunks, stats)
+
+
+def timed_chunks(chunks: Iterator[str], stats: RequestStats) -> Iterator[str]:
+    """Yield chunks, adding the time taken to produce them to `stats`."""
+    while True:
+        start = time.perf_counter()
+        chunk = next(chunks, None)
+        stats.stream_seconds += time.perf_counter() - start
+        if chunk is None:
+            return
+        yield chunk
+
+
+class Histogram:
+    """Cumulative histogram, in the Prometheus sense."""
+
+    def __init__(self, buckets: Sequence[float]) -> None:
+        """Initialize."""
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last is +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        """Record a value."""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def render(self, name: str, labels: str) -> list[str]:
+        """Format as Prometheus text exposition lines."""
+        lines = []
+        cumulative = 0
+        for bound, count in zip(
+            [*map(str, self.buckets), "+Inf"], self.counts, strict=True
+        ):
+            cumulative += count
+            lines.append(
+                f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+            )
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {cumulative}")
+        return lines
+
+
+class Metrics:
+    """Request metrics by method and route."""
+
+    HISTOGRAMS = {
+        "ehr_api_request_duration_seconds": "Request latency.",
+        "ehr_api_db_duration_seconds": "Time spent in queries per request.",
+        "ehr_api_serialization_duration_seconds": (
+            "Time spent serializing responses."
+        ),
+    }
+    COUNTERS = {
+        "ehr_api_requests_total": "Requests, by response status.",
+        "ehr_api_db_queries_total": "Queries executed.",
+        "ehr_api_db_rows_total": "Rows loaded.",
+    }
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        """Initialize."""
+        self.buckets = buckets
+        self.histograms: dict[str, dict[str, Histogram]] = {
+            name: {} for name in self.HISTOGRAMS
+        }
+        self.counters: dict[str, dict[str, float]] = {
+            name: {} for name in self.COUNTERS
+        }
+        self.lock = threading.Lock()
+
+    def observe(
+        self, method: str, route: str, status: int, stats: RequestStats
+    ) -> None:
+        """Record a finished request."""
+        labels = f'method="{method}",route="{route}"'
+        duration = time.perf_counter() - stats.start
+        with self.lock:
+            for name, value in [
+                ("ehr_api_request_duration_seconds", duration),
+                ("ehr_api_db_duration_seconds", stats.db_seconds),
+                (
+                    "ehr_api_serialization_duration_seconds",
+                    stats.serialization_seconds(),
+                ),
+            ]:
+                histograms = self.histograms[name]
+                if labels not in histograms:
+                    histograms[labels] = Histogram(self.buckets)
+                histograms[labels].observe(value)
+            for name, labels_, increment in [
+                ("ehr_api_requests_total", f'{labels},status="{status}"', 1),
+                ("ehr_api_db_queries_total", labels, stats.queries),
+                ("ehr_api_db_rows_total", labels, stats.rows),
+            ]:
+                counter = self.counters[name]
+                counter[labels_] = counter.get(labels_, 0) + increment
+
+    def render(self) -> str:
+        """Format as Prometheus text exposition."""
+        lines = []
+        with self.lock:
+            for name, help in self.HISTOGRAMS.items():
+                lines += [f"# HELP {name} {help}", f"# TYPE {name} histogram"]
+                for labels, histogram in sorted(self.histograms[name].items()):
+                    lines += histogram.render(name, labels)
+            for name, help in self.COUNTERS.items():
+                lines += [f"# HELP {name} {help}", f"# TYPE {name} counter"]
+                for labels, value in sorted(self.counters[name].items()):
+                    lines.append(f"{name}{{{labels}}} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class InstrumentationMiddleware:
+    """Time requests, add a Server-Timing header and record metrics."""
+
+    def __init__(self, app: ASGIApp, metrics: Metrics) -> None:
+        """Initialize."""
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(
+        self, scope: Scope, receive: Receive, send: Send
+    ) -> None:
+        """Handle a request."""
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats()
+        status = 500
+
+        async def send_with_timing(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                stats.response_start = time.perf_counter()
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", stats.server_timing())
+            await send(message)
+
+        token = current_stats.set(stats)
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_stats.reset(token)
+            route = scope.get("route")
+            self.metrics.observe(
+                scope["method"],
+                route.path if isinstance(route, APIRoute) else "unmatched",
+                status,
+                stats,
+            )
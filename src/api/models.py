@@ -2,10 +2,38 @@
 
 import datetime
 import enum
+import json
+from collections.abc import Iterator
 from typing import Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
+from api.exports import ExportJob as StorageExportJob
+from api.exports import ExportStatus as StorageExportStatus
+from dao.lab_dao import (
+    LabAggregate as StorageLabAggregate,
+)
+from dao.lab_dao import (
+    LabBatch as StorageLabBatch,
+)
+from dao.lab_dao import (
+    LabPoint as StorageLabPoint,
+)
+from dao.lab_name_dao import (
+    LabName as StorageLabName,
+)
+from dao.lab_windows import (
+    LabWindowPoint as StorageLabWindowPoint,
+)
+from dao.models import (
+    Admission as StorageAdmission,
+)
+from dao.models import (
+    Change as StorageChange,
+)
+from dao.models import (
+    Entity as StorageEntity,
+)
 from dao.models import (
     Gender as StorageGender,
 )
@@ -18,12 +46,18 @@ from dao.models import (
 from dao.models import (
     MaritalStatus as StorageMaritalStatus,
 )
+from dao.models import (
+    Operation as StorageOperation,
+)
 from dao.models import (
     Patient as StoragePatient,
 )
 from dao.models import (
     Race as StorageRace,
 )
+from dao.patient_dao import (
+    PatientRecord as StoragePatientRecord,
+)
 
 
 class Gender(enum.StrEnum):
@@ -99,8 +133,10 @@ class Patient(InputPatient):
     id: Optional[str]  # output-only
 
     @staticmethod
-    def from_storage(patient: StoragePatient) -> "Patient":
-        """Convert a storage Patient to an API Patient."""
+    def from_storage(
+        patient: StoragePatient | StoragePatientRecord,
+    ) -> "Patient":
+        """Convert a storage Patient or PatientRecord to an API Patient."""
         return Patient(
             id=patient.id,
             gender=Gender.from_storage(patient.gender),
@@ -128,14 +164,271 @@ class Lab(InputLab):
     patient_id: Optional[str]
 
     @staticmethod
-    def from_storage(lab: StorageLab) -> "Lab":
-        """Convert a storage Lab to an API Lab."""
+    def from_storage(lab: StorageLab, normalize: bool = False) -> "Lab":
+        """Convert a storage Lab to an API Lab, optionally normalized."""
         return Lab(
             id=lab.id,
             patient_id=lab.patient_id,
             admission_number=lab.admission_number,
             datetime=lab.datetime,
             name=lab.name,
-            value=lab.value,
-            units=lab.units,
+            value=lab.normalized_value if normalize else lab.value,
+            units=lab.normalized_units if normalize else lab.units,
+        )
+
+    @staticmethod
+    def json_from_storage_batch(
+        batch: StorageLabBatch, normalize: bool = False, chunk_size: int = 1000
+    ) -> Iterator[str]:
+        """Serialize a storage LabBatch as a JSON array of API Labs.
+
+        Labs are encoded straight from the batch, in chunks, without building
+        a Lab for each, so large lists can be streamed.
+        """
+        encoder = json.JSONEncoder(
+            ensure_ascii=False, allow_nan=False, separators=(",", ":")
+        )
+        yield "["
+        chunk: list[str] = []
+        separator = ""
+        for lab in batch.records(normalize):
+            chunk.append(
+                encoder.encode(
+                    {
+                        "admission_number": lab.admission_number,
+                        "datetime": lab.datetime.isoformat(),
+                        "name": lab.name,
+                        "value": lab.value,
+                        "units": lab.units,
+                        "id": lab.id,
+                        "patient_id": lab.patient_id,
+                    }
+                )
+            )
+            if len(chunk) == chunk_size:
+                yield separator + ",".join(chunk)
+                separator, chunk = ",", []
+        if chunk:
+            yield separator + ",".join(chunk)
+        yield "]"
+
+
+class LabAggregate(BaseModel):
+    """Summary statistics of the values of a lab in some units."""
+
+    name: str
+    units: str
+    labs: int
+    mean: float
+    minimum: float
+    maximum: float
+
+    @staticmethod
+    def from_storage(aggregate: StorageLabAggregate) -> "LabAggregate":
+        """Convert a storage LabAggregate to an API LabAggregate."""
+        return LabAggregate(**aggregate._asdict())
+
+
+class LabUnits(BaseModel):
+    """Units a lab has been taken in, with their number of labs."""
+
+    units: str
+    labs: int
+
+
+class LabName(BaseModel):
+    """Name of a lab, with its number of labs in each of its units."""
+
+    name: str
+    labs: int
+    units: list[LabUnits]
+
+    @staticmethod
+    def from_storage(name: StorageLabName) -> "LabName":
+        """Convert a storage LabName to an API LabName."""
+        return LabName(
+            name=name.name,
+            labs=name.labs,
+            units=[LabUnits(**units._asdict()) for units in name.units],
+        )
+
+
+class LabPoint(BaseModel):
+    """Value of a lab at a time."""
+
+    datetime: datetime.datetime
+    value: float
+    units: str
+
+    @staticmethod
+    def from_storage(point: StorageLabPoint) -> "LabPoint":
+        """Convert a storage LabPoint to an API LabPoint."""
+        return LabPoint(**point._asdict())
+
+
+class LabWindowPoint(BaseModel):
+    """Value of a lab at a time, with the statistics of its window.
+
+    The window holds the patient's labs of the same name and units taken in
+    the window's length up to and including this one.
+    """
+
+    datetime: datetime.datetime
+    value: float
+    units: str
+    mean: float
+    minimum: float
+    maximum: float
+    delta: float  # change since the window's first lab
+    rise: float  # value less the window's minimum
+    slope: float | None  # per hour since the previous lab
+    flagged: bool  # whether `rise` reached the threshold
+
+    @staticmethod
+    def from_storage(point: StorageLabWindowPoint) -> "LabWindowPoint":
+        """Convert a storage LabWindowPoint to an API LabWindowPoint."""
+        return LabWindowPoint(**point._asdict())
+
+
+class InputLabWindows(BaseModel):
+    """Rolling statistics to compute over patients' series of a lab."""
+
+    patient_ids: list[str] = Field(..., max_items=1000)
+    name: str
+    window: float = Field(24.0, gt=0)  # in hours
+    threshold: float | None  # flag labs that rose this much in a window
+    normalize: bool = False
+
+
+class InputAdmission(BaseModel):
+    """Supplied start and end of an admission."""
+
+    start: datetime.datetime | None
+    end: datetime.datetime | None
+
+
+class Admission(BaseModel):
+    """Hospital admission.
+
+    `start` and `end` are as supplied or, failing that, the times of the
+    admission's first and last labs.
+    """
+
+    patient_id: str
+    number: int
+    start: datetime.datetime | None
+    end: datetime.datetime | None
+    length_of_stay: float | None  # in days
+
+    @staticmethod
+    def from_storage(admission: StorageAdmission) -> "Admission":
+        """Convert a storage Admission to an API Admission."""
+        start = admission.start or admission.first_lab
+        end = admission.end or admission.last_lab
+        return Admission(
+            patient_id=admission.patient_id,
+            number=admission.number,
+            start=start,
+            end=end,
+            length_of_stay=(
+                None
+                if start is None or end is None
+                else (end - start) / datetime.timedelta(days=1)
+            ),
+        )
+
+
+class Entity(enum.StrEnum):
+    """Kind of entity tracked in the change log."""
+
+    patient = "patient"
+    lab = "lab"
+
+    @staticmethod
+    def from_storage(value: StorageEntity) -> "Entity":
+        """Convert a storage Entity to an API Entity."""
+        return Entity[value.name]
+
+
+class Operation(enum.StrEnum):
+    """Kind of change recorded in the change log."""
+
+    create = "create"
+    update = "update"
+    delete = "delete"
+
+    @staticmethod
+    def from_storage(value: StorageOperation) -> "Operation":
+        """Convert a storage Operation to an API Operation."""
+        return Operation[value.name]
+
+
+class Change(BaseModel):
+    """Change log entry."""
+
+    seq: int
+    entity: Entity
+    entity_id: str
+    operation: Operation
+
+    @staticmethod
+    def from_storage(change: StorageChange) -> "Change":
+        """Convert a storage Change to an API Change."""
+        return Change(
+            seq=change.seq,
+            entity=Entity.from_storage(change.entity),
+            entity_id=change.entity_id,
+            operation=Operation.from_storage(change.operation),
+        )
+
+
+class ChangePage(BaseModel):
+    """Page of change log entries."""
+
+    changes: list[Change]
+    next_since: int  # pass as `since` to fetch the following page
+    has_more: bool
+
+
+class InputExport(BaseModel):
+    """Labs to export: those of a lab name, if given, in [start, end)."""
+
+    name: str | None = None
+    start: datetime.datetime | None = None
+    end: datetime.datetime | None = None
+    normalize: bool = False
+
+
+class ExportStatus(enum.StrEnum):
+    """State of an export job."""
+
+    pending = "pending"
+    running = "running"
+    done = "done"
+    failed = "failed"
+
+    @staticmethod
+    def from_storage(value: StorageExportStatus) -> "ExportStatus":
+        """Convert a storage ExportStatus to an API ExportStatus."""
+        return ExportStatus[value.name]
+
+
+class Export(BaseModel):
+    """Export job and its progress."""
+
+    id: str
+    status: ExportStatus
+    rows: int  # exported so far
+    total: int | None  # to export, once counted
+    error: str | None
+
+    @staticmethod
+    def from_storage(job: StorageExportJob) -> "Export":
+        """Convert a storage ExportJob to an API Export."""
+        return Export(
+            id=job.id,
+            status=ExportStatus.from_storage(job.status),
+            rows=job.rows,
+            total=job.total,
+            error=job.error,
         )
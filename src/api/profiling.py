@@ -0,0 +1,117 @@
+"""On-demand sampling profiler for individual requests."""
+
+import sys
+import threading
+import uuid
+from collections import Counter
+from pathlib import Path
+from types import FrameType
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_ID_HEADER = "X-Profile-Id"
+
+
+def frame_stack(frame: FrameType | None) -> tuple[str, ...]:
+    """Get a stack of frame names, outermost first."""
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(
+            f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+        )
+        frame = frame.f_back
+    return tuple(reversed(stack))
+
+
+class SamplingProfiler:
+    """Sample one thread's stack at a fixed interval.
+
+    Samples are kept in the "folded stacks" format read by flamegraph.pl,
+    speedscope and similar tools.
+    """
+
+    def __init__(self, thread_id: int, interval: float = 0.001) -> None:
+        """Initialize. `interval` is in seconds."""
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Counter[tuple[str, ...]] = Counter()
+        self.stopped = threading.Event()
+        self.sampler = threading.Thread(target=self.run, daemon=True)
+
+    def start(self) -> None:
+        """Start sampling."""
+        self.sampler.start()
+
+    def stop(self) -> None:
+        """Stop sampling."""
+        self.stopped.set()
+        self.sampler.join()
+
+    def run(self) -> None:
+        """Sample until stopped."""
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.samples[frame_stack(frame)] += 1
+
+    def folded(self) -> str:
+        """Format samples as folded stacks, one "a;b;c count" per line."""
+        return "".join(
+            f"{';'.join(stack)} {count}\n"
+            for stack, count in self.samples.most_common()
+        )
+
+
+class ProfilingMiddleware:
+    """Profile requests that carry an `X-Profile` header.
+
+    The event loop thread is sampled while the request is handled, so the
+    profile also contains any other requests the loop is serving at the
+    time. The profile is saved as `<id>.folded` in `directory`, and its id
+    returned in the `X-Profile-Id` response header.
+    """
+
+    def __init__(
+        self, app: ASGIApp, directory: Path, interval: float = 0.001
+    ) -> None:
+        """Initialize."""
+        self.app = app
+        self.directory = directory
+        self.interval = interval
+
+    async def __call__(
+        self, scope: Scope, receive: Receive, send: Send
+    ) -> None:
+        """Handle a request."""
+        if scope["type"] != "http" or not any(
+            name.decode("latin-1").lower() == PROFILE_HEADER.lower()
+            for name, _ in scope["headers"]
+        ):
+            await self.app(scope, receive, send)
+            return
+        profile_id = str(uuid.uuid4())
+
+        async def send_with_id(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers.append(PROFILE_ID_HEADER, profile_id)
+            await send(message)
+
+        profiler = SamplingProfiler(threading.get_ident(), self.interval)
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            profiler.stop()
+            self.directory.mkdir(parents=True, exist_ok=True)
+            profile_path(self.directory, profile_id).write_text(
+                profiler.folded()
+            )
+
+
+def profile_path(directory: Path, profile_id: str) -> Path:
+    """Get the path of a saved profile, rejecting ids that are not UUIDs."""
+    return directory / f"{uuid.UUID(profile_id)}.folded"
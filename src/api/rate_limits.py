@@ -0,0 +1,225 @@
+"""Per-client rate limits and concurrency caps, enforced before routing.
+
+Each client has a token bucket refilled at a steady rate, and each request
+takes tokens according to the cost of its route, so expensive routes (lists,
+exports) use up a client's allowance faster than single reads. Routes may
+also cap how many requests run at once, per client and in total. Requests
+over a limit are refused at once with 429 and a Retry-After header, before
+their body is read or any query runs.
+"""
+
+import json
+import math
+import threading
+import time
+from collections import Counter, OrderedDict
+from collections.abc import Callable, Collection, Mapping
+from typing import NamedTuple
+
+from starlette.routing import Match
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+CLIENT_HEADER = b"x-client-id"
+
+
+class RouteLimit(NamedTuple):
+    """Limits of one route."""
+
+    cost: float = 1.0  # tokens taken per request
+    client_concurrency: int | None = None  # running per client
+    concurrency: int | None = None  # running across clients
+
+
+class TokenBucket:
+    """Allowance of tokens that refills at a steady rate up to a burst."""
+
+    def __init__(self, rate: float, burst: float, now: float) -> None:
+        """Initialize full. `rate` is in tokens per second."""
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, cost: float, now: float) -> float:
+        """Take `cost` tokens if there are enough.
+
+        Returns 0 if they were taken, or else the seconds until there will
+        be enough. Costs above the burst are capped to it, so that every
+        request can eventually be admitted.
+        """
+        self.tokens = min(
+            self.burst, self.tokens + (now - self.updated) * self.rate
+        )
+        self.updated = now
+        cost = min(cost, self.burst)
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """Token buckets of clients and requests running on each route.
+
+    Routes are named "METHOD /path/{template}", as they are declared. The
+    buckets of the least recently seen clients are dropped beyond
+    `max_clients`, which only ever lets them start again with a full one.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: float,
+        routes: Mapping[str, RouteLimit] | None = None,
+        max_clients: int = 10_000,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """Initialize. `rate` is in tokens per second."""
+        self.rate = rate
+        self.burst = burst
+        self.routes = routes or {}
+        self.max_clients = max_clients
+        self.clock = clock
+        self.buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+        self.running: Counter[tuple[str, str]] = Counter()  # client, route
+        self.route_running: Counter[str] = Counter()
+        self.rejected: Counter[tuple[str, str]] = Counter()  # route, reason
+        self.lock = threading.Lock()
+
+    def limit(self, route: str) -> RouteLimit:
+        """Get the limits of a route."""
+        return self.routes.get(route, RouteLimit())
+
+    def acquire(self, client: str, route: str) -> float | None:
+        """Admit a request, or refuse it.
+
+        Returns None if admitted, in which case `release` must be called
+        once it is done, or else the seconds to wait before retrying.
+        """
+        limit = self.limit(route)
+        with self.lock:
+            if (
+                limit.concurrency is not None
+                and self.route_running[route] >= limit.concurrency
+            ) or (
+                limit.client_concurrency is not None
+                and self.running[client, route] >= limit.client_concurrency
+            ):
+                self.rejected[route, "concurrency"] += 1
+                return 1.0
+            now = self.clock()
+            bucket = self.buckets.get(client)
+            if bucket is None:
+                bucket = self.buckets[client] = TokenBucket(
+                    self.rate, self.burst, now
+                )
+                while len(self.buckets) > self.max_clients:
+                    self.buckets.popitem(last=False)
+            self.buckets.move_to_end(client)
+            wait = bucket.take(limit.cost, now)
+            if wait:
+                self.rejected[route, "rate"] += 1
+                return wait
+            self.running[client, route] += 1
+            self.route_running[route] += 1
+            return None
+
+    def release(self, client: str, route: str) -> None:
+        """Record an admitted request as done."""
+        with self.lock:
+            self.running[client, route] -= 1
+            if not self.running[client, route]:
+                del self.running[client, route]
+            self.route_running[route] -= 1
+            if not self.route_running[route]:
+                del self.route_running[route]
+
+    def render(self) -> str:
+        """Format metrics as Prometheus text exposition."""
+        with self.lock:
+            lines = [
+                "# HELP ehr_api_rate_limited_total Requests refused with "
+                "429, by route and limit reached.",
+                "# TYPE ehr_api_rate_limited_total counter",
+            ]
+            lines.extend(
+                "ehr_api_rate_limited_total"
+                f'{{route="{route}",reason="{reason}"}} {count}'
+                for (route, reason), count in sorted(self.rejected.items())
+            )
+        return "\n".join(lines) + "\n"
+
+
+def client_key(scope: Scope, trusted_proxies: Collection[str] = ()) -> str:
+    """Identify a request's client by its address.
+
+    Requests from `trusted_proxies` are identified by their X-Client-Id
+    header instead, if they have one. Anyone else could send a new one with
+    each request to get a fresh bucket, so theirs is ignored.
+    """
+    client = scope.get("client")
+    address = client[0] if client else "unknown"
+    if address in trusted_proxies:
+        for name, value in scope["headers"]:
+            if name.lower() == CLIENT_HEADER:
+                client_id: str = value.decode("latin-1")
+                return f"id:{client_id}"
+    return f"address:{address}"
+
+
+def route_name(scope: Scope) -> str:
+    """Get the "METHOD /path/{template}" of the route a request matches."""
+    for route in scope["app"].router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            path: str = route.path
+            return f"{scope['method']} {path}"
+    return f"{scope['method']} unmatched"
+
+
+class RateLimitMiddleware:
+    """Refuse requests over their client's rate or their route's caps.
+
+    Clients are told apart as by `client_key`.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        limiter: RateLimiter,
+        trusted_proxies: Collection[str] = (),
+    ) -> None:
+        """Initialize."""
+        self.app = app
+        self.limiter = limiter
+        self.trusted_proxies = frozenset(trusted_proxies)
+
+    async def __call__(
+        self, scope: Scope, receive: Receive, send: Send
+    ) -> None:
+        """Handle a request."""
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        client = client_key(scope, self.trusted_proxies)
+        route = route_name(scope)
+        wait = self.limiter.acquire(client, route)
+        if wait is not None:
+            body = json.dumps({"detail": "Too many requests"}).encode()
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 429,
+                    "headers": [
+                        (b"content-type", b"application/json"),
+                        (b"content-length", str(len(body)).encode()),
+                        (b"retry-after", str(math.ceil(wait)).encode()),
+                    ],
+                }
+            )
+            await send({"type": "http.response.body", "body": body})
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.limiter.release(client, route)
@@ -0,0 +1 @@
+"""Benchmark suite for the HTTP API and the DAOs."""
@@ -0,0 +1,100 @@
+"""Run benchmarks and write or compare JSON results.
+
+Usage, from the `src` directory:
+
+    python -m benchmark --output results.json
+    python -m benchmark --baseline results.json
+"""
+
+import argparse
+import json
+import platform
+import sys
+import tempfile
+from pathlib import Path
+
+import sqlalchemy
+
+import database
+from benchmark.data import DataSpec
+from benchmark.runner import compare
+from benchmark.suite import run_suite
+
+
+def main() -> int:
+    """Run benchmarks."""
+    defaults = DataSpec()
+    parser = argparse.ArgumentParser(prog="python -m benchmark")
+    parser.add_argument("--patients", type=int, default=defaults.patients)
+    parser.add_argument(
+        "--labs-per-patient", type=int, default=defaults.labs_per_patient
+    )
+    parser.add_argument("--lab-names", type=int, default=defaults.lab_names)
+    parser.add_argument(
+        "--zipf-exponent", type=float, default=defaults.zipf_exponent
+    )
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument(
+        "--only", default="", help="run benchmarks whose name contains this"
+    )
+    parser.add_argument("--output", type=Path, help="write results here")
+    parser.add_argument(
+        "--baseline", type=Path, help="compare against these results"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="allowed relative p50 slowdown against the baseline",
+    )
+    args = parser.parse_args()
+    spec = DataSpec(
+        patients=args.patients,
+        labs_per_patient=args.labs_per_patient,
+        lab_names=args.lab_names,
+        zipf_exponent=args.zipf_exponent,
+        seed=args.seed,
+    )
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = database.setup(f"sqlite:///{directory}/benchmark.db")
+        results = run_suite(
+            engine, spec, args.iterations, args.warmup, args.only
+        )
+        engine.dispose()
+
+    report = {
+        "config": {
+            **spec._asdict(),
+            "iterations": args.iterations,
+            "warmup": args.warmup,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "sqlalchemy": sqlalchemy.__version__,
+            "platform": platform.platform(),
+        },
+        "results": {
+            name: result._asdict() for name, result in results.items()
+        },
+    }
+    for name, result in results.items():
+        print(
+            f"{name:<24} {result.throughput:>10.1f}/s"
+            f" p50 {result.p50_ms:>8.2f} ms p99 {result.p99_ms:>8.2f} ms"
+        )
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())["results"]
+        regressions = compare(baseline, report["results"], args.tolerance)
+        for name, change in regressions.items():
+            print(f"REGRESSION {name}: p50 {change:+.0%}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+"""Synthetic EHR data for benchmarks."""
+
+import random
+import uuid
+from collections.abc import Sequence
+from datetime import datetime, timedelta
+from typing import NamedTuple
+
+from sqlalchemy import Engine
+
+from dao.lab_dao import LabDao
+from dao.models import (
+    Gender,
+    Lab,
+    Language,
+    MaritalStatus,
+    Patient,
+    Race,
+)
+from dao.patient_dao import PatientDao
+
+
+class LabSpec(NamedTuple):
+    """Kind of lab to generate."""
+
+    name: str
+    units: str
+    mean: float
+    sd: float
+
+
+DEFAULT_LABS = [
+    LabSpec("METABOLIC: GLUCOSE", "mg/dL", 110.0, 30.0),
+    LabSpec("METABOLIC: CREATININE", "mg/dL", 1.0, 0.3),
+    LabSpec("METABOLIC: SODIUM", "mmol/L", 140.0, 3.0),
+    LabSpec("METABOLIC: POTASSIUM", "mmol/L", 4.2, 0.4),
+    LabSpec("CBC: HEMOGLOBIN", "g/dL", 13.5, 1.5),
+    LabSpec("CBC: WHITE BLOOD CELL COUNT", "k/cumm", 7.5, 2.0),
+    LabSpec("CBC: PLATELET COUNT", "k/cumm", 250.0, 60.0),
+    LabSpec("URINALYSIS: PH", "no unit", 6.0, 0.5),
+]
+
+
+class DataSpec(NamedTuple):
+    """Shape of a synthetic data set."""
+
+    patients: int = 100
+    labs_per_patient: int = 50
+    lab_names: int = len(DEFAULT_LABS)
+    zipf_exponent: float = 1.0  # skew of the lab name distribution
+    seed: int = 0
+
+
+def lab_specs(count: int) -> list[LabSpec]:
+    """Get `count` kinds of lab, padding the defaults with synthetic ones."""
+    specs = DEFAULT_LABS[:count]
+    for index in range(len(specs), count):
+        specs.append(LabSpec(f"SYNTHETIC: LAB {index}", "units", 1.0, 0.1))
+    return specs
+
+
+def lab_weights(count: int, exponent: float) -> list[float]:
+    """Get Zipf-like weights, so the first lab names are the most common."""
+    return [1 / (rank**exponent) for rank in range(1, count + 1)]
+
+
+def make_patients(spec: DataSpec, rng: random.Random) -> list[Patient]:
+    """Make patients with reproducible ids and demographics."""
+    return [
+        Patient(
+            id=str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+            date_of_birth=datetime(1940, 1, 1)
+            + timedelta(days=rng.randrange(365 * 80)),
+            gender=rng.choice(list(Gender)),
+            language=rng.choice(list(Language)),
+            marital_status=rng.choice(list(MaritalStatus)),
+            race=rng.choice(list(Race)),
+        )
+        for _ in range(spec.patients)
+    ]
+
+
+def make_labs(
+    patient_id: str, spec: DataSpec, rng: random.Random
+) -> list[Lab]:
+    """Make a patient's labs, spread over a few admissions."""
+    specs = lab_specs(spec.lab_names)
+    weights = lab_weights(spec.lab_names, spec.zipf_exponent)
+    start = datetime(2010, 1, 1) + timedelta(minutes=rng.randrange(5_000_000))
+    labs = []
+    for index, lab in enumerate(
+        rng.choices(specs, weights, k=spec.labs_per_patient)
+    ):
+        labs.append(
+            Lab(
+                id=str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+                patient_id=patient_id,
+                admission_number=index * 4 // max(spec.labs_per_patient, 1),
+                datetime=start + timedelta(minutes=index * 37),
+                name=lab.name,
+                value=round(rng.gauss(lab.mean, lab.sd), 2),
+                units=lab.units,
+            )
+        )
+    return labs
+
+
+def generate(engine: Engine, spec: DataSpec) -> Sequence[Patient]:
+    """Populate a database with synthetic patients and labs."""
+    rng = random.Random(spec.seed)
+    patients = PatientDao(engine).create_many(make_patients(spec, rng))
+    lab_dao = LabDao(engine)
+    for patient in patients:
+        lab_dao.create_many(make_labs(patient.id, spec, rng))
+    return patients
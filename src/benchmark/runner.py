@@ -0,0 +1,65 @@
+"""Timing and comparison of benchmark results."""
+
+import math
+import time
+from collections.abc import Callable
+from typing import Any, NamedTuple
+
+
+class Result(NamedTuple):
+    """Timings of one benchmark."""
+
+    iterations: int
+    throughput: float  # operations per second
+    mean_ms: float
+    p50_ms: float
+    p99_ms: float
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    """Get a percentile of sorted values, by the nearest-rank method."""
+    if not sorted_values:
+        return math.nan
+    rank = math.ceil(fraction * len(sorted_values))
+    return sorted_values[max(rank, 1) - 1]
+
+
+def measure(
+    operation: Callable[[int], Any], iterations: int, warmup: int = 0
+) -> Result:
+    """Time an operation, which is passed the iteration number."""
+    for index in range(warmup):
+        operation(index)
+    durations = []
+    for index in range(warmup, warmup + iterations):
+        start = time.perf_counter()
+        operation(index)
+        durations.append(time.perf_counter() - start)
+    durations.sort()
+    total = sum(durations)
+    return Result(
+        iterations=iterations,
+        throughput=iterations / total if total else math.inf,
+        mean_ms=1000 * total / iterations,
+        p50_ms=1000 * percentile(durations, 0.50),
+        p99_ms=1000 * percentile(durations, 0.99),
+    )
+
+
+def compare(
+    baseline: dict[str, dict[str, float]],
+    current: dict[str, dict[str, float]],
+    tolerance: float = 0.2,
+) -> dict[str, float]:
+    """Find benchmarks whose p50 latency regressed by more than `tolerance`.
+
+    Returns the relative change in p50 latency of each regressed benchmark.
+    """
+    regressions = {}
+    for name, result in current.items():
+        if name not in baseline or not baseline[name]["p50_ms"]:
+            continue
+        change = result["p50_ms"] / baseline[name]["p50_ms"] - 1
+        if change > tolerance:
+            regressions[name] = change
+    return regressions
@@ -0,0 +1,157 @@
+"""Benchmark how long the API takes to start.
+
+Usage, from the `src` directory:
+
+    python -m benchmark.startup --workers 1 4 --output startup.json
+
+Measures, each in fresh processes: importing the API, setting up a new and
+an existing database, and starting `server.py` with each number of workers
+until it answers its first request.
+"""
+
+import argparse
+import functools
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import Callable, Sequence
+from pathlib import Path
+from typing import Any
+
+import httpx
+
+import database
+from benchmark.runner import Result, measure
+
+SOURCE = Path(__file__).resolve().parents[1]
+
+
+def run_python(code: str, env: dict[str, str]) -> None:
+    """Run Python code in a fresh interpreter."""
+    subprocess.run(
+        [sys.executable, "-c", code], cwd=SOURCE, env=env, check=True
+    )
+
+
+def free_port() -> int:
+    """Find a free TCP port."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port: int = sock.getsockname()[1]
+        return port
+
+
+def start_server(
+    workers: int, env: dict[str, str], timeout: float, index: int
+) -> None:
+    """Start a server and wait for its first response, then stop it."""
+    port = free_port()
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "server.py",
+            "--workers",
+            str(workers),
+            "--port",
+            str(port),
+        ],
+        cwd=SOURCE,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                httpx.get(
+                    f"http://127.0.0.1:{port}/metrics"
+                ).raise_for_status()
+                return
+            except httpx.TransportError:
+                if server.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError("Server did not start") from None
+                time.sleep(0.01)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def run_startup(
+    directory: Path,
+    workers: Sequence[int],
+    iterations: int,
+    timeout: float = 60.0,
+) -> dict[str, Result]:
+    """Time the stages of starting the API, with databases in `directory`."""
+    url = f"sqlite:///{directory / 'startup.db'}"
+    env = {
+        **os.environ,
+        "EHR_API_DATABASE_URL": url,
+        "EHR_API_EXPORT_DIR": str(directory / "exports"),
+    }
+    env.pop(database.SCHEMA_READY, None)
+
+    def setup_new(index: int) -> None:
+        database.setup(f"sqlite:///{directory / f'new-{index}.db'}").dispose()
+
+    benchmarks: dict[str, Callable[[int], Any]] = {
+        "startup.python": lambda i: run_python("pass", env),
+        "startup.import_api": lambda i: run_python("import api.api", env),
+        "startup.setup.new": setup_new,
+        "startup.setup.existing": lambda i: database.setup(url).dispose(),
+        **{
+            f"startup.server.workers_{count}": functools.partial(
+                start_server, count, env, timeout
+            )
+            for count in workers
+        },
+    }
+    return {
+        name: measure(operation, iterations)
+        for name, operation in benchmarks.items()
+    }
+
+
+def main() -> int:
+    """Run startup benchmarks."""
+    parser = argparse.ArgumentParser(prog="python -m benchmark.startup")
+    parser.add_argument(
+        "--workers", type=int, nargs="+", default=[1, os.cpu_count() or 1]
+    )
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--output", type=Path, help="write results here")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = run_startup(Path(directory), args.workers, args.iterations)
+    for name, result in results.items():
+        print(
+            f"{name:<32} p50 {result.p50_ms:>9.1f} ms"
+            f" p99 {result.p99_ms:>9.1f} ms"
+        )
+    if args.output:
+        args.output.write_text(
+            json.dumps(
+                {
+                    "config": {
+                        "workers": args.workers,
+                        "iterations": args.iterations,
+                    },
+                    "results": {
+                        name: result._asdict()
+                        for name, result in results.items()
+                    },
+                },
+                indent=2,
+            )
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,150 @@
+"""Micro-benchmark the per-call overhead of the DAOs' hot statements.
+
+Usage, from the `src` directory:
+
+    python -m benchmark.statements --patients 1000 --output statements.json
+
+Each DAO read and list runs against the query it replaced, built anew on
+every call and loading ORM entities, in one open session so that only
+statement and row handling are timed.
+"""
+
+import argparse
+import json
+import sys
+import tempfile
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+from sqlalchemy import Engine, select
+from sqlalchemy.orm import Session
+
+import database
+from benchmark.data import DataSpec, generate
+from benchmark.runner import Result, measure
+from dao.lab_dao import LabDao
+from dao.models import Lab, Patient
+from dao.patient_dao import PatientDao
+
+# Variants of each operation, the one it replaced first.
+VARIANTS = ("select", "cached")
+
+
+def run_statements(
+    engine: Engine, spec: DataSpec, iterations: int = 1000, warmup: int = 10
+) -> dict[str, Result]:
+    """Populate a database and time each variant of the hot statements."""
+    patients = [patient.id for patient in generate(engine, spec)]
+    lab_dao = LabDao(engine)
+    labs = [lab.id for lab in lab_dao.list()]
+    patient_dao = PatientDao(engine)
+
+    def patient_id(index: int) -> str:
+        return patients[index % len(patients)]
+
+    def lab_id(index: int) -> str:
+        return labs[index % len(labs)]
+
+    with Session(engine) as session:
+
+        def fresh(operation: Callable[[int], Any]) -> Callable[[int], Any]:
+            """Run an operation with an empty identity map."""
+
+            def run(index: int) -> Any:
+                session.expunge_all()
+                return operation(index)
+
+            return run
+
+        benchmarks: dict[str, Callable[[int], Any]] = {
+            "statements.patient.read.select": lambda i: session.scalars(
+                select(Patient).where(Patient.id == patient_id(i))
+            ).one(),
+            "statements.patient.read.cached": lambda i: patient_dao._read(
+                patient_id(i), session
+            ),
+            "statements.patient.check.select": lambda i: session.scalars(
+                select(Patient).where(Patient.id == patient_id(i))
+            ).one(),
+            "statements.patient.check.cached": lambda i: patient_dao._check(
+                patient_id(i), session
+            ),
+            "statements.patient.list.select": lambda i: session.scalars(
+                select(Patient)
+            ).all(),
+            "statements.patient.list.cached": lambda i: patient_dao._list(
+                session
+            ),
+            "statements.lab.read.select": lambda i: session.scalars(
+                select(Lab).where(Lab.id == lab_id(i))
+            ).one(),
+            "statements.lab.read.cached": lambda i: lab_dao._read(
+                lab_id(i), session
+            ),
+            "statements.lab.list.select": lambda i: session.scalars(
+                select(Lab)
+            ).all(),
+            "statements.lab.list.cached": lambda i: lab_dao._list(session),
+        }
+        return {
+            name: measure(
+                fresh(operation),
+                # Lists read every row, so are far slower than reads.
+                max(iterations // 100, 1) if ".list." in name else iterations,
+                warmup,
+            )
+            for name, operation in benchmarks.items()
+        }
+
+
+def main() -> int:
+    """Run statement micro-benchmarks."""
+    defaults = DataSpec(labs_per_patient=10)
+    parser = argparse.ArgumentParser(prog="python -m benchmark.statements")
+    parser.add_argument("--patients", type=int, default=defaults.patients)
+    parser.add_argument(
+        "--labs-per-patient", type=int, default=defaults.labs_per_patient
+    )
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--output", type=Path, help="write results here")
+    args = parser.parse_args()
+    spec = defaults._replace(
+        patients=args.patients, labs_per_patient=args.labs_per_patient
+    )
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = database.setup(f"sqlite:///{directory}/statements.db")
+        results = run_statements(engine, spec, args.iterations, args.warmup)
+        engine.dispose()
+
+    for name, result in results.items():
+        line = f"{name:<36} mean {1000 * result.mean_ms:>10.1f} us"
+        operation, variant = name.rsplit(".", 1)
+        if variant != VARIANTS[0]:
+            before = results[f"{operation}.{VARIANTS[0]}"]
+            line += f" ({result.mean_ms / before.mean_ms:.0%} of before)"
+        print(line)
+    if args.output:
+        args.output.write_text(
+            json.dumps(
+                {
+                    "config": {
+                        **spec._asdict(),
+                        "iterations": args.iterations,
+                        "warmup": args.warmup,
+                    },
+                    "results": {
+                        name: result._asdict()
+                        for name, result in results.items()
+                    },
+                },
+                indent=2,
+            )
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
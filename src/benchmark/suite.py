@@ -0,0 +1,239 @@
+"""Benchmarks of the HTTP API and the DAOs."""
+
+import random
+import tempfile
+from collections.abc import Callable
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any
+
+from fastapi.testclient import TestClient
+from sqlalchemy import Engine
+from sqlalchemy.orm import Session
+
+from api import analytics
+from api.api import app, get_engine, lab_catalogue, patient_filter
+from api.exports import ExportFilter, ExportStore, export_labs
+from benchmark.data import (
+    DataSpec,
+    generate,
+    lab_specs,
+    make_labs,
+    make_patients,
+)
+from benchmark.runner import Result, measure
+from dao.admission_dao import AdmissionDao
+from dao.change_dao import ChangeDao
+from dao.lab_dao import LabDao
+from dao.lab_name_dao import LabNameDao, search_terms
+from dao.lab_store import LabStore
+from dao.models import Lab
+from dao.patient_dao import PatientDao
+
+Operation = Callable[[int], Any]
+
+
+def new_lab(patient_id: str, index: int) -> dict[str, Any]:
+    """Make a lab body whose natural key is unique to the iteration."""
+    return {
+        "patient_id": patient_id,
+        "admission_number": 0,
+        "datetime": datetime(2000, 1, 1) + timedelta(seconds=index),
+        "name": "BENCHMARK: LAB",
+        "value": 1.0,
+        "units": "units",
+    }
+
+
+def run_suite(
+    engine: Engine,
+    spec: DataSpec,
+    iterations: int = 100,
+    warmup: int = 5,
+    only: str = "",
+) -> dict[str, Result]:
+    """Populate a database and run every benchmark whose name has `only`.
+
+    Read benchmarks run before those that create and delete, so that they
+    all see the data set described by `spec`.
+    """
+    patients = generate(engine, spec)
+    labs = [(lab.id, lab.patient_id) for lab in LabDao(engine).list()]
+    # Patients with labs for the delete benchmarks to remove.
+    rng = random.Random(f"{spec.seed}-victims")
+    victims = list(
+        PatientDao(engine).create_many(
+            make_patients(
+                spec._replace(patients=2 * (iterations + warmup)), rng
+            )
+        )
+    )
+    for victim in victims:
+        LabDao(engine).create_many(make_labs(victim.id, spec, rng))
+    # Labs for the lab delete benchmarks to remove, of a patient deleted last.
+    doomed = [
+        lab.id
+        for lab in LabDao(engine).create_many(
+            Lab(**new_lab(victims[0].id, 30_000_000 + index))
+            for index in range(2 * (iterations + warmup))
+        )
+    ]
+
+    app.dependency_overrides[get_engine] = lambda: engine
+    lab_catalogue.clear()  # ids of another database's entries
+    if patient_filter is not None:
+        patient_filter.clear()
+    client = TestClient(app)
+    patient_dao = PatientDao(engine)
+    lab_dao = LabDao(engine)
+    change_dao = ChangeDao(engine)
+    admission_dao = AdmissionDao(engine)
+    lab_name_dao = LabNameDao(engine)
+    lab_name_dao.refresh_counts()
+    directory = tempfile.TemporaryDirectory()
+    lab_store = LabStore(Path(directory.name) / "store")
+    with Session(engine) as session:
+        lab_store.refresh(session)
+    export_store = ExportStore(Path(directory.name) / "exports")
+    lab_name = lab_specs(spec.lab_names)[0].name
+    # A prefix of the lab name's last word, as typed while searching.
+    name_query = search_terms(lab_name)[-1][:4]
+    cohort_ids = [patient.id for patient in patients[:100]]
+
+    def patient_id(index: int) -> str:
+        return patients[index % len(patients)].id
+
+    def lab_id(index: int) -> str:
+        return labs[index % len(labs)][0]
+
+    def lab_url(index: int) -> str:
+        lab_id, patient_id = labs[index % len(labs)]
+        return f"/patients/{patient_id}/labs/{lab_id}"
+
+    def api_lab(index: int) -> dict[str, Any]:
+        lab = new_lab(patient_id(index), index)
+        del lab["patient_id"]
+        return {**lab, "datetime": lab["datetime"].isoformat()}
+
+    def get(url: str, **params: Any) -> Any:
+        response = client.get(url, params=params)
+        response.raise_for_status()
+        return response
+
+    def windows(store: LabStore | None) -> Any:
+        return analytics.windows(
+            engine, store, cohort_ids, lab_name, 24.0, 10.0, False
+        )
+
+    patient_body = {
+        "date_of_birth": "2016-10-17T00:00:00",
+        "gender": "male",
+        "language": "English",
+        "marital_status": "married",
+        "race": "White",
+    }
+    benchmarks: dict[str, Operation] = {
+        # reads
+        "dao.patient.read": lambda i: patient_dao.read(patient_id(i)),
+        "dao.patient.check": lambda i: patient_dao.check(patient_id(i)),
+        "dao.patient.list": lambda i: patient_dao.list(),
+        "dao.lab.read": lambda i: lab_dao.read(lab_id(i)),
+        "dao.lab.list": lambda i: lab_dao.list(),
+        "dao.change.list": lambda i: change_dao.list(limit=1000),
+        "dao.lab.aggregate": lambda i: lab_dao.aggregate(lab_name),
+        "dao.lab.series": lambda i: lab_dao.series(patient_id(i), lab_name),
+        "dao.lab.cohort": lambda i: lab_dao.cohort(lab_name, minimum=100),
+        "store.lab.aggregate": lambda i: lab_store.aggregate(lab_name),
+        "store.lab.series": lambda i: lab_store.series(
+            patient_id(i), lab_name
+        ),
+        "store.lab.cohort": lambda i: lab_store.cohort(lab_name, minimum=100),
+        "dao.lab.batch": lambda i: lab_dao.batch(patient_id(i)),
+        "dao.lab.windows": lambda i: windows(None),
+        "store.lab.windows": lambda i: windows(lab_store),
+        "dao.lab_name.search": lambda i: lab_name_dao.search(name_query),
+        "dao.admission.list": lambda i: admission_dao.list(patient_id(i)),
+        "dao.lab.batch_admission": lambda i: lab_dao.batch(patient_id(i), 0),
+        "export.labs": lambda i: export_labs(
+            engine,
+            export_store,
+            export_store.create(),
+            ExportFilter(lab_name),
+            10_000,
+        ),
+        "api.read_patient": lambda i: get(f"/patients/{patient_id(i)}"),
+        "api.list_patients": lambda i: get("/patients"),
+        "api.list_labs": lambda i: get(f"/patients/{patient_id(i)}/labs"),
+        "api.read_lab": lambda i: get(lab_url(i)),
+        "api.list_changes": lambda i: get("/changes", limit=1000),
+        "api.aggregate_labs": lambda i: get("/labs/aggregate", name=lab_name),
+        "api.read_lab_series": lambda i: get(
+            f"/patients/{patient_id(i)}/labs/series", name=lab_name
+        ),
+        "api.find_cohort": lambda i: get(
+            "/labs/cohort", name=lab_name, minimum=100
+        ),
+        "api.read_lab_windows": lambda i: get(
+            f"/patients/{patient_id(i)}/labs/windows", name=lab_name
+        ),
+        "api.compute_lab_windows": lambda i: client.post(
+            "/labs/windows",
+            json={"patient_ids": cohort_ids, "name": lab_name},
+        ).raise_for_status(),
+        "api.search_lab_names": lambda i: get("/labs/names", q=name_query),
+        "api.list_admissions": lambda i: get(
+            f"/patients/{patient_id(i)}/admissions"
+        ),
+        "api.list_admission_labs": lambda i: get(
+            f"/patients/{patient_id(i)}/admissions/0/labs"
+        ),
+        # writes
+        "dao.patient.create": lambda i: patient_dao.create(
+            date_of_birth=datetime(2016, 10, 17)
+        ),
+        "dao.lab.create": lambda i: lab_dao.create(
+            **new_lab(patient_id(i), i)
+        ),
+        "dao.lab.create_many": lambda i: lab_dao.create_many(
+            [
+                Lab(**new_lab(patient_id(i), 1_000_000 + 100 * i + j))
+                for j in range(100)
+            ]
+        ),
+        "api.create_patient": lambda i: client.post(
+            "/patients", json=patient_body
+        ).raise_for_status(),
+        "api.create_lab": lambda i: client.post(
+            f"/patients/{patient_id(i)}/labs", json=api_lab(10_000_000 + i)
+        ).raise_for_status(),
+        "api.create_labs": lambda i: client.post(
+            f"/patients/{patient_id(i)}/labs/bulk",
+            json=[api_lab(20_000_000 + 100 * i + j) for j in range(100)],
+        ).raise_for_status(),
+        "dao.lab_name.refresh": lambda i: lab_name_dao.refresh_counts(),
+        "dao.admission.update": lambda i: admission_dao.update(
+            patient_id(i), 0, datetime(2000, 1, 1), datetime(2000, 1, 2)
+        ),
+        "api.update_admission": lambda i: client.put(
+            f"/patients/{patient_id(i)}/admissions/0",
+            json={
+                "start": "2000-01-01T00:00:00",
+                "end": "2000-01-02T00:00:00",
+            },
+        ).raise_for_status(),
+        # deletes
+        "dao.lab.delete": lambda i: lab_dao.delete(doomed.pop()),
+        "dao.patient.delete": lambda i: patient_dao.delete(victims.pop().id),
+        "api.delete_patient": lambda i: client.delete(
+            f"/patients/{victims.pop().id}"
+        ).raise_for_status(),
+    }
+    try:
+        return {
+            name: measure(operation, iterations, warmup)
+            for name, operation in benchmarks.items()
+            if only in name
+        }
+    finally:
+        app.dependency_overrides.pop(get_engine)
+        directory.cleanup()
@@ -1,5 +1,29 @@
 """dao module."""
 
+from collections.abc import Callable, Iterable, Iterator
+from itertools import islice
+
+# Called with the number of rows each fetch of the DAOs reads without the
+# ORM, which unlike entities fire no load event.
+row_listeners: list[Callable[[int], None]] = []
+
 
 class NotFoundError(Exception):
     """Resource not found."""
+
+
+class ConflictError(Exception):
+    """Resource conflicts with an existing resource."""
+
+
+def batched(items: Iterable[str], size: int) -> Iterator[list[str]]:
+    """Split items into lists of at most `size`."""
+    iterator = iter(items)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def record_rows(count: int) -> None:
+    """Report rows fetched without the ORM to `row_listeners`."""
+    for listener in row_listeners:
+        listener(count)
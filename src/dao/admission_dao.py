@@ -0,0 +1,161 @@
+"""Admission data access."""
+
+from collections.abc import Iterable, Sequence
+from datetime import datetime
+
+from sqlalchemy import Engine, case, func, insert, select, update
+from sqlalchemy.orm import Session, sessionmaker
+
+from dao import NotFoundError
+from dao.models import Admission, Lab
+from dao.statements import dialect_insert, upsert_statement
+
+KEY = ["patient_id", "number"]
+
+
+def record_admissions(
+    labs: Iterable[tuple[str, int, datetime]], session: Session
+) -> None:
+    """Widen the admissions of labs to their times, creating them if needed.
+
+    `labs` are (patient id, admission number, datetime), and admissions are
+    updated with one statement.
+    """
+    bounds: dict[tuple[str, int], tuple[datetime, datetime]] = {}
+    for patient_id, number, time in labs:
+        first, last = bounds.get((patient_id, number), (time, time))
+        bounds[patient_id, number] = (min(first, time), max(last, time))
+    if not bounds:
+        return
+    statement = dialect_insert(Admission, session)
+    excluded = statement.excluded
+    session.execute(
+        statement.on_conflict_do_update(
+            index_elements=KEY,
+            set_={
+                "first_lab": case(
+                    (
+                        Admission.first_lab <= excluded.first_lab,
+                        Admission.first_lab,
+                    ),
+                    else_=excluded.first_lab,
+                ),
+                "last_lab": case(
+                    (
+                        Admission.last_lab >= excluded.last_lab,
+                        Admission.last_lab,
+                    ),
+                    else_=excluded.last_lab,
+                ),
+            },
+        ),
+        [
+            {
+                "patient_id": patient_id,
+                "number": number,
+                "first_lab": first,
+                "last_lab": last,
+            }
+            for (patient_id, number), (first, last) in bounds.items()
+        ],
+    )
+
+
+def refresh_admission(patient_id: str, number: int, session: Session) -> None:
+    """Recompute an admission's first and last lab, after labs are deleted."""
+    conditions = [Lab.patient_id == patient_id, Lab.admission_number == number]
+    session.execute(
+        update(Admission)
+        .where(Admission.patient_id == patient_id, Admission.number == number)
+        .values(
+            first_lab=select(func.min(Lab.datetime))
+            .where(*conditions)
+            .scalar_subquery(),
+            last_lab=select(func.max(Lab.datetime))
+            .where(*conditions)
+            .scalar_subquery(),
+        )
+    )
+
+
+def backfill_admissions(session: Session) -> None:
+    """Create the admissions of existing labs, if there are none yet."""
+    if session.scalar(select(Admission.number).limit(1)) is not None:
+        return
+    session.execute(
+        insert(Admission).from_select(
+            ["patient_id", "number", "first_lab", "last_lab"],
+            select(
+                Lab.patient_id,
+                Lab.admission_number,
+                func.min(Lab.datetime),
+                func.max(Lab.datetime),
+            ).group_by(Lab.patient_id, Lab.admission_number),
+        )
+    )
+
+
+class AdmissionDao:
+    """Admission data access object."""
+
+    def __init__(self, engine: Engine) -> None:
+        """Initialize."""
+        self.engine = engine
+        self.Session = sessionmaker(bind=self.engine, expire_on_commit=False)
+
+    def read(self, patient_id: str, number: int) -> Admission:
+        """Get an admission."""
+        with self.Session.begin() as session:
+            return self._read(patient_id, number, session)
+
+    def _read(
+        self, patient_id: str, number: int, session: Session
+    ) -> Admission:
+        """Get an admission in a session."""
+        admission = session.get(Admission, (patient_id, number))
+        if admission is None:
+            raise NotFoundError(
+                f"No admission {number} found for patient {patient_id}"
+            )
+        return admission
+
+    def update(
+        self,
+        patient_id: str,
+        number: int,
+        start: datetime | None,
+        end: datetime | None,
+    ) -> Admission:
+        """Set an admission's start and end, creating it if needed."""
+        with self.Session.begin() as session:
+            return self._update(patient_id, number, start, end, session)
+
+    def _update(
+        self,
+        patient_id: str,
+        number: int,
+        start: datetime | None,
+        end: datetime | None,
+        session: Session,
+    ) -> Admission:
+        """Set an admission's start and end, creating it if needed."""
+        statement = upsert_statement(
+            Admission, KEY, ["start", "end"], session
+        ).values(patient_id=patient_id, number=number, start=start, end=end)
+        session.execute(statement)
+        admission = self._read(patient_id, number, session)
+        session.refresh(admission)
+        return admission
+
+    def list(self, patient_id: str) -> Sequence[Admission]:
+        """List a patient's admissions."""
+        with self.Session.begin() as session:
+            return self._list(patient_id, session)
+
+    def _list(self, patient_id: str, session: Session) -> Sequence[Admission]:
+        """List a patient's admissions, in number order."""
+        return session.scalars(
+            select(Admission)
+            .where(Admission.patient_id == patient_id)
+            .order_by(Admission.number)
+        ).all()
@@ -0,0 +1,90 @@
+"""Change log data access."""
+
+from collections.abc import Iterable, Sequence
+
+from sqlalchemy import (
+    Engine,
+    Select,
+    insert,
+    literal,
+    select,
+)
+from sqlalchemy.orm import Session, sessionmaker
+
+from dao.models import Change, Entity, Operation
+
+
+def record_change(
+    entity: Entity,
+    entity_id: str,
+    operation: Operation,
+    session: Session,
+) -> None:
+    """Record a change in the session's transaction."""
+    session.add(
+        Change(entity=entity, entity_id=entity_id, operation=operation)
+    )
+
+
+def record_many_changes(
+    entity: Entity,
+    changes: Iterable[tuple[str, Operation]],
+    session: Session,
+) -> None:
+    """Record changes to many entities with one bulk INSERT."""
+    rows = [
+        {"entity": entity, "entity_id": entity_id, "operation": operation}
+        for entity_id, operation in changes
+    ]
+    if rows:
+        session.execute(insert(Change), rows)
+
+
+def record_changes(
+    entity: Entity,
+    entity_ids: Select[tuple[str]],
+    operation: Operation,
+    session: Session,
+) -> None:
+    """Record a change for every id selected, in one INSERT ... SELECT."""
+    columns = Change.__table__.c
+    ids = entity_ids.subquery()
+    session.execute(
+        insert(Change).from_select(
+            ["entity", "entity_id", "operation"],
+            select(
+                literal(entity, columns.entity.type),
+                ids.c[0],
+                literal(operation, columns.operation.type),
+            ),
+        )
+    )
+
+
+class ChangeDao:
+    """Change log data access object."""
+
+    def __init__(self, engine: Engine) -> None:
+        """Initialize."""
+        self.engine = engine
+        self.Session = sessionmaker(bind=self.engine, expire_on_commit=False)
+
+    def list(self, since: int = 0, limit: int = 1000) -> Sequence[Change]:
+        """List changes after a sequence number."""
+        with self.Session.begin() as session:
+            return self._list(since, limit, session)
+
+    def _list(
+        self, since: int, limit: int, session: Session
+    ) -> Sequence[Change]:
+        """List changes after a sequence number.
+
+        Only SQLite guarantees that no change with a lower sequence number
+        becomes visible later (see `dao.models.Change`).
+        """
+        return session.scalars(
+            select(Change)
+            .where(Change.seq > since)
+            .order_by(Change.seq)
+            .limit(limit)
+        ).all()
@@ -0,0 +1,186 @@
+"""Idempotency key data access."""
+
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from datetime import datetime, timedelta
+
+from sqlalchemy import (
+    Engine,
+    delete,
+    event,
+    select,
+)
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, sessionmaker
+
+from dao import ConflictError
+from dao.models import IdempotencyRecord
+
+PENDING = "idempotency_pending"
+
+
+class KeyCache:
+    """Bounded, least-recently-used cache whose entries expire after a TTL."""
+
+    def __init__(
+        self,
+        max_size: int = 10_000,
+        ttl: float = 24 * 60 * 60,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """Initialize. `ttl` is in seconds."""
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.entries: OrderedDict[
+            tuple[str, str], tuple[float, IdempotencyRecord]
+        ] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, scope: str, key: str) -> IdempotencyRecord | None:
+        """Get a live record."""
+        with self.lock:
+            entry = self.entries.get((scope, key))
+            if entry is None:
+                return None
+            expires, record = entry
+            if expires <= self.clock():
+                del self.entries[(scope, key)]
+                return None
+            self.entries.move_to_end((scope, key))
+            return record
+
+    def put(self, record: IdempotencyRecord, ttl: float | None = None) -> None:
+        """Add a record, evicting the least recently used if full."""
+        with self.lock:
+            self.entries[(record.scope, record.key)] = (
+                self.clock() + (self.ttl if ttl is None else ttl),
+                record,
+            )
+            self.entries.move_to_end((record.scope, record.key))
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Remove all records."""
+        with self.lock:
+            self.entries.clear()
+
+
+class IdempotencyDao:
+    """Idempotency record data access object.
+
+    Records are looked up in an in-process cache first, falling back to the
+    database so that keys survive restarts and are shared between processes.
+    """
+
+    def __init__(self, engine: Engine, cache: KeyCache) -> None:
+        """Initialize."""
+        self.engine = engine
+        self.cache = cache
+        self.Session = sessionmaker(bind=self.engine, expire_on_commit=False)
+
+    def create(
+        self, scope: str, key: str, fingerprint: str, response: str
+    ) -> IdempotencyRecord:
+        """Record the response for a key."""
+        with self.Session.begin() as session:
+            return self._create(scope, key, fingerprint, response, session)
+
+    def _create(
+        self,
+        scope: str,
+        key: str,
+        fingerprint: str,
+        response: str,
+        session: Session,
+    ) -> IdempotencyRecord:
+        """Record the response for a key, in the transaction of its request.
+
+        The record is inserted before the request's writes commit, so that
+        they commit together. If another request recorded the key first,
+        the transaction is rolled back and ConflictError raised. Records
+        are only cached once committed.
+        """
+        # An expired record with the same key is replaced.
+        session.execute(
+            delete(IdempotencyRecord).where(
+                IdempotencyRecord.scope == scope,
+                IdempotencyRecord.key == key,
+                IdempotencyRecord.created <= self._cutoff(),
+            )
+        )
+        record = IdempotencyRecord(
+            scope=scope,
+            key=key,
+            fingerprint=fingerprint,
+            response=response,
+            created=datetime.now(),
+        )
+        session.add(record)
+        try:
+            session.flush()
+        except IntegrityError as e:
+            session.rollback()
+            raise ConflictError(
+                f"Idempotency-Key {key} was recorded by another request"
+            ) from e
+        session.info.setdefault(PENDING, []).append((self.cache, record))
+        return record
+
+    def read(self, scope: str, key: str) -> IdempotencyRecord | None:
+        """Get the live record for a key, if any."""
+        with self.Session.begin() as session:
+            return self._read(scope, key, session)
+
+    def _read(
+        self, scope: str, key: str, session: Session
+    ) -> IdempotencyRecord | None:
+        """Get the live record for a key, if any."""
+        record = self.cache.get(scope, key)
+        if record is not None:
+            return record
+        record = session.scalars(
+            select(IdempotencyRecord).where(
+                IdempotencyRecord.scope == scope,
+                IdempotencyRecord.key == key,
+                IdempotencyRecord.created > self._cutoff(),
+            )
+        ).one_or_none()
+        if record is not None:
+            age = datetime.now() - record.created
+            self.cache.put(record, self.cache.ttl - age.total_seconds())
+        return record
+
+    def purge(self) -> int:
+        """Delete expired records, returning the number deleted."""
+        with self.Session.begin() as session:
+            return self._purge(session)
+
+    def _purge(self, session: Session) -> int:
+        """Delete expired records, returning the number deleted."""
+        result = session.execute(
+            delete(IdempotencyRecord).where(
+                IdempotencyRecord.created <= self._cutoff()
+            )
+        )
+        return result.rowcount
+
+    def _cutoff(self) -> datetime:
+        """Get the creation time before which records have expired."""
+        return datetime.now() - timedelta(seconds=self.cache.ttl)
+
+
+@event.listens_for(Session, "after_commit")
+def cache_created_records(session: Session) -> None:
+    """Cache the records created in a committed transaction."""
+    for cache, record in session.info.pop(PENDING, []):
+        cache.put(record)
+
+
+@event.listens_for(Session, "after_rollback")
+def forget_created_records(session: Session) -> None:
+    """Forget the records created in a rolled back transaction."""
+    session.info.pop(PENDING, None)
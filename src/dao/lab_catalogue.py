@@ -0,0 +1,129 @@
+"""Lab catalogue, and a cache translating lab names and units to entries."""
+
+import re
+import threading
+from typing import NamedTuple
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from dao.models import LabCatalogue
+from dao.statements import insert_missing_statement
+from dao.units import UnitRegistry, registry
+
+PENDING = "lab_catalogue_pending"
+
+
+def catalogue_code(name: str) -> str:
+    """Get the canonical code of a lab name.
+
+    Codes ignore case, punctuation and spacing, so that "CBC: HEMOGLOBIN"
+    and "cbc hemoglobin" share one.
+    """
+    return "_".join(re.findall(r"[A-Z0-9]+", name.upper()))
+
+
+class Entry(NamedTuple):
+    """Catalogue entry."""
+
+    id: int
+    name: str
+    units: str
+    code: str
+    normalized_units: str
+    factor: float
+    offset: float
+
+
+class LabCatalogueCache:
+    """Catalogue entries by name and units, shared across sessions.
+
+    Entries are never deleted, so cached ones stay valid. Entries created in
+    a transaction are only cached once it commits. New entries take their
+    unit conversion from `units`.
+    """
+
+    def __init__(self, units: UnitRegistry = registry) -> None:
+        """Initialize."""
+        self.units = units
+        self.entries: dict[tuple[str, str], LabCatalogue] = {}
+        self.lock = threading.Lock()
+
+    def get(self, name: str, units: str) -> LabCatalogue | None:
+        """Get a cached entry, detached from any session."""
+        with self.lock:
+            return self.entries.get((name, units))
+
+    def put(self, entry: Entry) -> None:
+        """Cache an entry."""
+        detached = LabCatalogue(**entry._asdict())
+        make_transient_to_detached(detached)
+        with self.lock:
+            self.entries[entry.name, entry.units] = detached
+
+    def clear(self) -> None:
+        """Forget all entries."""
+        with self.lock:
+            self.entries.clear()
+
+    def resolve(self, name: str, units: str, session: Session) -> LabCatalogue:
+        """Get the entry for a name and units, creating it if needed."""
+        cached = self.get(name, units)
+        if cached is not None:
+            return session.merge(cached, load=False)
+        statement = select(LabCatalogue).where(
+            LabCatalogue.name == name, LabCatalogue.units == units
+        )
+        entry = session.scalars(statement).one_or_none()
+        created = None
+        if entry is None:
+            code = catalogue_code(name)
+            conversion = self.units.conversion(code, units)
+            # Another transaction may be creating the same entry.
+            created = session.scalar(
+                insert_missing_statement(
+                    LabCatalogue, ["name", "units"], session
+                )
+                .values(
+                    name=name,
+                    units=units,
+                    code=code,
+                    normalized_units=conversion.units,
+                    factor=conversion.factor,
+                    offset=conversion.offset,
+                )
+                .returning(LabCatalogue.id)
+            )
+            entry = session.scalars(statement).one()
+        pending = session.info.setdefault(PENDING, [])
+        if created is not None:
+            pending.append((self, entry_of(entry)))
+        elif all(other.id != entry.id for _, other in pending):
+            self.put(entry_of(entry))
+        return entry
+
+
+def entry_of(entry: LabCatalogue) -> Entry:
+    """Get the values of a catalogue entry."""
+    return Entry(
+        entry.id,
+        entry.name,
+        entry.units,
+        entry.code,
+        entry.normalized_units,
+        entry.factor,
+        entry.offset,
+    )
+
+
+@event.listens_for(Session, "after_commit")
+def cache_created_entries(session: Session) -> None:
+    """Cache the entries created in a committed transaction."""
+    for cache, entry in session.info.pop(PENDING, []):
+        cache.put(entry)
+
+
+@event.listens_for(Session, "after_rollback")
+def forget_created_entries(session: Session) -> None:
+    """Forget the entries created in a rolled back transaction."""
+    session.info.pop(PENDING, None)
@@ -1,27 +1,213 @@
 """Lab data access."""
 
 import uuid
-from collections.abc import Sequence
-from datetime import datetime
+from array import array
+from collections.abc import Iterable, Iterator, Sequence
+from datetime import datetime, timedelta
+from typing import Any, NamedTuple
 
 from sqlalchemy import (
+    ColumnElement,
     Engine,
+    Select,
+    func,
+    insert,
+    lambda_stmt,
     select,
 )
-from sqlalchemy.exc import NoResultFound
-from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.exc import IntegrityError, NoResultFound
+from sqlalchemy.orm import InstrumentedAttribute, Session, sessionmaker
+from sqlalchemy.orm.attributes import set_committed_value
 
-from dao import NotFoundError
-from dao.models import Lab
+from dao import ConflictError, NotFoundError, batched, record_rows
+from dao.admission_dao import record_admissions, refresh_admission
+from dao.change_dao import record_change, record_many_changes
+from dao.lab_catalogue import LabCatalogueCache
+from dao.models import Entity, Lab, LabCatalogue, Operation
+from dao.statements import upsert_statement
+from dao.units import normalize
+
+NATURAL_KEY = ["patient_id", "admission_number", "datetime", "catalogue_id"]
+# Keep IN lists well under SQLite's bound parameter limit.
+IN_CHUNK_SIZE = 500
+# Columns that a re-sent lab updates, rather than creating another lab.
+UPSERT_COLUMNS = ["value", "normalized_value"]
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+
+class LabAggregate(NamedTuple):
+    """Summary statistics of the values of a lab in some units."""
+
+    name: str
+    units: str
+    labs: int
+    mean: float
+    minimum: float
+    maximum: float
+
+
+class LabPoint(NamedTuple):
+    """Value of a lab at a time."""
+
+    datetime: datetime
+    value: float
+    units: str
+
+
+class PatientLabPoint(NamedTuple):
+    """Value of a lab of a patient at a time."""
+
+    patient_id: str
+    datetime: datetime
+    value: float
+    units: str
+
+
+class LabRecord(NamedTuple):
+    """Lab as a flat row, for lists and exports."""
+
+    id: str
+    patient_id: str
+    admission_number: int
+    name: str
+    value: float
+    units: str
+    datetime: datetime
+
+
+class LabBatch:
+    """Labs held column by column, for reading many at once.
+
+    Numbers and datetimes are kept in typed arrays, and each lab refers to
+    its patient and catalogue entry by index into lists holding each of
+    them once, so a lab costs little more than its id. Datetimes are kept
+    as microseconds since the epoch.
+    """
+
+    __slots__ = (
+        "ids",
+        "patient_indexes",
+        "admission_numbers",
+        "datetimes",
+        "values",
+        "normalized_values",
+        "entry_indexes",
+        "patients",
+        "entries",
+        "patient_index",
+        "entry_index",
+    )
+
+    def __init__(self) -> None:
+        """Initialize empty."""
+        self.ids: list[str] = []
+        self.patient_indexes = array("l")
+        self.admission_numbers = array("q")
+        self.datetimes = array("q")
+        self.values = array("d")
+        self.normalized_values = array("d")
+        self.entry_indexes = array("l")
+        self.patients: list[str] = []
+        # Name, units and normalized units of each catalogue entry.
+        self.entries: list[tuple[str, str, str]] = []
+        self.patient_index: dict[str, int] = {}
+        self.entry_index: dict[int, int] = {}  # by catalogue id
+
+    def __len__(self) -> int:
+        """Get the number of labs."""
+        return len(self.ids)
+
+    def append(
+        self,
+        id: str,
+        patient_id: str,
+        admission_number: int,
+        datetime: datetime,
+        value: float,
+        normalized_value: float,
+        catalogue_id: int,
+        name: str,
+        units: str,
+        normalized_units: str,
+    ) -> None:
+        """Add a lab."""
+        patient_index = self.patient_index.get(patient_id)
+        if patient_index is None:
+            patient_index = self.patient_index[patient_id] = len(self.patients)
+            self.patients.append(patient_id)
+        entry_index = self.entry_index.get(catalogue_id)
+        if entry_index is None:
+            entry_index = self.entry_index[catalogue_id] = len(self.entries)
+            self.entries.append((name, units, normalized_units))
+        self.ids.append(id)
+        self.patient_indexes.append(patient_index)
+        self.admission_numbers.append(admission_number)
+        self.datetimes.append((datetime - EPOCH) // MICROSECOND)
+        self.values.append(value)
+        self.normalized_values.append(normalized_value)
+        self.entry_indexes.append(entry_index)
+
+    def records(self, normalize: bool = False) -> Iterator[LabRecord]:
+        """Get the labs one at a time, with raw or normalized values."""
+        values = self.normalized_values if normalize else self.values
+        units_index = 2 if normalize else 1
+        for index, id in enumerate(self.ids):
+            entry = self.entries[self.entry_indexes[index]]
+            yield LabRecord(
+                id,
+                self.patients[self.patient_indexes[index]],
+                self.admission_numbers[index],
+                entry[0],
+                values[index],
+                entry[units_index],
+                EPOCH + self.datetimes[index] * MICROSECOND,
+            )
+
+
+BATCH_COLUMNS = (
+    Lab.id,
+    Lab.patient_id,
+    Lab.admission_number,
+    Lab.datetime,
+    Lab.value,
+    Lab.normalized_value,
+    Lab.catalogue_id,
+    LabCatalogue.name,
+    LabCatalogue.units,
+    LabCatalogue.normalized_units,
+)
+
+
+def fetch_batch(statement: Select[Any], session: Session) -> LabBatch:
+    """Read the labs selected by a statement on `BATCH_COLUMNS` into a batch.
+
+    Rows are fetched through the session's connection and added to the
+    batch as they are read, so no entity or row list is built.
+    """
+    batch = LabBatch()
+    for row in session.connection().execute(statement):
+        batch.append(*row)
+    record_rows(len(batch))
+    return batch
 
 
 class LabDao:
     """Lab data access object."""
 
-    def __init__(self, engine: Engine) -> None:
-        """Initialize."""
+    def __init__(
+        self, engine: Engine, catalogue: LabCatalogueCache | None = None
+    ) -> None:
+        """Initialize.
+
+        Share a `catalogue` cache between DAOs of the same database to save
+        looking up the catalogue entries of labs' names and units.
+        """
         self.engine = engine
         self.Session = sessionmaker(bind=self.engine, expire_on_commit=False)
+        self.catalogue = (
+            LabCatalogueCache() if catalogue is None else catalogue
+        )
 
     def create(
         self,
@@ -31,8 +217,14 @@ class LabDao:
         name: str,
         value: float,
         units: str,
+        upsert: bool = False,
     ) -> Lab:
-        """Create a lab."""
+        """Create a lab.
+
+        If a lab with the same natural key (patient, admission, datetime,
+        name and units) exists, raise ConflictError, or update it if
+        `upsert` is set.
+        """
         with self.Session.begin() as session:
             return self._create(
                 patient_id,
@@ -42,6 +234,7 @@ class LabDao:
                 value,
                 units,
                 session,
+                upsert,
             )
 
     def _create(
@@ -53,31 +246,154 @@ class LabDao:
         value: float,
         units: str,
         session: Session,
+        upsert: bool = False,
+        lab_id: str | None = None,
     ) -> Lab:
-        """Create a lab."""
-        id = str(uuid.uuid4())
+        """Create a lab in a session, leaving it to commit.
+
+        The lab is given `lab_id` if set, unless `upsert` updates an
+        existing lab instead.
+        """
+        if upsert:
+            lab = Lab(
+                id=lab_id,
+                patient_id=patient_id,
+                admission_number=admission_number,
+                datetime=datetime,
+                name=name,
+                value=value,
+                units=units,
+            )
+            return self._create_many([lab], session, upsert=True)[0]
+        entry = self.catalogue.resolve(name, units, session)
         lab = Lab(
-            id=id,
+            id=lab_id or str(uuid.uuid4()),
             patient_id=patient_id,
             admission_number=admission_number,
             datetime=datetime,
-            name=name,
+            catalogue=entry,
             value=value,
-            units=units,
+            normalized_value=value * entry.factor + entry.offset,
         )
         session.add(lab)
-        session.commit()
+        record_change(Entity.lab, lab.id, Operation.create, session)
+        try:
+            record_admissions(
+                [(patient_id, admission_number, datetime)], session
+            )
+            session.flush()
+        except IntegrityError as e:
+            session.rollback()
+            raise ConflictError(
+                f"Lab conflicts with an existing lab for patient {patient_id}"
+            ) from e
         return lab
 
+    def create_many(
+        self, labs: Iterable[Lab], upsert: bool = False
+    ) -> Sequence[Lab]:
+        """Create labs in one statement.
+
+        If a lab with the same natural key (patient, admission, datetime,
+        name and units) exists, raise ConflictError, or update it if
+        `upsert` is set.
+        """
+        with self.Session.begin() as session:
+            return self._create_many(labs, session, upsert)
+
+    def _create_many(
+        self, labs: Iterable[Lab], session: Session, upsert: bool = False
+    ) -> Sequence[Lab]:
+        """Create labs in one statement.
+
+        Ids are assigned to labs that do not have one. With `upsert`,
+        conflicts on the natural key are resolved by the database (`INSERT
+        ... ON CONFLICT DO UPDATE`), and the later of several labs with the
+        same natural key in `labs` wins; without it, they conflict. Values
+        are normalized in one vectorized step. The caller commits.
+        """
+        entries: dict[tuple[str, str], LabCatalogue] = {}
+        rows: dict[Any, dict[str, Any]] = {}
+        for index, lab in enumerate(labs):
+            if (lab.name, lab.units) not in entries:
+                entries[lab.name, lab.units] = self.catalogue.resolve(
+                    lab.name, lab.units, session
+                )
+            row = {
+                "id": lab.id or str(uuid.uuid4()),
+                "patient_id": lab.patient_id,
+                "admission_number": lab.admission_number,
+                "datetime": lab.datetime,
+                "catalogue_id": entries[lab.name, lab.units].id,
+                "value": lab.value,
+            }
+            # Only an upsert may send a lab twice; otherwise both conflict.
+            key = (
+                tuple(row[column] for column in NATURAL_KEY)
+                if upsert
+                else index
+            )
+            rows[key] = row
+        if not rows:
+            return []
+        by_id = {entry.id: entry for entry in entries.values()}
+        normalize_rows(list(rows.values()), by_id)
+        statement = (
+            upsert_statement(Lab, NATURAL_KEY, UPSERT_COLUMNS, session)
+            if upsert
+            else insert(Lab)
+        )
+        try:
+            created = session.scalars(
+                statement.returning(Lab),
+                list(rows.values()),
+                execution_options={"populate_existing": True},
+            ).all()
+            # RETURNING cannot load the catalogue entries with a join.
+            for lab in created:
+                set_committed_value(  # type: ignore[no-untyped-call]
+                    lab,
+                    "catalogue",
+                    by_id[lab.catalogue_id],
+                )
+            ids = {row["id"] for row in rows.values()}
+            record_many_changes(
+                Entity.lab,
+                (
+                    (
+                        lab.id,
+                        Operation.create
+                        if lab.id in ids
+                        else Operation.update,
+                    )
+                    for lab in created
+                ),
+                session,
+            )
+            record_admissions(
+                (
+                    (lab.patient_id, lab.admission_number, lab.datetime)
+                    for lab in created
+                ),
+                session,
+            )
+            session.flush()
+        except IntegrityError as e:
+            session.rollback()
+            raise ConflictError("Labs conflict with existing labs") from e
+        return created
+
     def read(self, lab_id: str) -> Lab:
         """Get a lab."""
         with self.Session.begin() as session:
             return self._read(lab_id, session)
 
     def _read(self, lab_id: str, session: Session) -> Lab:
-        """Get a lab in a session."""
+        """Get a lab in a session, with a lambda statement built once."""
         try:
-            result = session.scalars(select(Lab).where(Lab.id == lab_id)).one()
+            result: Lab = session.scalars(
+                lambda_stmt(lambda: select(Lab).where(Lab.id == lab_id))
+            ).one()
         except NoResultFound as e:
             raise NotFoundError(f"No lab found with id {lab_id}") from e
         return result
@@ -93,12 +409,306 @@ class LabDao:
     def _delete(self, lab: Lab, session: Session) -> None:
         """Delete a lab."""
         session.delete(lab)
+        record_change(Entity.lab, lab.id, Operation.delete, session)
+        session.flush()
+        refresh_admission(lab.patient_id, lab.admission_number, session)
 
-    def list(self) -> Sequence[Lab]:
+    def list(self) -> Sequence[LabRecord]:
         """List labs."""
         with self.Session.begin() as session:
             return self._list(session)
 
-    def _list(self, session: Session) -> Sequence[Lab]:
-        """List labs."""
-        return [row[0] for row in session.execute(select(Lab)).fetchall()]
+    def _list(self, session: Session) -> Sequence[LabRecord]:
+        """List labs.
+
+        Rows are fetched through the session's connection, skipping the ORM's
+        entity construction and identity map.
+        """
+        records = [
+            LabRecord(*row)
+            for row in session.connection().execute(
+                lambda_stmt(
+                    lambda: select(
+                        Lab.id,
+                        Lab.patient_id,
+                        Lab.admission_number,
+                        LabCatalogue.name,
+                        Lab.value,
+                        LabCatalogue.units,
+                        Lab.datetime,
+                    ).join(Lab.catalogue)
+                )
+            )
+        ]
+        record_rows(len(records))
+        return records
+
+    def batch(
+        self, patient_id: str, admission_number: int | None = None
+    ) -> LabBatch:
+        """Get a patient's labs, or those of one admission, as a batch."""
+        with self.Session.begin() as session:
+            return self._batch(patient_id, admission_number, session)
+
+    def _batch(
+        self,
+        patient_id: str,
+        admission_number: int | None,
+        session: Session,
+    ) -> LabBatch:
+        """Get a patient's labs, or those of one admission, oldest first."""
+        conditions = [Lab.patient_id == patient_id]
+        if admission_number is not None:
+            conditions.append(Lab.admission_number == admission_number)
+        return fetch_batch(
+            select(*BATCH_COLUMNS)
+            .join(Lab.catalogue)
+            .where(*conditions)
+            .order_by(Lab.datetime, Lab.id),
+            session,
+        )
+
+    def aggregate(
+        self,
+        name: str,
+        start: datetime | None = None,
+        end: datetime | None = None,
+        normalize: bool = False,
+    ) -> Sequence[LabAggregate]:
+        """Summarize the values of a lab, by units."""
+        with self.Session.begin() as session:
+            return self._aggregate(name, start, end, session, normalize)
+
+    def _aggregate(
+        self,
+        name: str,
+        start: datetime | None,
+        end: datetime | None,
+        session: Session,
+        normalize: bool = False,
+    ) -> Sequence[LabAggregate]:
+        """Summarize the values of a lab in [start, end), by units.
+
+        With `normalize`, normalized values are summarized by normalized
+        units.
+        """
+        value, units = measurement(normalize)
+        statement = (
+            select(
+                LabCatalogue.name,
+                units,
+                func.count(),
+                func.avg(value),
+                func.min(value),
+                func.max(value),
+            )
+            .join(Lab.catalogue)
+            .where(LabCatalogue.name == name, *period(start, end))
+            .group_by(LabCatalogue.name, units)
+            .order_by(units)
+        )
+        return [LabAggregate(*row) for row in session.execute(statement)]
+
+    def series(
+        self, patient_id: str, name: str, normalize: bool = False
+    ) -> Sequence[LabPoint]:
+        """Get a patient's values of a lab, oldest first."""
+        with self.Session.begin() as session:
+            return self._series(patient_id, name, session, normalize)
+
+    def _series(
+        self,
+        patient_id: str,
+        name: str,
+        session: Session,
+        normalize: bool = False,
+    ) -> Sequence[LabPoint]:
+        """Get a patient's values of a lab, oldest first."""
+        value, units = measurement(normalize)
+        statement = (
+            select(Lab.datetime, value, units)
+            .join(Lab.catalogue)
+            .where(Lab.patient_id == patient_id, LabCatalogue.name == name)
+            .order_by(Lab.datetime)
+        )
+        return [LabPoint(*row) for row in session.execute(statement)]
+
+    def series_many(
+        self, patient_ids: Iterable[str], name: str, normalize: bool = False
+    ) -> Sequence[PatientLabPoint]:
+        """Get patients' values of a lab."""
+        with self.Session.begin() as session:
+            return self._series_many(patient_ids, name, session, normalize)
+
+    def _series_many(
+        self,
+        patient_ids: Iterable[str],
+        name: str,
+        session: Session,
+        normalize: bool = False,
+    ) -> Sequence[PatientLabPoint]:
+        """Get patients' values of a lab, by patient, units and then time.
+
+        Patients are queried a chunk at a time, each scanning the labs'
+        (patient, catalogue entry, datetime) index in order.
+        """
+        value, units = measurement(normalize)
+        points = []
+        for chunk in batched(sorted(set(patient_ids)), IN_CHUNK_SIZE):
+            statement = (
+                select(Lab.patient_id, Lab.datetime, value, units)
+                .join(Lab.catalogue)
+                .where(Lab.patient_id.in_(chunk), LabCatalogue.name == name)
+                .order_by(Lab.patient_id, units, Lab.datetime)
+            )
+            points += [
+                PatientLabPoint(*row) for row in session.execute(statement)
+            ]
+        return points
+
+    def cohort(
+        self,
+        name: str,
+        minimum: float | None = None,
+        maximum: float | None = None,
+        start: datetime | None = None,
+        end: datetime | None = None,
+        normalize: bool = False,
+    ) -> Sequence[str]:
+        """Get the ids of patients with a value of a lab in a range."""
+        with self.Session.begin() as session:
+            return self._cohort(
+                name, minimum, maximum, start, end, session, normalize
+            )
+
+    def _cohort(
+        self,
+        name: str,
+        minimum: float | None,
+        maximum: float | None,
+        start: datetime | None,
+        end: datetime | None,
+        session: Session,
+        normalize: bool = False,
+    ) -> Sequence[str]:
+        """Get the ids of patients with a value of a lab in a range.
+
+        The range is inclusive, and only labs in [start, end) count. With
+        `normalize`, the range is in the lab's normalized units.
+        """
+        value, _ = measurement(normalize)
+        conditions = [LabCatalogue.name == name, *period(start, end)]
+        if minimum is not None:
+            conditions.append(value >= minimum)
+        if maximum is not None:
+            conditions.append(value <= maximum)
+        statement = (
+            select(Lab.patient_id)
+            .join(Lab.catalogue)
+            .where(*conditions)
+            .distinct()
+            .order_by(Lab.patient_id)
+        )
+        return session.scalars(statement).all()
+
+    def page(
+        self,
+        after: str | None,
+        limit: int,
+        name: str | None = None,
+        start: datetime | None = None,
+        end: datetime | None = None,
+    ) -> LabBatch:
+        """Get a page of labs, in id order."""
+        with self.Session.begin() as session:
+            return self._page(after, limit, name, start, end, session)
+
+    def _page(
+        self,
+        after: str | None,
+        limit: int,
+        name: str | None,
+        start: datetime | None,
+        end: datetime | None,
+        session: Session,
+    ) -> LabBatch:
+        """Get up to `limit` labs with ids after `after`, in id order.
+
+        Only labs of `name`, if given, taken in [start, end) are included.
+        Paging on the id rather than an offset keeps every page as cheap as
+        the first.
+        """
+        conditions = filters(name, start, end)
+        if after is not None:
+            conditions.append(Lab.id > after)
+        return fetch_batch(
+            select(*BATCH_COLUMNS)
+            .join(Lab.catalogue)
+            .where(*conditions)
+            .order_by(Lab.id)
+            .limit(limit),
+            session,
+        )
+
+    def _count(
+        self,
+        name: str | None,
+        start: datetime | None,
+        end: datetime | None,
+        session: Session,
+    ) -> int:
+        """Count the labs of `name`, if given, taken in [start, end)."""
+        statement = (
+            select(func.count())
+            .select_from(Lab)
+            .join(Lab.catalogue)
+            .where(*filters(name, start, end))
+        )
+        return session.scalar(statement) or 0
+
+
+def normalize_rows(
+    rows: list[dict[str, Any]], entries: dict[int, LabCatalogue]
+) -> None:
+    """Set the normalized values of lab rows from their catalogue entries."""
+    for row, normalized_value in zip(
+        rows,
+        normalize(
+            [row["value"] for row in rows],
+            [entries[row["catalogue_id"]].factor for row in rows],
+            [entries[row["catalogue_id"]].offset for row in rows],
+        ),
+        strict=True,
+    ):
+        row["normalized_value"] = normalized_value
+
+
+def measurement(
+    normalize: bool,
+) -> tuple[InstrumentedAttribute[float], InstrumentedAttribute[str]]:
+    """Get the value and units columns, raw or normalized."""
+    if normalize:
+        return Lab.normalized_value, LabCatalogue.normalized_units
+    return Lab.value, LabCatalogue.units
+
+
+def period(
+    start: datetime | None, end: datetime | None
+) -> list[ColumnElement[bool]]:
+    """Get conditions selecting labs in [start, end)."""
+    conditions = []
+    if start is not None:
+        conditions.append(Lab.datetime >= start)
+    if end is not None:
+        conditions.append(Lab.datetime < end)
+    return conditions
+
+
+def filters(
+    name: str | None, start: datetime | None, end: datetime | None
+) -> list[ColumnElement[bool]]:
+    """Get conditions selecting labs of `name`, if given, in [start, end)."""
+    conditions = period(start, end)
+    if name is not None:
+        conditions.append(LabCatalogue.name == name)
+    return conditions
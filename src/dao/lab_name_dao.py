@@ -0,0 +1,140 @@
+"""Lab name search.
+
+Names are found through a full-text index of the lab catalogue, and ranked
+by how many labs they have, as last counted in `lab_counts`. Searches never
+scan the labs; the counts are recomputed from them now and then instead of
+as labs are written, which would make every writer of a lab update the same
+counts row.
+"""
+
+import re
+from typing import NamedTuple
+
+from sqlalchemy import (
+    ColumnElement,
+    Engine,
+    Select,
+    column,
+    delete,
+    func,
+    literal_column,
+    select,
+    table,
+)
+from sqlalchemy.orm import Session, sessionmaker
+
+from dao.models import LabCatalogue, LabCount, count_labs
+
+# The SQLite full-text index, kept outside of the ORM models.
+SEARCH = table("lab_catalogue_search", column("rowid"), column("name"))
+
+
+class LabUnits(NamedTuple):
+    """Units a lab has been taken in, with their number of labs."""
+
+    units: str
+    labs: int
+
+
+class LabName(NamedTuple):
+    """Name of a lab, with its number of labs in each of its units."""
+
+    name: str
+    labs: int
+    units: list[LabUnits]
+
+
+def search_terms(query: str) -> list[str]:
+    """Split a query into the words to match as prefixes, in lower case."""
+    return re.findall(r"[^\W_]+", query.lower())
+
+
+def matching_entries(terms: list[str], session: Session) -> Select[tuple[int]]:
+    """Select the ids of catalogue entries with a word starting with each term.
+
+    Uses the dialect's full-text index, so that prefixes are looked up
+    rather than matched against every name.
+    """
+    dialect = session.get_bind().dialect.name
+    if dialect == "sqlite":
+        match = " ".join(f'"{term}"*' for term in terms)
+        return select(SEARCH.c.rowid).where(
+            literal_column(SEARCH.name).op("MATCH")(f"name : ({match})")
+        )
+    if dialect == "postgresql":
+        condition: ColumnElement[bool] = func.to_tsvector(
+            literal_column("'simple'"), LabCatalogue.name
+        ).bool_op("@@")(
+            func.to_tsquery(
+                literal_column("'simple'"),
+                " & ".join(f"{term}:*" for term in terms),
+            )
+        )
+        return select(LabCatalogue.id).where(condition)
+    raise NotImplementedError(f"Lab name search is not supported on {dialect}")
+
+
+class LabNameDao:
+    """Lab name search data access object."""
+
+    def __init__(self, engine: Engine) -> None:
+        """Initialize."""
+        self.engine = engine
+        self.Session = sessionmaker(bind=self.engine, expire_on_commit=False)
+
+    def search(self, query: str, limit: int = 10) -> list[LabName]:
+        """Get the names with a word starting with each word of a query."""
+        with self.Session.begin() as session:
+            return self._search(query, limit, session)
+
+    def _search(
+        self, query: str, limit: int, session: Session
+    ) -> list[LabName]:
+        """Get the names matching a query in a session.
+
+        Names with the most labs come first, then in alphabetical order.
+        """
+        terms = search_terms(query)
+        if not terms:
+            return []
+        entries = matching_entries(terms, session).subquery()
+        labs = func.coalesce(LabCount.labs, 0)
+        matches = (
+            select(LabCatalogue.name, LabCatalogue.units, labs.label("labs"))
+            .join(entries, entries.c[0] == LabCatalogue.id)
+            .outerjoin(LabCount, LabCount.catalogue_id == LabCatalogue.id)
+            .subquery()
+        )
+        top = (
+            select(matches.c.name)
+            .group_by(matches.c.name)
+            .order_by(func.sum(matches.c.labs).desc(), matches.c.name)
+            .limit(limit)
+        )
+        rows = session.execute(
+            select(LabCatalogue.name, LabCatalogue.units, labs)
+            .outerjoin(LabCount, LabCount.catalogue_id == LabCatalogue.id)
+            .where(LabCatalogue.name.in_(top.scalar_subquery()))
+        ).all()
+        units: dict[str, list[LabUnits]] = {}
+        for name, unit, count in rows:
+            units.setdefault(name, []).append(LabUnits(unit, count))
+        names = [
+            LabName(
+                name,
+                sum(unit.labs for unit in by_units),
+                sorted(by_units, key=lambda unit: (-unit.labs, unit.units)),
+            )
+            for name, by_units in units.items()
+        ]
+        return sorted(names, key=lambda name: (-name.labs, name.name))
+
+    def refresh_counts(self) -> None:
+        """Recount the labs of each catalogue entry."""
+        with self.Session.begin() as session:
+            self._refresh_counts(session)
+
+    def _refresh_counts(self, session: Session) -> None:
+        """Recount the labs of each catalogue entry in a session."""
+        session.execute(delete(LabCount))
+        session.execute(count_labs())
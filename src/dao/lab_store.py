@@ -0,0 +1,540 @@
+"""Read-optimized columnar snapshot of labs, for analytical queries.
+
+Labs are kept as one array per column in memory-mapped files: patient, name
+and units as int32 codes into append-only dictionaries, datetime as int64
+microseconds since the epoch and value as float64. Scans run over the
+mapped files with NumPy, so they touch the page cache rather than the heap.
+
+Raw and normalized values (see `dao.units`) are both kept.
+
+The snapshot follows the change log, a chunk of changes at a time: labs
+new to it are appended, and labs it has are updated or marked deleted in
+place, through an index of the lab id of each row. Files live in a
+numbered generation directory named by `meta.json`, so a rebuild never
+disturbs arrays that readers have mapped, and bytes appended past the
+sizes recorded there (by an interrupted refresh) are ignored. Updates and
+deletes written in place are seen by readers at once; they are applied
+again if a refresh is interrupted, which leaves the same result. Like any
+follower of the change log, the snapshot is only sure to see every change
+on SQLite (see `dao.models.Change`).
+"""
+
+import contextlib
+import fcntl
+import json
+import os
+import shutil
+import threading
+from collections.abc import Iterator, Sequence
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+from typing import Any, NamedTuple
+
+import numpy as np
+import numpy.typing as npt
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from dao import batched
+from dao.lab_dao import UPSERT_COLUMNS, LabAggregate, LabPoint
+from dao.models import Change, Entity, Lab, LabCatalogue
+
+EPOCH = datetime(1970, 1, 1)
+CHUNK_SIZE = 100_000
+FORMAT = 3  # snapshots in other formats are rebuilt
+COLUMN_TYPES = {
+    "patient": np.int32,
+    "datetime": np.int64,
+    "value": np.float64,
+    "normalized_value": np.float64,
+    "name": np.int32,
+    "units": np.int32,
+    "normalized_units": np.int32,  # codes in the units dictionary
+    "deleted": np.bool_,
+}
+DICTIONARIES = ["patient", "name", "units"]
+# One lab id per row, for finding the rows of changed labs.
+ID_FILE = "id.jsonl"
+LAB_COLUMNS = (
+    Lab.id,
+    Lab.patient_id,
+    Lab.datetime,
+    Lab.value,
+    Lab.normalized_value,
+    LabCatalogue.name,
+    LabCatalogue.units,
+    LabCatalogue.normalized_units,
+)
+
+
+def to_microseconds(value: datetime) -> int:
+    """Convert a datetime to microseconds since the epoch.
+
+    Naive datetimes are taken to be UTC, as they are stored.
+    """
+    if value.tzinfo is not None:
+        value = value.astimezone(UTC).replace(tzinfo=None)
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+class Dictionary:
+    """Append-only mapping between strings and integer codes."""
+
+    def __init__(self, values: list[str] | None = None) -> None:
+        """Initialize."""
+        self.values = values or []
+        self.codes = {value: code for code, value in enumerate(self.values)}
+
+    def code(self, value: str) -> int:
+        """Get the code of a value, adding it if it is new."""
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def encode(self, values: Sequence[str]) -> npt.NDArray[np.int32]:
+        """Get the codes of values, adding those that are new."""
+        return np.fromiter(
+            (self.code(value) for value in values), np.int32, len(values)
+        )
+
+
+class Snapshot(NamedTuple):
+    """Columns and dictionaries of a store, as of one refresh."""
+
+    columns: dict[str, npt.NDArray[Any]]
+    dictionaries: dict[str, Dictionary]
+
+    def mask(
+        self, name: str, start: datetime | None, end: datetime | None
+    ) -> npt.NDArray[np.bool_] | None:
+        """Select the labs with a name in [start, end), or None if none."""
+        code = self.dictionaries["name"].codes.get(name)
+        if code is None:
+            return None
+        mask: npt.NDArray[np.bool_] = (self.columns["name"] == code) & ~(
+            self.columns["deleted"]
+        )
+        if start is not None:
+            mask &= self.columns["datetime"] >= to_microseconds(start)
+        if end is not None:
+            mask &= self.columns["datetime"] < to_microseconds(end)
+        return mask
+
+
+def measurement(normalize: bool) -> tuple[str, str]:
+    """Get the value and units columns, raw or normalized."""
+    if normalize:
+        return "normalized_value", "normalized_units"
+    return "value", "units"
+
+
+def empty_snapshot() -> Snapshot:
+    """Make a snapshot without labs."""
+    return Snapshot(
+        {column: np.empty(0, dtype) for column, dtype in COLUMN_TYPES.items()},
+        {dictionary: Dictionary() for dictionary in DICTIONARIES},
+    )
+
+
+class RowIndex(NamedTuple):
+    """Rows of the lab ids of a generation, as far as they have been read."""
+
+    generation: int
+    size: int  # bytes of the id file read
+    rows: dict[str, int]
+
+
+class LabStore:
+    """Columnar snapshot of labs in a directory.
+
+    Queries answer from the snapshot as of the last `refresh`. Several
+    processes can share a directory; refreshes are serialized with a file
+    lock.
+    """
+
+    def __init__(self, directory: Path) -> None:
+        """Initialize."""
+        self.directory = directory
+        self.meta: dict[str, Any] | None = None
+        self.snapshot = empty_snapshot()
+        self.index: RowIndex | None = None
+        self.lock = threading.Lock()
+
+    def refresh(self, session: Session) -> None:
+        """Bring the snapshot up to date with the database."""
+        with self.lock, self.file_lock():
+            meta = self.read_meta()
+            if meta is None or meta.get("format") != FORMAT:
+                self.rebuild(meta, session)
+                return
+            if meta != self.meta:
+                self.open(meta)
+            changes = session.execute(
+                select(Change.seq, Change.entity_id)
+                .where(
+                    Change.entity == Entity.lab, Change.seq > meta["last_seq"]
+                )
+                .order_by(Change.seq)
+                .execution_options(yield_per=CHUNK_SIZE)
+            )
+            for chunk in changes.partitions():
+                self.apply(
+                    [change.entity_id for change in chunk],
+                    chunk[-1].seq,
+                    session,
+                )
+
+    def aggregate(
+        self,
+        name: str,
+        start: datetime | None = None,
+        end: datetime | None = None,
+        normalize: bool = False,
+    ) -> Sequence[LabAggregate]:
+        """Summarize the values of a lab in [start, end), by units.
+
+        With `normalize`, normalized values are summarized by normalized
+        units.
+        """
+        value_column, units_column = measurement(normalize)
+        snapshot = self.snapshot
+        mask = snapshot.mask(name, start, end)
+        if mask is None or not mask.any():
+            return []
+        units = snapshot.columns[units_column][mask]
+        values = snapshot.columns[value_column][mask]
+        codes, groups = np.unique(units, return_inverse=True)
+        counts = np.bincount(groups)
+        sums = np.bincount(groups, weights=values)
+        order = np.argsort(groups, kind="stable")
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        minimums = np.minimum.reduceat(values[order], starts)
+        maximums = np.maximum.reduceat(values[order], starts)
+        unit_names = snapshot.dictionaries["units"].values
+        return sorted(
+            (
+                LabAggregate(
+                    name,
+                    unit_names[code],
+                    int(count),
+                    float(sum_ / count),
+                    float(minimum),
+                    float(maximum),
+                )
+                for code, count, sum_, minimum, maximum in zip(
+                    codes, counts, sums, minimums, maximums, strict=True
+                )
+            ),
+            key=lambda aggregate: aggregate.units,
+        )
+
+    def series(
+        self, patient_id: str, name: str, normalize: bool = False
+    ) -> Sequence[LabPoint]:
+        """Get a patient's values of a lab, oldest first."""
+        value_column, units_column = measurement(normalize)
+        snapshot = self.snapshot
+        patient = snapshot.dictionaries["patient"].codes.get(patient_id)
+        mask = snapshot.mask(name, None, None)
+        if patient is None or mask is None:
+            return []
+        mask &= snapshot.columns["patient"] == patient
+        indexes = np.flatnonzero(mask)
+        indexes = indexes[
+            np.argsort(snapshot.columns["datetime"][indexes], kind="stable")
+        ]
+        unit_names = snapshot.dictionaries["units"].values
+        return [
+            LabPoint(EPOCH + timedelta(microseconds=int(time)), value, units)
+            for time, value, units in zip(
+                snapshot.columns["datetime"][indexes].tolist(),
+                snapshot.columns[value_column][indexes].tolist(),
+                (
+                    unit_names[code]
+                    for code in snapshot.columns[units_column][
+                        indexes
+                    ].tolist()
+                ),
+                strict=True,
+            )
+        ]
+
+    def cohort(
+        self,
+        name: str,
+        minimum: float | None = None,
+        maximum: float | None = None,
+        start: datetime | None = None,
+        end: datetime | None = None,
+        normalize: bool = False,
+    ) -> Sequence[str]:
+        """Get the ids of patients with a value of a lab in a range.
+
+        The range is inclusive, and only labs in [start, end) count. With
+        `normalize`, the range is in the lab's normalized units.
+        """
+        value_column, _ = measurement(normalize)
+        snapshot = self.snapshot
+        mask = snapshot.mask(name, start, end)
+        if mask is None:
+            return []
+        values = snapshot.columns[value_column]
+        if minimum is not None:
+            mask &= values >= minimum
+        if maximum is not None:
+            mask &= values <= maximum
+        patient_ids = snapshot.dictionaries["patient"].values
+        return sorted(
+            patient_ids[code]
+            for code in np.unique(snapshot.columns["patient"][mask]).tolist()
+        )
+
+    @contextlib.contextmanager
+    def file_lock(self) -> Iterator[None]:
+        """Hold the directory's lock, against other processes."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with (self.directory / "lock").open("w") as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+    def read_meta(self) -> dict[str, Any] | None:
+        """Read the metadata of the current generation, if there is one."""
+        try:
+            with (self.directory / "meta.json").open() as file:
+                meta: dict[str, Any] = json.load(file)
+        except FileNotFoundError:
+            return None
+        return meta
+
+    def write_meta(self, meta: dict[str, Any]) -> None:
+        """Write metadata atomically, then switch to it."""
+        path = self.directory / "meta.json"
+        temporary = path.with_suffix(".tmp")
+        with temporary.open("w") as file:
+            json.dump(meta, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, path)
+        self.open(meta)
+
+    def generation(self, meta: dict[str, Any]) -> Path:
+        """Get the directory of a generation."""
+        return self.directory / str(meta["generation"])
+
+    def open(self, meta: dict[str, Any]) -> None:
+        """Map the files of a generation."""
+        directory = self.generation(meta)
+        columns = {}
+        for column, dtype in COLUMN_TYPES.items():
+            columns[column] = (
+                np.memmap(
+                    directory / f"{column}.bin",
+                    dtype,
+                    mode="r",
+                    shape=(meta["rows"],),
+                )
+                if meta["rows"]
+                else np.empty(0, dtype)
+            )
+        dictionaries = {}
+        for dictionary in DICTIONARIES:
+            name = f"{dictionary}.jsonl"
+            with (directory / name).open("rb") as file:
+                lines = file.read(meta["sizes"][name]).splitlines()
+            dictionaries[dictionary] = Dictionary(
+                [json.loads(line) for line in lines]
+            )
+        self.meta = meta
+        self.snapshot = Snapshot(columns, dictionaries)
+
+    def rebuild(
+        self, previous: dict[str, Any] | None, session: Session
+    ) -> None:
+        """Write a generation from all labs, to replace `previous`."""
+        last_seq = session.scalar(select(func.max(Change.seq))) or 0
+        # Labs changed since `last_seq` are left to the next refresh.
+        changed = select(Change.entity_id).where(
+            Change.entity == Entity.lab, Change.seq > last_seq
+        )
+        rows = session.execute(
+            select(*LAB_COLUMNS)
+            .join(Lab.catalogue)
+            .where(Lab.id.not_in(changed))
+            .execution_options(yield_per=CHUNK_SIZE)
+        )
+        meta = {
+            "format": FORMAT,
+            "generation": (previous or {"generation": 0})["generation"] + 1,
+            "rows": 0,
+            "last_seq": last_seq,
+            "sizes": {},
+        }
+        directory = self.generation(meta)
+        shutil.rmtree(directory, ignore_errors=True)
+        directory.mkdir()
+        dictionaries = {
+            dictionary: Dictionary() for dictionary in DICTIONARIES
+        }
+        self.write_rows(meta, dictionaries, rows.partitions())
+        self.write_meta(meta)
+        if previous is not None:
+            # Processes that mapped the old files keep them until unmapped.
+            shutil.rmtree(self.generation(previous), ignore_errors=True)
+
+    def apply(
+        self, lab_ids: list[str], last_seq: int, session: Session
+    ) -> None:
+        """Bring changed labs up to date in the current generation.
+
+        Labs still stored are appended if the generation has no row for
+        them, and otherwise have their values (the only columns a lab's
+        update changes) overwritten. Labs no longer stored are marked
+        deleted.
+        """
+        assert self.meta is not None
+        meta = {**self.meta, "sizes": dict(self.meta["sizes"])}
+        directory = self.generation(meta)
+        for name, size in meta["sizes"].items():
+            os.truncate(directory / name, size)
+        index = self.row_index(meta)
+        stored = [
+            row
+            for ids in batched(dict.fromkeys(lab_ids), CHUNK_SIZE // 100)
+            for row in session.execute(
+                select(*LAB_COLUMNS).join(Lab.catalogue).where(Lab.id.in_(ids))
+            ).all()
+        ]
+        updated = [row for row in stored if row.id in index]
+        gone = set(lab_ids).difference(row.id for row in stored)
+        # Copies, so that a failed append leaves the snapshot as it was.
+        dictionaries = {
+            dictionary: Dictionary(list(values.values))
+            for dictionary, values in self.snapshot.dictionaries.items()
+        }
+        self.write_rows(
+            meta,
+            dictionaries,
+            iter([[row for row in stored if row.id not in index]]),
+        )
+        rows = np.array([index[row.id] for row in updated], np.int64)
+        for column in UPSERT_COLUMNS:
+            self.overwrite(
+                meta,
+                column,
+                rows,
+                np.array([getattr(row, column) for row in updated]),
+            )
+        deleted = np.array(
+            [index[lab_id] for lab_id in gone if lab_id in index], np.int64
+        )
+        self.overwrite(meta, "deleted", deleted, np.True_)
+        meta["last_seq"] = last_seq
+        self.write_meta(meta)
+
+    def overwrite(
+        self,
+        meta: dict[str, Any],
+        column: str,
+        rows: npt.NDArray[np.int64],
+        values: Any,
+    ) -> None:
+        """Write values to rows of a column of a generation, in place."""
+        if not len(rows):
+            return
+        array = np.memmap(
+            self.generation(meta) / f"{column}.bin",
+            COLUMN_TYPES[column],
+            mode="r+",
+            shape=(meta["rows"],),
+        )
+        array[rows] = values
+        array.flush()
+
+    def row_index(self, meta: dict[str, Any]) -> dict[str, int]:
+        """Map the lab ids of a generation to their rows.
+
+        Ids appended since the index was last used are read on the way.
+        """
+        index = self.index
+        if index is None or index.generation != meta["generation"]:
+            index = RowIndex(meta["generation"], 0, {})
+        with (self.generation(meta) / ID_FILE).open("rb") as file:
+            file.seek(index.size)
+            data = file.read(meta["sizes"][ID_FILE] - index.size)
+        for line in data.splitlines():
+            index.rows[json.loads(line)] = len(index.rows)
+        self.index = index._replace(size=index.size + len(data))
+        return index.rows
+
+    def write_rows(
+        self,
+        meta: dict[str, Any],
+        dictionaries: dict[str, Dictionary],
+        chunks: Iterator[Sequence[Any]],
+    ) -> None:
+        """Append rows to a generation's files, updating `meta`."""
+        directory = self.generation(meta)
+        saved = {
+            dictionary: len(dictionaries[dictionary].values)
+            for dictionary in DICTIONARIES
+        }
+        files = {
+            column: (directory / f"{column}.bin").open("ab")
+            for column in COLUMN_TYPES
+        }
+        ids = (directory / ID_FILE).open("ab")
+        try:
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                (
+                    lab_ids,
+                    patient_ids,
+                    datetimes,
+                    values,
+                    normalized_values,
+                    names,
+                    units,
+                    normalized_units,
+                ) = zip(*chunk, strict=True)
+                arrays: dict[str, npt.NDArray[Any]] = {
+                    "patient": dictionaries["patient"].encode(patient_ids),
+                    "datetime": np.fromiter(
+                        map(to_microseconds, datetimes),
+                        np.int64,
+                        len(datetimes),
+                    ),
+                    "value": np.array(values, np.float64),
+                    "normalized_value": np.array(
+                        normalized_values, np.float64
+                    ),
+                    "name": dictionaries["name"].encode(names),
+                    "units": dictionaries["units"].encode(units),
+                    "normalized_units": dictionaries["units"].encode(
+                        normalized_units
+                    ),
+                    "deleted": np.zeros(len(chunk), np.bool_),
+                }
+                for column, array in arrays.items():
+                    files[column].write(array.tobytes())
+                ids.writelines(
+                    json.dumps(lab_id).encode() + b"\n" for lab_id in lab_ids
+                )
+                meta["rows"] += len(chunk)
+        finally:
+            for file in files.values():
+                file.close()
+            ids.close()
+        for dictionary in DICTIONARIES:
+            with (directory / f"{dictionary}.jsonl").open("ab") as file:
+                for value in dictionaries[dictionary].values[
+                    saved[dictionary] :
+                ]:
+                    file.write(json.dumps(value).encode() + b"\n")
+        for path in directory.iterdir():
+            meta["sizes"][path.name] = path.stat().st_size
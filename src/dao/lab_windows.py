@@ -0,0 +1,133 @@
+"""Rolling-window statistics over lab series, as vectorized array operations.
+
+Series are given as flat arrays sorted by group (a patient's labs in one
+set of units) and then by time. The window of a lab is the labs of its
+group taken in the `window` before it, itself included.
+"""
+
+from collections.abc import Callable
+from datetime import datetime
+from typing import NamedTuple
+
+import numpy as np
+import numpy.typing as npt
+
+HOUR = 3600 * 10**6  # in microseconds
+
+
+class RollingStats(NamedTuple):
+    """Statistics of the window of each lab."""
+
+    mean: npt.NDArray[np.float64]
+    minimum: npt.NDArray[np.float64]
+    maximum: npt.NDArray[np.float64]
+    delta: npt.NDArray[np.float64]  # change since the window's first lab
+    rise: npt.NDArray[np.float64]  # value less the window's minimum
+    slope: npt.NDArray[np.float64]  # per hour since the previous lab, or NaN
+
+
+class LabWindowPoint(NamedTuple):
+    """Value of a lab at a time, with the statistics of its window."""
+
+    datetime: datetime
+    value: float
+    units: str
+    mean: float
+    minimum: float
+    maximum: float
+    delta: float
+    rise: float
+    slope: float | None  # per hour, None for a series' first lab
+    flagged: bool  # whether `rise` reached the threshold
+
+
+def group_bounds(groups: npt.NDArray[np.int64]) -> npt.NDArray[np.int64]:
+    """Get the index of the first element of each element's group."""
+    starts = np.flatnonzero(np.diff(groups, prepend=groups[:1] - 1))
+    bounds: npt.NDArray[np.int64] = starts[
+        np.searchsorted(starts, np.arange(len(groups)), side="right") - 1
+    ]
+    return bounds
+
+
+def window_starts(
+    times: npt.NDArray[np.int64],
+    groups: npt.NDArray[np.int64],
+    window: int,
+) -> npt.NDArray[np.int64]:
+    """Get the index of the first lab in each lab's window."""
+    bounds = group_bounds(groups)
+    starts = np.empty(len(times), np.int64)
+    for first in np.unique(bounds).tolist():
+        last = np.searchsorted(bounds, first, side="right")
+        group_times = times[first:last]
+        starts[first:last] = first + np.searchsorted(
+            group_times, group_times - window, side="right"
+        )
+    return starts
+
+
+def range_reduce(
+    values: npt.NDArray[np.float64],
+    starts: npt.NDArray[np.int64],
+    ufunc: Callable[..., npt.NDArray[np.float64]],
+) -> npt.NDArray[np.float64]:
+    """Reduce values[starts[i]:i + 1] for every i with np.minimum or maximum.
+
+    Uses a sparse table: level k holds the reduction of each run of 2**k
+    values, and any range is covered by two overlapping runs.
+    """
+    ends = np.arange(len(values))
+    lengths = ends - starts + 1
+    levels = [values]
+    while 2 ** len(levels) <= len(values):
+        previous = levels[-1]
+        half = 2 ** (len(levels) - 1)
+        levels.append(ufunc(previous[:-half], previous[half:]))
+    table_levels = np.log2(np.maximum(lengths, 1)).astype(np.int64)
+    result = np.empty(len(values))
+    for level in np.unique(table_levels).tolist():
+        chosen = table_levels == level
+        result[chosen] = ufunc(
+            levels[level][starts[chosen]],
+            levels[level][ends[chosen] - 2**level + 1],
+        )
+    return result
+
+
+def rolling(
+    times: npt.NDArray[np.int64],
+    values: npt.NDArray[np.float64],
+    groups: npt.NDArray[np.int64],
+    window: int,
+) -> RollingStats:
+    """Compute the statistics of each lab's window.
+
+    `times` are in microseconds, as is `window`.
+    """
+    if not len(times):
+        empty = np.empty(0)
+        return RollingStats(empty, empty, empty, empty, empty, empty)
+    starts = window_starts(times, groups, window)
+    sums = np.concatenate([[0.0], np.cumsum(values)])
+    indexes = np.arange(len(values))
+    mean = (sums[indexes + 1] - sums[starts]) / (indexes + 1 - starts)
+    minimum = range_reduce(values, starts, np.minimum)
+    maximum = range_reduce(values, starts, np.maximum)
+    slope = np.full(len(values), np.nan)
+    following = np.flatnonzero(group_bounds(groups) < indexes)
+    elapsed = times[following] - times[following - 1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope[following] = np.where(
+            elapsed > 0,
+            (values[following] - values[following - 1]) / elapsed * HOUR,
+            np.nan,
+        )
+    return RollingStats(
+        mean,
+        minimum,
+        maximum,
+        values - values[starts],
+        values - minimum,
+        slope,
+    )
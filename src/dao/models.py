@@ -4,10 +4,20 @@ import enum
 from datetime import datetime
 
 from sqlalchemy import (
+    Connection,
     ForeignKey,
+    Index,
+    Insert,
+    ScalarSelect,
+    Table,
     create_engine,
+    event,
+    func,
+    insert,
+    inspect,
     select,
 )
+from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import (
     DeclarativeBase,
     Mapped,
@@ -57,6 +67,21 @@ class Language(enum.StrEnum):
     icelandic = "Icelandic"
 
 
+class Entity(enum.StrEnum):
+    """Kind of entity tracked in the change log."""
+
+    patient = "patient"
+    lab = "lab"
+
+
+class Operation(enum.StrEnum):
+    """Kind of change recorded in the change log."""
+
+    create = "create"
+    update = "update"
+    delete = "delete"
+
+
 class Base(DeclarativeBase):
     """Base class for models."""
 
@@ -73,23 +98,284 @@ class Patient(Base):
     marital_status: Mapped[MaritalStatus]
     race: Mapped[Race]
 
-    labs: Mapped[list["Lab"]] = relationship(back_populates="patient")
+    # Labs are removed with set-based deletes (see `PatientDao.delete_many`)
+    # or by the database's ON DELETE CASCADE, never loaded one by one.
+    labs: Mapped[list["Lab"]] = relationship(
+        back_populates="patient", passive_deletes=True
+    )
+
+
+class LabCatalogue(Base):
+    """Kind of lab, measured in some units.
+
+    Labs refer to their catalogue entry by id rather than repeating its name
+    and units on every row.
+    """
+
+    __tablename__ = "lab_catalogue"
+    __table_args__ = (
+        Index("uq_lab_catalogue_name_units", "name", "units", unique=True),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    name: Mapped[str]
+    units: Mapped[str]
+    # Canonical code of the name, shared by the entries for each of its units.
+    code: Mapped[str] = mapped_column(index=True)
+    # Values are normalized to `normalized_units` as value * factor + offset.
+    normalized_units: Mapped[str]
+    factor: Mapped[float]
+    offset: Mapped[float]
 
 
 class Lab(Base):
-    """Lab."""
+    """Lab.
+
+    A lab's name and units are those of its catalogue entry, queried as
+    correlated subqueries of it (select them from `Lab`). A new lab may be
+    given them instead, which `LabDao` resolves to a stored entry; the
+    unresolved entry cannot be stored on its own.
+    """
 
     __tablename__ = "labs"
+    __table_args__ = (
+        # Natural key: the same measurement re-sent by a feed is one lab.
+        Index(
+            "uq_labs_natural_key",
+            "patient_id",
+            "admission_number",
+            "datetime",
+            "catalogue_id",
+            unique=True,
+        ),
+        # A patient's series of a lab, in time order.
+        Index(
+            "ix_labs_patient_catalogue_datetime",
+            "patient_id",
+            "catalogue_id",
+            "datetime",
+        ),
+    )
 
     id: Mapped[str] = mapped_column(primary_key=True)
-    patient_id: Mapped[str] = mapped_column(ForeignKey("patients.id"))
+    patient_id: Mapped[str] = mapped_column(
+        ForeignKey("patients.id", ondelete="CASCADE")
+    )
     admission_number: Mapped[int]
     datetime: Mapped[datetime]
-    name: Mapped[str]
+    catalogue_id: Mapped[int] = mapped_column(
+        ForeignKey("lab_catalogue.id"), index=True
+    )
     value: Mapped[float]
-    units: Mapped[str]
+    normalized_value: Mapped[float]  # in the catalogue's normalized units
 
     patient: Mapped["Patient"] = relationship(back_populates="labs")
+    catalogue: Mapped[LabCatalogue] = relationship(
+        lazy="joined", innerjoin=True
+    )
+
+    @hybrid_property
+    def name(self) -> str:
+        """Name of the lab."""
+        return self.catalogue.name
+
+    @name.inplace.setter
+    def _name_setter(self, value: str) -> None:
+        self.new_entry().name = value
+
+    @name.inplace.expression
+    @classmethod
+    def _name_expression(cls) -> ScalarSelect[str]:
+        return (
+            select(LabCatalogue.name)
+            .where(LabCatalogue.id == cls.catalogue_id)
+            .correlate_except(LabCatalogue)
+            .scalar_subquery()
+        )
+
+    @hybrid_property
+    def units(self) -> str:
+        """Units of the lab's value."""
+        return self.catalogue.units
+
+    @units.inplace.setter
+    def _units_setter(self, value: str) -> None:
+        self.new_entry().units = value
+
+    @units.inplace.expression
+    @classmethod
+    def _units_expression(cls) -> ScalarSelect[str]:
+        return (
+            select(LabCatalogue.units)
+            .where(LabCatalogue.id == cls.catalogue_id)
+            .correlate_except(LabCatalogue)
+            .scalar_subquery()
+        )
+
+    def new_entry(self) -> LabCatalogue:
+        """Get the unresolved catalogue entry of a new lab.
+
+        It holds the name and units given, for `LabDao` to resolve to a
+        stored entry.
+        """
+        if self.catalogue is None:
+            self.catalogue = LabCatalogue()
+        elif inspect(self.catalogue).has_identity:
+            raise AttributeError(
+                "The name and units of a stored lab are its catalogue entry's"
+            )
+        return self.catalogue
+
+    @property
+    def normalized_units(self) -> str:
+        """Units of the lab's normalized value."""
+        return self.catalogue.normalized_units
+
+
+class LabCount(Base):
+    """Number of labs of a catalogue entry.
+
+    Counts are recomputed from the labs now and then (see
+    `dao.lab_name_dao.LabNameDao.refresh_counts`) rather than as labs are
+    written, so they may lag behind the labs.
+    """
+
+    __tablename__ = "lab_counts"
+
+    catalogue_id: Mapped[int] = mapped_column(
+        ForeignKey("lab_catalogue.id"), primary_key=True
+    )
+    labs: Mapped[int]
+
+
+class Admission(Base):
+    """Hospital admission of a patient, holding the labs of its number.
+
+    `first_lab` and `last_lab` are kept up to date as labs are created and
+    deleted (see `dao.admission_dao`); `start` and `end` are only set when
+    supplied.
+    """
+
+    __tablename__ = "admissions"
+
+    patient_id: Mapped[str] = mapped_column(
+        ForeignKey("patients.id", ondelete="CASCADE"), primary_key=True
+    )
+    number: Mapped[int] = mapped_column(primary_key=True)
+    start: Mapped[datetime | None]
+    end: Mapped[datetime | None]
+    first_lab: Mapped[datetime | None]
+    last_lab: Mapped[datetime | None]
+
+
+class Change(Base):
+    """Change log entry.
+
+    Sequence numbers are strictly increasing and never reused, so clients
+    can resume an incremental sync from the last sequence number they saw.
+    That relies on changes becoming visible in sequence order, which holds
+    on SQLite, where one transaction writes at a time. On PostgreSQL, a
+    transaction can commit a change after another with a higher sequence
+    number has been read, and a cursor past it never sees it.
+    """
+
+    __tablename__ = "changes"
+    __table_args__ = (
+        # Syncs of one entity's changes, such as the patient filter's.
+        Index("ix_changes_entity_seq", "entity", "seq"),
+        {"sqlite_autoincrement": True},
+    )
+
+    seq: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    entity: Mapped[Entity]
+    entity_id: Mapped[str]
+    operation: Mapped[Operation]
+
+
+class IdempotencyRecord(Base):
+    """Response recorded for an idempotency key."""
+
+    __tablename__ = "idempotency_records"
+
+    scope: Mapped[str] = mapped_column(primary_key=True)  # method and path
+    key: Mapped[str] = mapped_column(primary_key=True)
+    fingerprint: Mapped[str]  # digest of the request body
+    response: Mapped[str]  # JSON response body
+    created: Mapped[datetime] = mapped_column(index=True)
+
+
+class SchemaVersion(Base):
+    """Digest of the schema a database was last set up with."""
+
+    __tablename__ = "schema_version"
+
+    digest: Mapped[str] = mapped_column(primary_key=True)
+
+
+# Lab name search: a full-text index of catalogue names. Catalogue entries
+# are never updated or deleted, so the index only follows inserts.
+LAB_SEARCH_DDL = {
+    "sqlite": [
+        (
+            "CREATE VIRTUAL TABLE IF NOT EXISTS lab_catalogue_search USING "
+            "fts5(name, content='lab_catalogue', content_rowid='id', "
+            "prefix='1 2 3')"
+        ),
+        (
+            "CREATE TRIGGER IF NOT EXISTS lab_catalogue_search_insert "
+            "AFTER INSERT ON lab_catalogue BEGIN "
+            "INSERT INTO lab_catalogue_search (rowid, name) "
+            "VALUES (NEW.id, NEW.name); END"
+        ),
+    ],
+    "postgresql": [
+        (
+            "CREATE INDEX IF NOT EXISTS ix_lab_catalogue_name_search "
+            "ON lab_catalogue USING gin (to_tsvector('simple', name))"
+        ),
+    ],
+}
+
+
+def count_labs() -> Insert:
+    """Insert the number of labs of each catalogue entry into lab_counts."""
+    return insert(LabCount).from_select(
+        ["catalogue_id", "labs"],
+        select(Lab.catalogue_id, func.count()).group_by(Lab.catalogue_id),
+    )
+
+
+# Run when the counts table is created, to fill it and the index.
+LAB_SEARCH_BACKFILL_DDL = {
+    "sqlite": [
+        "INSERT INTO lab_catalogue_search (lab_catalogue_search) "
+        "VALUES ('rebuild')",
+    ],
+    "postgresql": [],
+}
+
+
+@event.listens_for(Base.metadata, "after_create")
+def create_lab_search(
+    target: object, connection: Connection, tables: list[Table], **kw: object
+) -> None:
+    """Create the lab name index, if missing, and fill new lab counts."""
+    dialect = connection.dialect.name
+    for statement in LAB_SEARCH_DDL.get(dialect, []):
+        connection.exec_driver_sql(statement)
+    if LabCount.__table__ in tables:
+        for statement in LAB_SEARCH_BACKFILL_DDL.get(dialect, []):
+            connection.exec_driver_sql(statement)
+        connection.execute(count_labs())
+
+
+@event.listens_for(Base.metadata, "before_drop")
+def drop_lab_search(
+    target: object, connection: Connection, **kw: object
+) -> None:
+    """Drop the lab name index, which is not a table of the metadata."""
+    if connection.dialect.name == "sqlite":
+        connection.exec_driver_sql("DROP TABLE IF EXISTS lab_catalogue_search")
 
 
 if __name__ == "__main__":
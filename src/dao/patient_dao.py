@@ -1,33 +1,78 @@
 """Patient data access."""
 
 import uuid
-from collections.abc import Sequence
+from collections.abc import Iterable, Sequence
 from datetime import datetime
+from typing import NamedTuple
 
 from sqlalchemy import (
     Engine,
+    delete,
+    insert,
+    lambda_stmt,
     select,
 )
 from sqlalchemy.exc import NoResultFound
 from sqlalchemy.orm import Session, sessionmaker
 
-from dao import NotFoundError
+from dao import NotFoundError, batched, record_rows
+from dao.change_dao import (
+    record_change,
+    record_changes,
+    record_many_changes,
+)
 from dao.models import (
+    Admission,
+    Entity,
     Gender,
+    Lab,
     Language,
     MaritalStatus,
+    Operation,
     Patient,
     Race,
 )
+from dao.patient_filter import PENDING, PatientFilter
+
+# Keep IN lists well under SQLite's bound parameter limit.
+DELETE_CHUNK_SIZE = 500
+
+
+class PatientRecord(NamedTuple):
+    """Patient as a flat row, for reads that do not need the entity."""
+
+    id: str
+    gender: Gender
+    date_of_birth: datetime
+    language: Language
+    marital_status: MaritalStatus
+    race: Race
+
+
+RECORD_COLUMNS = (
+    Patient.id,
+    Patient.gender,
+    Patient.date_of_birth,
+    Patient.language,
+    Patient.marital_status,
+    Patient.race,
+)
 
 
 class PatientDao:
     """Patient data access object."""
 
-    def __init__(self, engine: Engine) -> None:
-        """Initialize."""
+    def __init__(
+        self, engine: Engine, patient_filter: PatientFilter | None = None
+    ) -> None:
+        """Initialize.
+
+        With a `patient_filter` of the same database, reads of patients it
+        reports absent fail without a query.
+        """
         self.engine = engine
         self.Session = sessionmaker(bind=self.engine, expire_on_commit=False)
+        self.patient_filter = patient_filter
 
     def create(
         self,
@@ -57,7 +102,7 @@ class PatientDao:
         race: Race,
         session: Session,
     ) -> Patient:
-        """Create a patient."""
+        """Create a patient in a session, leaving it to commit."""
         id = str(uuid.uuid4())
         patient = Patient(
             id=id,
@@ -68,43 +113,176 @@ class PatientDao:
             race=race,
         )
         session.add(patient)
-        session.commit()
+        record_change(Entity.patient, id, Operation.create, session)
+        session.flush()
+        self.record_filter_writes([id], [], session)
         return patient
 
+    def create_many(self, patients: Iterable[Patient]) -> Sequence[Patient]:
+        """Create patients in one statement."""
+        with self.Session.begin() as session:
+            return self._create_many(patients, session)
+
+    def _create_many(
+        self, patients: Iterable[Patient], session: Session
+    ) -> Sequence[Patient]:
+        """Create patients in one statement.
+
+        Ids are assigned to patients that do not have one. The caller
+        commits.
+        """
+        rows = [
+            {
+                "id": patient.id or str(uuid.uuid4()),
+                "date_of_birth": patient.date_of_birth,
+                "gender": patient.gender or Gender.unknown,
+                "language": patient.language or Language.unknown,
+                "marital_status": patient.marital_status
+                or MaritalStatus.unknown,
+                "race": patient.race or Race.unknown,
+            }
+            for patient in patients
+        ]
+        if not rows:
+            return []
+        created = session.scalars(
+            insert(Patient).returning(Patient), rows
+        ).all()
+        record_many_changes(
+            Entity.patient,
+            ((patient.id, Operation.create) for patient in created),
+            session,
+        )
+        session.flush()
+        self.record_filter_writes(
+            [patient.id for patient in created], [], session
+        )
+        return created
+
     def read(self, patient_id: str) -> Patient:
         """Get a patient."""
         with self.Session.begin() as session:
             return self._read(patient_id, session)
 
     def _read(self, patient_id: str, session: Session) -> Patient:
-        """Get a patient in a session."""
+        """Get a patient in a session.
+
+        The query is a lambda statement, which is built and compiled once
+        and then only has its parameter bound on each call.
+        """
+        self.check_filter(patient_id, session)
         try:
-            result = session.scalars(
-                select(Patient).where(Patient.id == patient_id)
+            result: Patient = session.scalars(
+                lambda_stmt(
+                    lambda: select(Patient).where(Patient.id == patient_id)
+                )
             ).one()
         except NoResultFound as e:
+            self.record_false_positive()
             raise NotFoundError(
                 f"No patient found with id {patient_id}"
             ) from e
         return result
 
+    def check(self, patient_id: str) -> None:
+        """Check that a patient exists."""
+        with self.Session.begin() as session:
+            return self._check(patient_id, session)
+
+    def _check(self, patient_id: str, session: Session) -> None:
+        """Check that a patient exists, without loading it.
+
+        Raises NotFoundError if it does not.
+        """
+        self.check_filter(patient_id, session)
+        found = session.connection().scalar(
+            lambda_stmt(
+                lambda: select(Patient.id).where(Patient.id == patient_id)
+            )
+        )
+        record_rows(found is not None)
+        if found is None:
+            self.record_false_positive()
+            raise NotFoundError(f"No patient found with id {patient_id}")
+
+    def check_filter(self, patient_id: str, session: Session) -> None:
+        """Fail reads of patients the patient filter reports absent."""
+        if (
+            self.patient_filter is not None
+            and not self.patient_filter.might_contain(patient_id, session)
+        ):
+            raise NotFoundError(f"No patient found with id {patient_id}")
+
+    def record_filter_writes(
+        self, created: list[str], deleted: list[str], session: Session
+    ) -> None:
+        """Have the patient filter apply patients written, on commit."""
+        if self.patient_filter is not None:
+            session.info.setdefault(PENDING, []).append(
+                (self.patient_filter, created, deleted)
+            )
+
+    def record_false_positive(self) -> None:
+        """Count a patient the filter reported present that was not found."""
+        if self.patient_filter is not None:
+            self.patient_filter.record_false_positive()
+
     def delete(self, patient_id: str) -> None:
-        """Delete a patient."""
+        """Delete a patient and their labs."""
         with self.Session.begin() as session:
-            patient = self._read(patient_id, session)
-            if patient is None:
-                raise NotFoundError(f"No patient found with id {patient_id}")
-            return self._delete(patient, session)
+            return self._delete(patient_id, session)
 
-    def _delete(self, patient: Patient, session: Session) -> None:
-        """Delete a patient."""
-        session.delete(patient)
+    def _delete(self, patient_id: str, session: Session) -> None:
+        """Delete a patient and their labs."""
+        if not self._delete_many([patient_id], session):
+            raise NotFoundError(f"No patient found with id {patient_id}")
 
-    def list(self) -> Sequence[Patient]:
+    def delete_many(self, patient_ids: Iterable[str]) -> int:
+        """Delete patients and their labs, returning the number deleted."""
+        with self.Session.begin() as session:
+            return self._delete_many(patient_ids, session)
+
+    def _delete_many(
+        self, patient_ids: Iterable[str], session: Session
+    ) -> int:
+        """Delete patients and their labs, returning the number deleted.
+
+        Labs and admissions are removed with set-based DELETE statements, a
+        chunk of patients at a time, without loading any into the session.
+        """
+        deleted = 0
+        for chunk in batched(patient_ids, DELETE_CHUNK_SIZE):
+            labs = select(Lab.id).where(Lab.patient_id.in_(chunk))
+            patients = select(Patient.id).where(Patient.id.in_(chunk))
+            record_changes(Entity.lab, labs, Operation.delete, session)
+            record_changes(Entity.patient, patients, Operation.delete, session)
+            session.execute(delete(Lab).where(Lab.patient_id.in_(chunk)))
+            session.execute(
+                delete(Admission).where(Admission.patient_id.in_(chunk))
+            )
+            result = session.execute(
+                delete(Patient).where(Patient.id.in_(chunk))
+            )
+            deleted += result.rowcount
+            self.record_filter_writes([], chunk, session)
+        return deleted
+
+    def list(self) -> Sequence[PatientRecord]:
         """List patients."""
         with self.Session.begin() as session:
             return self._list(session)
 
-    def _list(self, session: Session) -> Sequence[Patient]:
-        """List patients."""
-        return [row[0] for row in session.execute(select(Patient)).fetchall()]
+    def _list(self, session: Session) -> Sequence[PatientRecord]:
+        """List patients.
+
+        Rows are fetched through the session's connection, skipping the ORM's
+        entity construction and identity map.
+        """
+        records = [
+            PatientRecord(*row)
+            for row in session.connection().execute(
+                lambda_stmt(lambda: select(*RECORD_COLUMNS))
+            )
+        ]
+        record_rows(len(records))
+        return records
@@ -0,0 +1,278 @@
+"""Probabilistic filter of known patient ids, to skip lookups of unknown ones.
+
+The filter is a counting Bloom filter: ids that were never added are almost
+always reported absent, and ids that were are always reported present, so
+lookups of absent ids can be answered without touching the database. Its
+counters, unlike a plain Bloom filter's bits, allow ids to be removed, but
+only ids that were added: removing others would clear counters that other
+ids share.
+"""
+
+import hashlib
+import math
+import threading
+import time
+from collections.abc import Callable, Iterable
+
+import numpy as np
+import numpy.typing as npt
+from sqlalchemy import event, func, select, true
+from sqlalchemy.orm import Session
+
+from dao.models import Change, Entity, Operation, Patient
+
+MAX_COUNT = np.iinfo(np.uint8).max
+PENDING = "patient_filter_pending"
+
+
+class CountingBloomFilter:
+    """Counting Bloom filter of strings.
+
+    Counters saturate rather than overflow, and saturated counters are never
+    decremented again, so removing keys can never cause false negatives.
+    """
+
+    def __init__(self, capacity: int, error_rate: float) -> None:
+        """Initialize for `capacity` keys at a false positive rate."""
+        self.size = max(
+            math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2), 64
+        )
+        self.hashes = max(round(self.size / capacity * math.log(2)), 1)
+        self.counters: npt.NDArray[np.uint8] = np.zeros(self.size, np.uint8)
+        self.capacity = capacity
+        self.keys = 0
+
+    def positions(self, key: str) -> npt.NDArray[np.int64]:
+        """Get the distinct counters of a key, by double hashing."""
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return np.unique(
+            np.fromiter(
+                ((first + i * second) % self.size for i in range(self.hashes)),
+                np.int64,
+                self.hashes,
+            )
+        )
+
+    def add(self, key: str) -> None:
+        """Add a key."""
+        positions = self.positions(key)
+        counters = self.counters[positions]
+        self.counters[positions] = np.where(
+            counters < MAX_COUNT, counters + 1, counters
+        )
+        self.keys += 1
+
+    def remove(self, key: str) -> None:
+        """Remove a key that was added."""
+        positions = self.positions(key)
+        counters = self.counters[positions]
+        self.counters[positions] = np.where(
+            (counters > 0) & (counters < MAX_COUNT), counters - 1, counters
+        )
+        self.keys -= 1
+
+    def __contains__(self, key: str) -> bool:
+        """Check whether a key may have been added."""
+        return bool(self.counters[self.positions(key)].all())
+
+    def error_rate(self) -> float:
+        """Estimate the current false positive rate from the counters used."""
+        used = np.count_nonzero(self.counters) / self.size
+        return float(used**self.hashes)
+
+
+class PatientFilter:
+    """Filter of the ids of stored patients.
+
+    The filter is built from the patients table on first use. Patients this
+    process creates are added as their transactions commit, and the writes
+    of other processes (other workers, the loader) are applied from the
+    change log, read by the first lookup once `sync_interval` seconds have
+    passed since the last read. Ids absent from the filter are otherwise
+    reported absent without a query, so a patient created by another
+    process may be reported absent for up to `sync_interval` seconds. The
+    change log is only sure to be followed without gaps on SQLite (see
+    `dao.models.Change`).
+    """
+
+    def __init__(
+        self,
+        error_rate: float = 0.01,
+        min_capacity: int = 1024,
+        sync_interval: float = 1.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """Initialize."""
+        self.error_rate = error_rate
+        self.min_capacity = min_capacity
+        self.sync_interval = sync_interval
+        self.clock = clock
+        self.bloom: CountingBloomFilter | None = None
+        self.last_seq = 0
+        self.last_sync = -math.inf
+        # Ids created by this process that no sync has applied yet.
+        self.created: set[str] = set()
+        self.building = False
+        self.lock = threading.Lock()
+        self.negatives = 0  # lookups answered without the database
+        self.positives = 0
+        self.false_positives = 0  # positives that were not found
+
+    def clear(self) -> None:
+        """Forget all ids, rebuilding the filter on next use."""
+        with self.lock:
+            self.bloom = None
+            self.created = set()
+
+    def build(self, session: Session) -> bool:
+        """Build the filter from the patients table.
+
+        The ids and the last sequence number are read in one statement, so
+        from one snapshot, without holding `lock`. Returns False, without
+        waiting, if another thread is building the filter already.
+        """
+        with self.lock:
+            if self.building:
+                return False
+            self.building = True
+        try:
+            started = self.clock()
+            last_seq = select(
+                func.coalesce(func.max(Change.seq), 0).label("seq")
+            ).subquery()
+            # At least one row, with no id if there are no patients.
+            rows = session.execute(
+                select(last_seq.c.seq, Patient.id)
+                .select_from(last_seq)
+                .outerjoin(Patient, true())
+            ).all()
+            ids = [patient_id for _, patient_id in rows if patient_id]
+            bloom = CountingBloomFilter(
+                max(2 * len(ids), self.min_capacity), self.error_rate
+            )
+            for patient_id in ids:
+                bloom.add(patient_id)
+            with self.lock:
+                self.bloom = bloom
+                self.last_seq = rows[0].seq
+                self.last_sync = started
+                self.created = {
+                    patient_id
+                    for patient_id in self.created
+                    if patient_id not in bloom
+                }
+        finally:
+            with self.lock:
+                self.building = False
+        return True
+
+    def sync(self, session: Session) -> None:
+        """Apply patient changes since the last sync."""
+        with self.lock:
+            last_seq = self.last_seq
+            self.last_sync = self.clock()
+        changes = session.execute(
+            select(Change.seq, Change.entity_id, Change.operation)
+            .where(Change.entity == Entity.patient, Change.seq > last_seq)
+            .order_by(Change.seq)
+        ).all()
+        with self.lock:
+            assert self.bloom is not None
+            for seq, patient_id, operation in changes:
+                if seq <= self.last_seq:  # applied by a concurrent sync
+                    continue
+                if operation == Operation.create:
+                    self.bloom.add(patient_id)
+                elif operation == Operation.delete:
+                    self.bloom.remove(patient_id)
+                self.created.discard(patient_id)
+                self.last_seq = seq
+            full = self.bloom.keys > self.bloom.capacity
+        if full:
+            self.build(session)  # twice as large
+
+    def add_created(self, patient_ids: Iterable[str]) -> None:
+        """Record patients this process created, once committed."""
+        with self.lock:
+            self.created.update(patient_ids)
+
+    def discard_deleted(self, patient_ids: Iterable[str]) -> None:
+        """Record patients this process deleted, once committed.
+
+        They stay in the Bloom filter, as false positives, until a sync
+        applies their deletion.
+        """
+        with self.lock:
+            self.created.difference_update(patient_ids)
+
+    def might_contain(self, patient_id: str, session: Session) -> bool:
+        """Check whether a patient may exist.
+
+        False means the patient did not exist as of the last sync, and was
+        not created by this process since. Until the filter is built, any
+        patient may. Syncs first if the last was `sync_interval` ago.
+        """
+        if self.bloom is None and not self.build(session):
+            return True
+        with self.lock:
+            due = self.clock() - self.last_sync >= self.sync_interval
+        if due:
+            self.sync(session)
+        with self.lock:
+            assert self.bloom is not None
+            if patient_id in self.bloom or patient_id in self.created:
+                self.positives += 1
+                return True
+            self.negatives += 1
+            return False
+
+    def record_false_positive(self) -> None:
+        """Count a patient reported present that was not found."""
+        with self.lock:
+            self.false_positives += 1
+
+    def render(self) -> str:
+        """Format metrics as Prometheus text exposition."""
+        with self.lock:
+            absent = self.negatives + self.false_positives
+            lines = [
+                "# HELP ehr_api_patient_filter_lookups_total Patient id "
+                "lookups, by filter result.",
+                "# TYPE ehr_api_patient_filter_lookups_total counter",
+                "ehr_api_patient_filter_lookups_total"
+                f'{{result="negative"}} {self.negatives}',
+                "ehr_api_patient_filter_lookups_total"
+                f'{{result="positive"}} {self.positives}',
+                "# HELP ehr_api_patient_filter_false_positives_total "
+                "Positive lookups of patients that did not exist.",
+                "# TYPE ehr_api_patient_filter_false_positives_total counter",
+                "ehr_api_patient_filter_false_positives_total "
+                f"{self.false_positives}",
+                "# HELP ehr_api_patient_filter_false_positive_rate Share of "
+                "lookups of absent patients that reached the database.",
+                "# TYPE ehr_api_patient_filter_false_positive_rate gauge",
+                "ehr_api_patient_filter_false_positive_rate "
+                f"{self.false_positives / absent if absent else 0.0}",
+                "# HELP ehr_api_patient_filter_estimated_error_rate False "
+                "positive rate estimated from the filter's fill.",
+                "# TYPE ehr_api_patient_filter_estimated_error_rate gauge",
+                "ehr_api_patient_filter_estimated_error_rate "
+                f"{self.bloom.error_rate() if self.bloom else 0.0}",
+            ]
+        return "\n".join(lines) + "\n"
+
+
+@event.listens_for(Session, "after_commit")
+def apply_committed_patients(session: Session) -> None:
+    """Apply the patients created and deleted in a committed transaction."""
+    for patient_filter, created, deleted in session.info.pop(PENDING, []):
+        patient_filter.add_created(created)
+        patient_filter.discard_deleted(deleted)
+
+
+@event.listens_for(Session, "after_rollback")
+def forget_rolled_back_patients(session: Session) -> None:
+    """Forget the patients written in a rolled back transaction."""
+    session.info.pop(PENDING, None)
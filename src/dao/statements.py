@@ -0,0 +1,53 @@
+"""Dialect-specific statements."""
+
+from collections.abc import Sequence
+from typing import TYPE_CHECKING, Any
+
+from sqlalchemy import Insert
+from sqlalchemy.orm import Session
+
+if TYPE_CHECKING:
+    from sqlalchemy.dialects import postgresql, sqlite
+
+
+def dialect_insert(
+    target: Any, session: Session
+) -> "sqlite.Insert | postgresql.Insert":
+    """Build an INSERT supporting ON CONFLICT clauses.
+
+    Dialects are imported on first use, which keeps those not in use out
+    of startup.
+    """
+    dialect = session.get_bind().dialect.name
+    if dialect == "sqlite":
+        from sqlalchemy.dialects import sqlite
+
+        return sqlite.insert(target)
+    if dialect == "postgresql":
+        from sqlalchemy.dialects import postgresql
+
+        return postgresql.insert(target)
+    raise NotImplementedError(f"Upserts are not supported on {dialect}")
+
+
+def upsert_statement(
+    target: Any,
+    index_elements: Sequence[str],
+    update_columns: Sequence[str],
+    session: Session,
+) -> Insert:
+    """Build an INSERT that updates rows conflicting on a unique index."""
+    statement = dialect_insert(target, session)
+    return statement.on_conflict_do_update(
+        index_elements=index_elements,
+        set_={column: statement.excluded[column] for column in update_columns},
+    )
+
+
+def insert_missing_statement(
+    target: Any, index_elements: Sequence[str], session: Session
+) -> Insert:
+    """Build an INSERT that skips rows conflicting on a unique index."""
+    return dialect_insert(target, session).on_conflict_do_nothing(
+        index_elements=index_elements
+    )
@@ -0,0 +1,101 @@
+"""Conversion of lab values to each lab's normalized units."""
+
+from collections.abc import Mapping, Sequence
+from typing import NamedTuple
+
+import numpy as np
+
+
+class Conversion(NamedTuple):
+    """Linear conversion of values to normalized units."""
+
+    units: str  # normalized units
+    factor: float = 1.0
+    offset: float = 0.0
+
+
+# Conversions by lab catalogue code and lower-case units.
+DEFAULT_CONVERSIONS: dict[str, dict[str, Conversion]] = {
+    "METABOLIC_GLUCOSE": {
+        "mmol/l": Conversion("mmol/L"),
+        "mg/dl": Conversion("mmol/L", 1 / 18.016),
+    },
+    "METABOLIC_CREATININE": {
+        "umol/l": Conversion("umol/L"),
+        "mg/dl": Conversion("umol/L", 88.42),
+    },
+    "METABOLIC_BUN": {
+        "mmol/l": Conversion("mmol/L"),
+        "mg/dl": Conversion("mmol/L", 0.357),
+    },
+    "METABOLIC_CALCIUM": {
+        "mmol/l": Conversion("mmol/L"),
+        "mg/dl": Conversion("mmol/L", 0.2495),
+    },
+    "METABOLIC_SODIUM": {
+        "mmol/l": Conversion("mmol/L"),
+        "meq/l": Conversion("mmol/L"),
+    },
+    "METABOLIC_POTASSIUM": {
+        "mmol/l": Conversion("mmol/L"),
+        "meq/l": Conversion("mmol/L"),
+    },
+    "METABOLIC_CHLORIDE": {
+        "mmol/l": Conversion("mmol/L"),
+        "meq/l": Conversion("mmol/L"),
+    },
+    "CBC_HEMOGLOBIN": {
+        "g/dl": Conversion("g/dL"),
+        "gm/dl": Conversion("g/dL"),
+        "g/l": Conversion("g/dL", 0.1),
+        "mmol/l": Conversion("g/dL", 1.611),
+    },
+    "VITALS_TEMPERATURE": {
+        "c": Conversion("C"),
+        "f": Conversion("C", 5 / 9, -160 / 9),
+    },
+}
+
+
+class UnitRegistry:
+    """Conversions keyed on lab catalogue code and units.
+
+    Units without a conversion are their own normalized units.
+    """
+
+    def __init__(
+        self, conversions: Mapping[str, Mapping[str, Conversion]]
+    ) -> None:
+        """Initialize."""
+        self.conversions = {
+            code: {
+                units.lower(): conversion for units, conversion in by.items()
+            }
+            for code, by in conversions.items()
+        }
+
+    def register(self, code: str, units: str, conversion: Conversion) -> None:
+        """Add or replace the conversion of a lab's units."""
+        self.conversions.setdefault(code, {})[units.lower()] = conversion
+
+    def conversion(self, code: str, units: str) -> Conversion:
+        """Get the conversion of a lab's units."""
+        return self.conversions.get(code, {}).get(
+            units.strip().lower(), Conversion(units)
+        )
+
+
+def normalize(
+    values: Sequence[float],
+    factors: Sequence[float],
+    offsets: Sequence[float],
+) -> list[float]:
+    """Convert values with their conversions' factors and offsets."""
+    normalized: list[float] = (
+        np.asarray(values, np.float64) * np.asarray(factors, np.float64)
+        + np.asarray(offsets, np.float64)
+    ).tolist()
+    return normalized
+
+
+registry = UnitRegistry(DEFAULT_CONVERSIONS)
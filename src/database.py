@@ -1,16 +1,340 @@
 """Set up database."""
 
-from sqlalchemy import Engine, create_engine
+import hashlib
+import logging
+import os
+import time
+from collections import deque
+from typing import Any
 
-from dao.models import Base
+from sqlalchemy import (
+    Engine,
+    MetaData,
+    Table,
+    and_,
+    create_engine,
+    delete,
+    event,
+    func,
+    insert,
+    inspect,
+    select,
+    text,
+)
+from sqlalchemy.engine import ExceptionContext
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateIndex, CreateTable
 
+from dao.admission_dao import backfill_admissions
+from dao.change_dao import record_changes
+from dao.lab_catalogue import catalogue_code
+from dao.models import (
+    LAB_SEARCH_DDL,
+    Base,
+    Entity,
+    Lab,
+    LabCatalogue,
+    Operation,
+    SchemaVersion,
+)
+from dao.units import registry
 
-def setup(database_path: str) -> Engine:
-    """Set up database."""
+logger = logging.getLogger(__name__)
+
+DEFAULT_URL = "sqlite:///my_db.db"
+# Set once the schema is set up, so that server workers skip doing it again.
+SCHEMA_READY = "EHR_API_SCHEMA_READY"
+
+
+def database_url() -> str:
+    """Get the URL of the database to serve, from `EHR_API_DATABASE_URL`."""
+    return os.environ.get("EHR_API_DATABASE_URL", DEFAULT_URL)
+
+
+class SlowQueryLog:
+    """Log queries slower than a threshold, with their query plan.
+
+    Parameters are only logged as a digest, since they may contain patient
+    data; the digest still tells repeated executions apart.
+    """
+
+    def __init__(
+        self,
+        threshold: float,
+        explain: bool = True,
+        max_entries: int = 100,
+    ) -> None:
+        """Initialize. `threshold` is in seconds."""
+        self.threshold = threshold
+        self.explain = explain
+        self.entries: deque[dict[str, Any]] = deque(maxlen=max_entries)
+
+    def attach(self, engine: Engine) -> None:
+        """Start watching an engine's queries."""
+        event.listen(engine, "before_cursor_execute", self.before_execute)
+        event.listen(engine, "after_cursor_execute", self.after_execute)
+        event.listen(engine, "handle_error", self.handle_error)
+
+    def before_execute(
+        self,
+        conn: Any,
+        cursor: Any,
+        statement: str,
+        parameters: Any,
+        context: Any,
+        executemany: bool,
+    ) -> None:
+        """Start timing a query."""
+        conn.info.setdefault("slow_query_start", {})[context] = (
+            time.perf_counter()
+        )
+
+    def after_execute(
+        self,
+        conn: Any,
+        cursor: Any,
+        statement: str,
+        parameters: Any,
+        context: Any,
+        executemany: bool,
+    ) -> None:
+        """Log the query if it was slow."""
+        duration = time.perf_counter() - conn.info["slow_query_start"].pop(
+            context
+        )
+        if duration < self.threshold:
+            return
+        entry = {
+            "statement": statement,
+            "parameters_digest": hashlib.sha256(
+                repr(parameters).encode()
+            ).hexdigest()[:16],
+            "duration_ms": round(1000 * duration, 3),
+            "plan": None,
+        }
+        if self.explain and not executemany:
+            entry["plan"] = self.query_plan(conn, statement, parameters)
+        self.entries.append(entry)
+        logger.warning(
+            "Slow query (%.1f ms, parameters %s): %s\n%s",
+            entry["duration_ms"],
+            entry["parameters_digest"],
+            statement,
+            entry["plan"] or "",
+            extra={"slow_query": entry},
+        )
+
+    @staticmethod
+    def handle_error(exception_context: ExceptionContext) -> None:
+        """Stop timing a query that failed."""
+        if exception_context.connection is not None:
+            exception_context.connection.info.get("slow_query_start", {}).pop(
+                exception_context.execution_context, None
+            )
+
+    @staticmethod
+    def query_plan(conn: Any, statement: str, parameters: Any) -> str | None:
+        """Get the plan of a SELECT, on a separate cursor."""
+        if not statement.lstrip().upper().startswith("SELECT"):
+            return None
+        prefix = (
+            "EXPLAIN QUERY PLAN"
+            if conn.dialect.name == "sqlite"
+            else "EXPLAIN"
+        )
+        cursor = conn.connection.dbapi_connection.cursor()
+        try:
+            cursor.execute(f"{prefix} {statement}", parameters)
+            return "\n".join(
+                " ".join(str(column) for column in row)
+                for row in cursor.fetchall()
+            )
+        except Exception:  # the plan is best effort
+            logger.debug("Could not explain query", exc_info=True)
+            return None
+        finally:
+            cursor.close()
+
+
+def schema_digest(engine: Engine) -> str:
+    """Get a digest of the DDL of the schema, in the engine's dialect."""
+    digest = hashlib.sha256()
+    for table in Base.metadata.sorted_tables:
+        digest.update(str(CreateTable(table).compile(engine)).encode())
+        for index in sorted(table.indexes, key=lambda index: str(index.name)):
+            create = CreateIndex(index)  # type: ignore[no-untyped-call]
+            digest.update(str(create.compile(engine)).encode())
+    for statement in LAB_SEARCH_DDL.get(engine.dialect.name, []):
+        digest.update(statement.encode())
+    return digest.hexdigest()
+
+
+class SchemaError(Exception):
+    """Raised when the database's tables do not match the models."""
+
+
+def schema_mismatches(engine: Engine) -> list[str]:
+    """Describe how the database's tables differ from the models' columns.
+
+    `create_all` creates missing tables but never alters existing ones, so
+    tables created by older versions may lack columns or have others.
+    """
+    inspector = inspect(engine)
+    tables = set(inspector.get_table_names())
+    mismatches = []
+    for table in Base.metadata.sorted_tables:
+        if table.name not in tables:
+            mismatches.append(f"table {table.name} is missing")
+            continue
+        columns = {
+            column["name"] for column in inspector.get_columns(table.name)
+        }
+        expected = set(table.c.keys())
+        for name in sorted(expected - columns):
+            mismatches.append(f"column {table.name}.{name} is missing")
+        for name in sorted(columns - expected):
+            mismatches.append(f"column {table.name}.{name} is unexpected")
+    return mismatches
+
+
+def stored_schema_digest(engine: Engine) -> str | None:
+    """Get the digest of the schema the database was set up with, if any."""
+    try:
+        with engine.connect() as conn:
+            return conn.scalar(select(SchemaVersion.digest))
+    except DBAPIError:  # set up before digests were recorded, or not at all
+        return None
+
+
+def migrate_legacy_labs(engine: Engine) -> bool:
+    """Move labs stored with their own name and units to catalogue entries.
+
+    Databases created before the lab catalogue have `name` and `units`
+    columns on labs. Their labs are copied aside, and the labs table created
+    anew with an entry for each distinct name and units and the normalized
+    value of each lab. Of labs sharing a natural key, the one with the
+    lowest id is kept, and the others are recorded as deleted in the change
+    log. Returns whether there was anything to migrate.
+    """
+    inspector = inspect(engine)
+    if not inspector.has_table("labs"):
+        return False
+    columns = {column["name"] for column in inspector.get_columns("labs")}
+    if "catalogue_id" in columns or not {"name", "units"} <= columns:
+        return False
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE labs_legacy AS SELECT * FROM labs"))
+        conn.execute(text("DROP TABLE labs"))
+        legacy = Table("labs_legacy", MetaData(), autoload_with=conn)
+        Base.metadata.tables["lab_catalogue"].create(conn, checkfirst=True)
+        entries = conn.execute(
+            select(legacy.c.name, legacy.c.units).distinct()
+        ).all()
+        if entries:
+            rows = []
+            for name, units in entries:
+                code = catalogue_code(name)
+                conversion = registry.conversion(code, units)
+                rows.append(
+                    {
+                        "name": name,
+                        "units": units,
+                        "code": code,
+                        "normalized_units": conversion.units,
+                        "factor": conversion.factor,
+                        "offset": conversion.offset,
+                    }
+                )
+            conn.execute(insert(LabCatalogue), rows)
+        Base.metadata.tables["labs"].create(conn)
+        kept = select(func.min(legacy.c.id)).group_by(
+            legacy.c.patient_id,
+            legacy.c.admission_number,
+            legacy.c.datetime,
+            legacy.c.name,
+            legacy.c.units,
+        )
+        conn.execute(
+            insert(Lab).from_select(
+                [
+                    "id",
+                    "patient_id",
+                    "admission_number",
+                    "datetime",
+                    "catalogue_id",
+                    "value",
+                    "normalized_value",
+                ],
+                select(
+                    legacy.c.id,
+                    legacy.c.patient_id,
+                    legacy.c.admission_number,
+                    legacy.c.datetime,
+                    LabCatalogue.id,
+                    legacy.c.value,
+                    legacy.c.value * LabCatalogue.factor + LabCatalogue.offset,
+                )
+                .join(
+                    LabCatalogue,
+                    and_(
+                        LabCatalogue.name == legacy.c.name,
+                        LabCatalogue.units == legacy.c.units,
+                    ),
+                )
+                .where(legacy.c.id.in_(kept)),
+            )
+        )
+        Base.metadata.tables["changes"].create(conn, checkfirst=True)
+        with Session(conn) as session:
+            record_changes(
+                Entity.lab,
+                select(legacy.c.id).where(legacy.c.id.not_in(kept)),
+                Operation.delete,
+                session,
+            )
+        legacy.drop(conn)
+    return True
+
+
+def setup(
+    database_path: str, slow_query_log: SlowQueryLog | None = None
+) -> Engine:
+    """Set up database.
+
+    Databases already set up with the current schema are left as they are,
+    which skips checking each table and index. Others have missing tables
+    and indexes created, and are only recorded as current once their
+    tables are checked to match the models; otherwise SchemaError is
+    raised.
+    """
     engine = create_engine(database_path, isolation_level="SERIALIZABLE")
+    if slow_query_log is not None:
+        slow_query_log.attach(engine)
+    digest = schema_digest(engine)
+    if stored_schema_digest(engine) == digest:
+        return engine
+    # Before create_all, which fills lab counts from the labs' catalogue ids.
+    migrate_legacy_labs(engine)
     Base.metadata.create_all(engine)
+    mismatches = schema_mismatches(engine)
+    if mismatches:
+        engine.dispose()
+        raise SchemaError(
+            "Database schema does not match the models: "
+            + "; ".join(mismatches)
+        )
+    # create_all only indexes the tables it creates.
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+    with Session(engine) as session, session.begin():
+        # Databases created before admissions were tracked have labs without.
+        backfill_admissions(session)
+        session.execute(delete(SchemaVersion))
+        session.add(SchemaVersion(digest=digest))
     return engine
 
 
 if __name__ == "__main__":
-    setup("sqlite:///my_db.db")
+    setup(database_url())
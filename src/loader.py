@@ -0,0 +1,387 @@
+"""Bulk-load patients and labs from tab-delimited EHR extracts.
+
+Usage:
+
+    python loader.py sqlite:///my_db.db \
+        --patients PatientCorePopulatedTable.txt \
+        --labs LabsCorePopulatedTable.txt
+
+Files are read in chunks, which are parsed (optionally in a process pool)
+and inserted by a single writer, one transaction per chunk.
+"""
+
+import argparse
+import enum
+import re
+import sys
+import time
+import uuid
+from collections import deque
+from collections.abc import Callable, Iterator
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, NamedTuple, TypeVar, cast
+
+from sqlalchemy import Engine, Table, insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, sessionmaker
+
+import database
+from dao import ConflictError, batched
+from dao.admission_dao import record_admissions
+from dao.change_dao import record_many_changes
+from dao.lab_catalogue import LabCatalogueCache
+from dao.lab_dao import (
+    IN_CHUNK_SIZE,
+    NATURAL_KEY,
+    UPSERT_COLUMNS,
+    normalize_rows,
+)
+from dao.lab_name_dao import LabNameDao
+from dao.models import (
+    Entity,
+    Gender,
+    Lab,
+    LabCatalogue,
+    Language,
+    MaritalStatus,
+    Operation,
+    Patient,
+    Race,
+)
+from dao.statements import upsert_statement
+
+PATIENT_COLUMNS = {
+    "id": "PatientID",
+    "gender": "PatientGender",
+    "date_of_birth": "PatientDateOfBirth",
+    "race": "PatientRace",
+    "marital_status": "PatientMaritalStatus",
+    "language": "PatientLanguage",
+}
+LAB_COLUMNS = {
+    "patient_id": "PatientID",
+    "admission_number": "AdmissionID",
+    "name": "LabName",
+    "value": "LabValue",
+    "units": "LabUnits",
+    "datetime": "LabDateTime",
+}
+# Escapes of the characters that would split a field or a line, in the
+# names and units of labs.
+ESCAPES = {"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"}
+ESCAPE_TABLE = str.maketrans(ESCAPES)
+UNESCAPES = {escaped: character for character, escaped in ESCAPES.items()}
+ESCAPE_PATTERN = re.compile(r"\\[\\tnr]")
+
+EnumT = TypeVar("EnumT", bound=enum.Enum)
+
+
+def enum_parser(enum_type: type[EnumT]) -> Callable[[str], EnumT]:
+    """Make a parser matching an enum's names or values, ignoring case."""
+    members = {}
+    for member in enum_type:
+        members[member.name.lower()] = member
+        members[str(member.value).lower()] = member
+
+    def parse(text: str) -> EnumT:
+        try:
+            return members[text.strip().lower()]
+        except KeyError:
+            raise ValueError(
+                f"invalid {enum_type.__name__} {text!r}"
+            ) from None
+
+    return parse
+
+
+PATIENT_PARSERS: dict[str, Callable[[str], Any]] = {
+    "id": str.strip,
+    "gender": enum_parser(Gender),
+    "date_of_birth": datetime.fromisoformat,
+    "race": enum_parser(Race),
+    "marital_status": enum_parser(MaritalStatus),
+    "language": enum_parser(Language),
+}
+
+
+def escape(text: str) -> str:
+    """Escape backslashes, tabs and line breaks in a field."""
+    return text.translate(ESCAPE_TABLE)
+
+
+def parse_text(text: str) -> str:
+    """Strip a text field and undo the escapes of `escape`."""
+    return ESCAPE_PATTERN.sub(lambda match: UNESCAPES[match[0]], text.strip())
+
+
+LAB_PARSERS: dict[str, Callable[[str], Any]] = {
+    "patient_id": str.strip,
+    "admission_number": int,
+    "name": parse_text,
+    "value": float,
+    "units": parse_text,
+    "datetime": datetime.fromisoformat,
+}
+
+
+class Chunk(NamedTuple):
+    """Lines of a delimited file."""
+
+    header: list[str]
+    first_line: int  # 1-based line number of the first line in the file
+    lines: list[str]
+
+
+class ParsedChunk(NamedTuple):
+    """Rows parsed from a chunk, and the reasons lines were rejected."""
+
+    rows: list[dict[str, Any]]
+    errors: list[str]
+
+
+class LoadStats(NamedTuple):
+    """Outcome of loading a file."""
+
+    loaded: int
+    rejected: int
+    seconds: float
+
+
+def read_chunks(path: Path, chunk_size: int) -> Iterator[Chunk]:
+    """Read a tab-delimited file with a header in chunks of lines."""
+    with path.open(encoding="utf-8-sig") as file:
+        header = file.readline().rstrip("\r\n").split("\t")
+        first_line = 2
+        lines: list[str] = []
+        for line in file:
+            lines.append(line)
+            if len(lines) == chunk_size:
+                yield Chunk(header, first_line, lines)
+                first_line += len(lines)
+                lines = []
+        if lines:
+            yield Chunk(header, first_line, lines)
+
+
+def parse_chunk(entity: Entity, chunk: Chunk) -> ParsedChunk:
+    """Parse and validate a chunk of patients or labs into rows."""
+    columns, parsers = (
+        (PATIENT_COLUMNS, PATIENT_PARSERS)
+        if entity == Entity.patient
+        else (LAB_COLUMNS, LAB_PARSERS)
+    )
+    missing = set(columns.values()) - set(chunk.header)
+    if missing:
+        raise ValueError(f"missing columns: {', '.join(sorted(missing))}")
+    indexes = {
+        field: chunk.header.index(name) for field, name in columns.items()
+    }
+    width = max(indexes.values()) + 1
+    rows = []
+    errors = []
+    for line_number, line in enumerate(chunk.lines, start=chunk.first_line):
+        if not line.strip():
+            continue
+        fields = line.rstrip("\r\n").split("\t")
+        if len(fields) < width:
+            errors.append(f"line {line_number}: too few columns")
+            continue
+        try:
+            row = {
+                field: parsers[field](fields[index])
+                for field, index in indexes.items()
+            }
+        except ValueError as e:
+            errors.append(f"line {line_number}: {e}")
+            continue
+        if entity == Entity.lab:
+            row["id"] = str(uuid.uuid4())
+        rows.append(row)
+    return ParsedChunk(rows, errors)
+
+
+def insert_rows(
+    entity: Entity,
+    rows: list[dict[str, Any]],
+    upsert: bool,
+    catalogue: LabCatalogueCache,
+    session: Session,
+) -> None:
+    """Insert rows with one executemany, recording them in the change log.
+
+    The names and units of labs are replaced by their catalogue entries,
+    their values normalized, and their admissions created or widened.
+    """
+    if entity == Entity.patient:
+        table = cast(Table, Patient.__table__)
+        index_elements = ["id"]
+        update_columns = [
+            column for column in PATIENT_COLUMNS if column != "id"
+        ]
+    else:
+        table = cast(Table, Lab.__table__)
+        index_elements = NATURAL_KEY
+        update_columns = UPSERT_COLUMNS
+        entries: dict[tuple[str, str], LabCatalogue] = {}
+        for row in rows:
+            key = (row.pop("name"), row.pop("units"))
+            if key not in entries:
+                entries[key] = catalogue.resolve(*key, session)
+            row["catalogue_id"] = entries[key].id
+        normalize_rows(rows, {entry.id: entry for entry in entries.values()})
+    if not upsert:
+        session.execute(insert(table), rows)
+        changes = [(row["id"], Operation.create) for row in rows]
+    else:
+        statement = upsert_statement(
+            table, index_elements, update_columns, session
+        ).returning(table.c.id)
+        new_ids = {row["id"] for row in rows}
+        if entity == Entity.patient:
+            # Patient ids come from the file, so some may already exist.
+            for ids in batched(list(new_ids), IN_CHUNK_SIZE):
+                new_ids.difference_update(
+                    session.scalars(
+                        select(table.c.id).where(table.c.id.in_(ids))
+                    )
+                )
+        changes = []
+        for id in session.scalars(statement, rows):
+            changes.append(
+                (id, Operation.create if id in new_ids else Operation.update)
+            )
+            new_ids.discard(id)  # a repeated row updates the first
+    record_many_changes(entity, changes, session)
+    if entity == Entity.lab:
+        record_admissions(
+            (
+                (row["patient_id"], row["admission_number"], row["datetime"])
+                for row in rows
+            ),
+            session,
+        )
+
+
+def parsed_chunks(
+    entity: Entity, chunks: Iterator[Chunk], workers: int
+) -> Iterator[ParsedChunk]:
+    """Parse chunks in order, in a pool of `workers` processes if above 1.
+
+    At most two chunks per worker are in flight, so memory use is bounded
+    however large the file.
+    """
+    if workers <= 1:
+        for chunk in chunks:
+            yield parse_chunk(entity, chunk)
+        return
+    with ProcessPoolExecutor(workers) as executor:
+        pending: deque[Future[ParsedChunk]] = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(parse_chunk, entity, chunk))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def load(
+    engine: Engine,
+    entity: Entity,
+    path: Path,
+    chunk_size: int = 50_000,
+    workers: int = 1,
+    upsert: bool = False,
+    skip_invalid: bool = False,
+    report: Callable[[str], None] = lambda message: None,
+) -> LoadStats:
+    """Load a file of patients or labs.
+
+    Each chunk is inserted in its own transaction. Invalid lines abort the
+    load with ValueError unless `skip_invalid` is set, in which case they
+    are reported and skipped; rows conflicting with existing ones raise
+    ConflictError unless `upsert` is set. Lab counts are recomputed once
+    labs are loaded.
+    """
+    Session = sessionmaker(bind=engine)
+    catalogue = LabCatalogueCache()
+    start = time.perf_counter()
+    loaded = rejected = 0
+    for rows, errors in parsed_chunks(
+        entity, read_chunks(path, chunk_size), workers
+    ):
+        if errors and not skip_invalid:
+            raise ValueError(f"{path}: {errors[0]}")
+        for error in errors:
+            report(f"{path}: skipped {error}")
+        rejected += len(errors)
+        if not rows:
+            continue
+        try:
+            with Session.begin() as session:
+                insert_rows(entity, rows, upsert, catalogue, session)
+        except IntegrityError as e:
+            raise ConflictError(
+                f"{path}: {entity}s conflict with existing ones"
+            ) from e
+        loaded += len(rows)
+        report(f"{path}: {loaded} {entity}s loaded")
+    if entity == Entity.lab and loaded:
+        LabNameDao(engine).refresh_counts()
+    return LoadStats(loaded, rejected, time.perf_counter() - start)
+
+
+def main() -> int:
+    """Load files given on the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("database", help="e.g. sqlite:///my_db.db")
+    parser.add_argument("--patients", type=Path, help="patients file")
+    parser.add_argument("--labs", type=Path, help="labs file")
+    parser.add_argument("--chunk-size", type=int, default=50_000)
+    parser.add_argument(
+        "--workers", type=int, default=1, help="parser processes"
+    )
+    parser.add_argument(
+        "--upsert",
+        action="store_true",
+        help="update existing patients and labs instead of failing",
+    )
+    parser.add_argument(
+        "--skip-invalid",
+        action="store_true",
+        help="skip invalid lines instead of failing",
+    )
+    args = parser.parse_args()
+
+    engine = database.setup(args.database)
+    for entity, path in [
+        (Entity.patient, args.patients),
+        (Entity.lab, args.labs),
+    ]:
+        if path is None:
+            continue
+        try:
+            stats = load(
+                engine,
+                entity,
+                path,
+                args.chunk_size,
+                args.workers,
+                args.upsert,
+                args.skip_invalid,
+                report=lambda message: print(message, file=sys.stderr),
+            )
+        except (ConflictError, ValueError) as e:
+            print(f"error: {e}", file=sys.stderr)
+            return 1
+        print(
+            f"{path}: loaded {stats.loaded}, rejected {stats.rejected}"
+            f" in {stats.seconds:.1f}s"
+            f" ({stats.loaded / max(stats.seconds, 1e-9):.0f} rows/s)"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
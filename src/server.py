@@ -0,0 +1,48 @@
+"""Serve the API, optionally with several worker processes.
+
+Usage:
+
+    python server.py --workers 4 --host 0.0.0.0 --port 34491
+
+The database schema is set up once, by this process, before the workers
+start, so they neither repeat nor contend on it. Each worker then creates
+its own engine and connection pool on first use. Export jobs left
+unfinished by a previous server are failed here too, since no worker can
+tell them from another worker's running jobs.
+"""
+
+import argparse
+import os
+import sys
+
+import uvicorn
+
+import database
+from api.exports import ExportStore, export_directory
+
+
+def main() -> int:
+    """Set up the database and serve the API."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.environ.get("EHR_API_WORKERS", "1")),
+        help="worker processes (default: $EHR_API_WORKERS or 1)",
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    database.setup(database.database_url()).dispose()
+    ExportStore(export_directory()).fail_interrupted()
+    # Inherited by the workers.
+    os.environ[database.SCHEMA_READY] = "1"
+    uvicorn.run(
+        "api.api:app", host=args.host, port=args.port, workers=args.workers
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
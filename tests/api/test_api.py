@@ -1,16 +1,42 @@
 """Tests for api.py."""
 
+import asyncio
+import contextlib
 import datetime
+import json
+from pathlib import Path
 
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import Engine, create_engine
+from sqlalchemy import Engine, create_engine, select
+from sqlalchemy.orm import Session
 from sqlalchemy.pool import StaticPool
 
-from api.api import app, get_engine
+from api.api import (
+    KEY_REUSED,
+    app,
+    get_engine,
+    get_exporter,
+    get_idempotency_dao,
+    get_lab_hub,
+    get_lab_store,
+    get_patient_filter,
+    get_profile_directory,
+    idempotency_cache,
+    lab_catalogue,
+    run_periodically,
+    stream_labs,
+)
+from api.events import LabHub, OverflowPolicy
+from api.exports import Exporter, ExportStore
+from api.models import Lab
+from dao.idempotency_dao import IdempotencyDao, KeyCache
 from dao.lab_dao import LabDao
-from dao.models import Base
+from dao.lab_name_dao import LabNameDao
+from dao.lab_store import LabStore
+from dao.models import Base, IdempotencyRecord
 from dao.patient_dao import PatientDao
+from dao.patient_filter import PatientFilter
 
 
 @pytest.fixture
@@ -33,6 +59,9 @@ def db_engine() -> Engine:
 @pytest.fixture
 def client(db_engine: Engine) -> TestClient:
     """Generate test client."""
+    app.dependency_overrides.clear()
+    idempotency_cache.clear()
+    lab_catalogue.clear()
     app.dependency_overrides[get_engine] = lambda: db_engine
 
     return TestClient(app)
@@ -130,6 +159,39 @@ def test_list_labs_exists_succeeds(
     assert len(response.json()) == 1
 
 
+def test_list_labs_matches_read_lab(
+    db_engine: Engine, client: TestClient
+) -> None:
+    """Test list_labs streams labs as read_lab returns them, oldest first."""
+    patient = PatientDao(db_engine).create(
+        date_of_birth=datetime.datetime(2016, 10, 17)
+    )
+    lab_dao = LabDao(db_engine)
+    for day in [3, 1, 2]:
+        lab_dao.create(
+            patient_id=patient.id,
+            admission_number=1,
+            datetime=datetime.datetime(2020, 1, day),
+            name="lab_name",
+            value=day / 10,
+            units="meters",
+        )
+
+    labs = client.get(f"/patients/{patient.id}/labs").json()
+
+    assert [lab["value"] for lab in labs] == [0.1, 0.2, 0.3]
+    assert labs == [
+        client.get(f"/patients/{patient.id}/labs/{lab['id']}").json()
+        for lab in labs
+    ]
+    batch = lab_dao.batch(patient.id)
+    for chunk_size in [1, 2, 3]:
+        chunks = Lab.json_from_storage_batch(batch, chunk_size=chunk_size)
+        assert json.loads("".join(chunks)) == labs
+    empty = lab_dao.batch("does-not-exist")
+    assert json.loads("".join(Lab.json_from_storage_batch(empty))) == []
+
+
 def test_create_lab_patient_exists_succeeds(
     db_engine: Engine, client: TestClient
 ) -> None:
@@ -150,6 +212,30 @@ def test_create_lab_patient_exists_succeeds(
     assert response.status_code == 200
 
 
+def test_create_lab_does_not_load_labs(
+    db_engine: Engine, client: TestClient
+) -> None:
+    """Test create_lab does not read the patient's other labs."""
+    patient_dao = PatientDao(db_engine)
+    patient = patient_dao.create(date_of_birth=datetime.datetime(2016, 10, 17))
+    labs = [
+        {
+            "admission_number": 0,
+            "datetime": f"2024-02-19T16:13:{second:02}",
+            "name": "string",
+            "value": 0,
+            "units": "string",
+        }
+        for second in range(51)
+    ]
+    client.post(f"/patients/{patient.id}/labs/bulk", json=labs[:50])
+
+    response = client.post(f"/patients/{patient.id}/labs", json=labs[50])
+
+    assert response.status_code == 200
+    assert '"4 queries 2 rows"' in response.headers["Server-Timing"]
+
+
 def test_create_lab_patient_does_not_exist_throws(client: TestClient) -> None:
     """Test create_lab."""
     response = client.post(
@@ -206,3 +292,757 @@ def test_get_lab_patient_does_not_exist_throws(
     """Test list_labs."""
     response = client.get("/patients/does-not-exist/labs/does-not-exist")
     assert response.status_code == 404
+
+
+def test_list_changes_paginates(db_engine: Engine, client: TestClient) -> None:
+    """Test list_changes."""
+    patient_dao = PatientDao(db_engine)
+    first = patient_dao.create(date_of_birth=datetime.datetime(2016, 10, 17))
+    second = patient_dao.create(date_of_birth=datetime.datetime(2019, 4, 2))
+
+    response = client.get("/changes", params={"limit": 1})
+    assert response.status_code == 200
+    page = response.json()
+    assert [change["entity_id"] for change in page["changes"]] == [first.id]
+    assert page["has_more"]
+
+    response = client.get("/changes", params={"since": page["next_since"]})
+    assert response.status_code == 200
+    page = response.json()
+    assert page["changes"] == [
+        {
+            "seq": page["next_since"],
+            "entity": "patient",
+            "entity_id": second.id,
+            "operation": "create",
+        }
+    ]
+    assert not page["has_more"]
+
+
+class RecordingHub(LabHub):
+    """Lab hub that records published labs."""
+
+    def __init__(self) -> None:
+        """Initialize."""
+        super().__init__()
+        self.published: list[Lab] = []
+
+    def publish(self, lab: Lab) -> None:
+        """Record a lab."""
+        self.published.append(lab)
+
+
+def test_create_lab_publishes(db_engine: Engine, client: TestClient) -> None:
+    """Test create_lab publishes the created lab."""
+    hub = RecordingHub()
+    app.dependency_overrides[get_lab_hub] = lambda: hub
+    patient_dao = PatientDao(db_engine)
+    patient = patient_dao.create(date_of_birth=datetime.datetime(2016, 10, 17))
+
+    response = client.post(
+        f"/patients/{patient.id}/labs",
+        json={
+            "admission_number": 0,
+            "datetime": "2024-02-19T16:13:28.918Z",
+            "name": "string",
+            "value": 0,
+            "units": "string",
+        },
+    )
+    assert response.status_code == 200
+    assert [lab.id for lab in hub.published] == [response.json()["id"]]
+
+
+def test_upsert_publishes_new_labs_only(
+    db_engine: Engine, client: TestClient
+) -> None:
+    """Test labs that upsert updates are not published as new."""
+    hub = RecordingHub()
+    app.dependency_overrides[get_lab_hub] = lambda: hub
+    patient_dao = PatientDao(db_engine)
+    patient = patient_dao.create(date_of_birth=datetime.datetime(2016, 10, 17))
+    lab = {
+        "admission_number": 0,
+        "datetime": "2024-02-19T16:13:28",
+        "name": "string",
+        "value": 0,
+        "units": "string",
+    }
+    other = {**lab, "datetime": "2024-02-20T16:13:28"}
+    first = client.post(f"/patients/{patient.id}/labs", json=lab).json()
+
+    updated = client.post(
+        f"/patients/{patient.id}/labs",
+        json={**lab, "value": 1},
+        params={"upsert": True},
+    )
+    response = client.post(
+        f"/patients/{patient.id}/labs/bulk",
+        json=[{**lab, "value": 2}, other],
+        params={"upsert": True},
+    )
+
+    assert updated.json()["id"] == first["id"]
+    assert response.status_code == 200
+    assert [lab.id for lab in hub.published] == [
+        first["id"],
+        response.json()[1]["id"],
+    ]
+
+
+def test_stream_labs_subscribes() -> None:
+    """Test stream_labs."""
+
+    async def run() -> None:
+        hub = LabHub()
+        response = await stream_labs(
+            patient_id="Alice",
+            name=None,
+            buffer_size=10,
+            policy=OverflowPolicy.drop_oldest,
+            hub=hub,
+        )
+        assert response.media_type == "text/event-stream"
+        (subscription,) = hub.subscriptions
+        assert subscription.patient_id == "Alice"
+
+    asyncio.run(run())
+
+
+def test_delete_patient_exists_204(
+    db_engine: Engine, client: TestClient
+) -> None:
+    """Test delete_patient."""
+    patient_dao = PatientDao(db_engine)
+    patient = patient_dao.create(date_of_birth=datetime.datetime(2016, 10, 17))
+    LabDao(db_engine).create(
+        patient_id=patient.id,
+        admission_number=0,
+        datetime=datetime.datetime.now(),
+        name="lab_name",
+        value=0.0,
+        units="meters",
+    )
+
+    response = client.delete(f"/patients/{patient.id}")
+    assert response.status_code == 204
+    assert client.get(f"/patients/{patient.id}").status_code == 404
+    assert LabDao(db_engine).list() == []
+
+
+def test_delete_patient_does_not_exist_404(client: TestClient) -> None:
+    """Test delete_patient."""
+    response = client.delete("/patients/does-not-exist")
+    assert response.status_code == 404
+
+
+def test_create_patient_idempotency_key_replays(
+    db_engine: Engine, client: TestClient
+) -> None:
+    """Test create_patient with a repeated Idempotency-Key."""
+    body = {
+        "date_of_birth": "2016-10-17T00:00:00",
+        "gender": "male",
+        "language": "English",
+        "marital_status": "married",
+        "race": "White",
+    }
+    headers = {"Idempotency-Key": "retry-1"}
+
+    first = client.post("/patients", json=body, headers=headers)
+    idempotency_cache.clear()  # exercise the persistent fallback
+    second = client.post("/patients", json=body, headers=headers)
+
+    assert first.status_code == second.status_code == 200
+    assert first.json() == second.json()
+    assert len(PatientDao(db_engine).list()) == 1
+
+
+def test_create_patient_idempotency_key_reused_409(client: TestClient) -> None:
+    """Test create_patient reusing an Idempotency-Key for another body."""
+    body = {
+        "date_of_birth": "2016-10-17T00:00:00",
+        "gender": "male",
+        "language": "English",
+        "marital_status": "married",
+        "race": "White",
+    }
+    headers = {"Idempotency-Key": "retry-1"}
+
+    client.post("/patients", json=body, headers=headers)
+    response = client.post(
+        "/patients", json={**body, "gender": "female"}, headers=headers
+    )
+
+    assert response.status_code == 409
+    assert response.json()["detail"] == KEY_REUSED
+
+
+class RacingIdempotencyDao(IdempotencyDao):
+    """Idempotency DAO whose first lookup misses, as in a concurrent retry."""
+
+    def __init__(self, engine: Engine) -> None:
+        """Initialize."""
+        super().__init__(engine, KeyCache())
+        self.raced = False
+
+    def _read(
+        self, scope: str, key: str, session: Session
+    ) -> IdempotencyRecord | None:
+        """Miss on the first lookup."""
+        if not self.raced:
+            self.raced = True
+            return None
+        return super()._read(scope, key, session)
+
+
+def test_create_patient_idempotency_key_race(
+    db_engine: Engine, client: TestClient
+) -> None:
+    """Test a retry racing the original request creates no second patient."""
+    body = {
+        "date_of_birth": "2016-10-17T00:00:00",
+        "gender": "male",
+        "language": "English",
+        "marital_status": "married",
+        "race": "White",
+    }
+    headers = {"Idempotency-Key": "retry-1"}
+    first = client.post("/patients", json=body, headers=headers)
+    racing = RacingIdempotencyDao(db_engine)
+    app.dependency_overrides[get_idempotency_dao] = lambda: racing
+
+    second = client.post("/patients", json=body, headers=headers)
+    racing.raced = False
+    other = client.post(
+        "/patients", json={**body, "gender": "female"}, headers=headers
+    )
+
+    assert second.status_code == 200
+    assert second.json() == first.json()
+    assert other.status_code == 409
+    assert other.json()["detail"] == KEY_REUSED
+    assert len(PatientDao(db_engine).list()) == 1
+
+
+def test_run_periodically(db_engine: Engine) -> None:
+    """Test run_periodically runs its task on start, such as purges."""
+    IdempotencyDao(db_engine, KeyCache()).create("scope", "old", "", "")
+    idempotency_dao = IdempotencyDao(db_engine, KeyCache(ttl=0))
+
+    async def purge_once() -> None:
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(
+                run_periodically(idempotency_dao.purge, 60), timeout=0.5
+            )
+
+    asyncio.run(purge_once())
+
+    assert IdempotencyDao(db_engine, KeyCache()).read("scope", "old") is None
+    with Session(db_engine) as session:
+        assert session.scalars(select(IdempotencyRecord)).all() == []
+
+
+def test_create_lab_idempotency_key_replays(
+    db_engine: Engine, client: TestClient
+) -> None:
+    """Test create_lab with a repeated Idempotency-Key."""
+    patient_dao = PatientDao(db_engine)
+    patient = patient_dao.create(date_of_birth=datetime.datetime(2016, 10, 17))
+    body = {
+        "admission_number": 0,
+        "datetime": "2024-02-19T16:13:28.918Z",
+        "name": "string",
+        "value": 0,
+        "units": "string",
+    }
+    headers = {"Idempotency-Key": "retry-1"}
+
+    first = client.post(
+        f"/patients/{patient.id}/labs", json=body, headers=headers
+    )
+    second = client.post(
+        f"/patients/{patient.id}/labs", json=body, headers=headers
+    )
+
+    assert first.json() == second.json()
+    assert len(LabDao(db_engine).list()) == 1
+
+
+def test_create_lab_duplicate_409(
+    db_engine: Engine, client: TestClient
+) -> None:
+    """Test create_lab with the natural key of an existing lab."""
+    patient_dao = PatientDao(db_engine)
+    patient = patient_dao.create(date_of_birth=datetime.datetime(2016, 10, 17))
+    body = {
+        "admission_number": 0,
+        "datetime": "2024-02-19T16:13:28.918000",
+        "name": "string",
+        "value": 0,
+        "units": "string",
+    }
+
+    first = client.post(f"/patients/{patient.id}/labs", json=body)
+    second = client.post(f"/patients/{patient.id}/labs", json=body)
+    upserted = client.post(
+        f"/patients/{patient.id}/labs",
+        json={**body, "value": 1},
+        params={"upsert": True},
+    )
+
+    assert first.status_code == 200
+    assert second.status_code == 409
+    assert upserted.status_code == 200
+    assert upserted.json() == {**first.json(), "value": 1.0}
+
+
+def test_create_labs_bulk_succeeds(
+    db_engine: Engine, client: TestClient
+) -> None:
+    """Test create_labs."""
+    patient_dao = PatientDao(db_engine)
+    patient = patient_dao.create(date_of_birth=datetime.datetime(2016, 10, 17))
+    labs = [
+        {
+            "admission_number": admission_number,
+            "datetime": "2024-02-19T16:13:28.918Z",
+            "name": "string",
+            "value": 0,
+            "units": "string",
+        }
+        for admission_number in range(3)
+    ]
+
+    response = client.post(f"/patients/{patient.id}/labs/bulk", json=labs)
+    assert response.status_code == 200
+    assert len(response.json()) == 3
+
+    response = client.post(f"/patients/{patient.id}/labs/bulk", json=labs)
+    assert response.status_code == 409
+
+    response = client.post(
+        f"/patients/{patient.id}/labs/bulk", json=labs, params={"upsert": True}
+    )
+    assert response.status_code == 200
+    assert len(LabDao(db_engine).list()) == 3
+
+
+def test_read_patient_server_timing(
+    db_engine: Engine, client: TestClient
+) -> None:
+    """Test requests report their database time in Server-Timing."""
+    patient_dao = PatientDao(db_engine)
+    patient = patient_dao.create(date_of_birth=datetime.datetime(2016, 10, 17))
+
+    response = client.get(f"/patients/{patient.id}")
+
+    assert '"1 queries 1 rows"' in response.headers["Server-Timing"]
+
+
+def test_list_server_timing_counts_rows(
+    db_engine: Engine, client: TestClient
+) -> None:
+    """Test rows fetched without the ORM are counted in Server-Timing."""
+    patient_dao = PatientDao(db_engine)
+    for _ in range(2):
+        patient_dao.create(date_of_birth=datetime.datetime(2016, 10, 17))
+
+    response = client.get("/patients")
+
+    assert '"1 queries 2 rows"' in response.headers["Server-Timing"]
+
+
+def test_read_metrics_by_route(client: TestClient) -> None:
+    """Test read_metrics."""
+    client.get("/patients/does-not-exist")
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert (
+        'ehr_api_requests_total{method="GET",'
+        'route="/patients/{patient_id}",status="404"}'
+    ) in response.text
+
+
+def test_read_profile(tmp_path: Path, client: TestClient) -> None:
+    """Test read_profile."""
+    app.dependency_overrides[get_profile_directory] = lambda: tmp_path
+    profile_id = "6f9619ff-8b86-d011-b42d-00c04fc964ff"
+    (tmp_path / f"{profile_id}.folded").write_text("main;handler 3\n")
+
+    assert client.get(f"/profiles/{profile_id}").text == "main;handler 3\n"
+    assert client.get("/profiles/..%2Fsecrets").status_code == 404
+    assert (
+        client.get(
+            "/profiles/00000000-0000-0000-0000-000000000000"
+        ).status_code
+        == 404
+    )
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_lab_analytics(
+    tmp_path: Path, db_engine: Engine, client: TestClient, columnar: bool
+) -> None:
+    """Test aggregate_labs, find_cohort and read_lab_series."""
+    if columnar:
+        store = LabStore(tmp_path)
+        app.dependency_overrides[get_lab_store] = lambda: store
+    patient = PatientDao(db_engine).create(
+        date_of_birth=datetime.datetime(2016, 10, 17)
+    )
+    lab_dao = LabDao(db_engine)
+    for day, value in enumerate([5.0, 9.0]):
+        lab_dao.create(
+            patient_id=patient.id,
+            admission_number=0,
+            datetime=datetime.datetime(2020, 1, 1 + day),
+            name="GLUCOSE",
+            value=value,
+            units="mmol/L",
+        )
+
+    response = client.get("/labs/aggregate", params={"name": "GLUCOSE"})
+    assert response.status_code == 200
+    assert response.json() == [
+        {
+            "name": "GLUCOSE",
+            "units": "mmol/L",
+            "labs": 2,
+            "mean": 7.0,
+            "minimum": 5.0,
+            "maximum": 9.0,
+        }
+    ]
+    response = client.get(
+        "/labs/cohort", params={"name": "GLUCOSE", "minimum": 8}
+    )
+    assert response.json() == [patient.id]
+    response = client.get(
+        f"/patients/{patient.id}/labs/series", params={"name": "GLUCOSE"}
+    )
+    assert [point["value"] for point in response.json()] == [5.0, 9.0]
+    response = client.get(
+        "/labs/aggregate", params={"name": "GLUCOSE", "normalize": True}
+    )
+    assert response.json()[0]["labs"] == 2
+    response = client.get(
+        "/patients/foo/labs/series", params={"name": "GLUCOSE"}
+    )
+    assert response.status_code == 404
+
+
+def test_list_labs_normalize(db_engine: Engine, client: TestClient) -> None:
+    """Test list_labs with normalized values."""
+    patient = PatientDao(db_engine).create(
+        date_of_birth=datetime.datetime(2016, 10, 17)
+    )
+    LabDao(db_engine).create(
+        patient_id=patient.id,
+        admission_number=0,
+        datetime=datetime.datetime(2020, 1, 1),
+        name="CBC: HEMOGLOBIN",
+        value=135.0,
+        units="g/L",
+    )
+
+    response = client.get(f"/patients/{patient.id}/labs")
+    assert [(lab["value"], lab["units"]) for lab in response.json()] == [
+        (135.0, "g/L")
+    ]
+    response = client.get(
+        f"/patients/{patient.id}/labs", params={"normalize": True}
+    )
+    assert [(lab["value"], lab["units"]) for lab in response.json()] == [
+        (13.5, "g/dL")
+    ]
+
+
+def test_export_labs(
+    tmp_path: Path, db_engine: Engine, client: TestClient
+) -> None:
+    """Test create_export, read_export and read_export_data."""
+    exporter = Exporter(ExportStore(tmp_path), chunk_size=2)
+    app.dependency_overrides[get_exporter] = lambda: exporter
+    patient = PatientDao(db_engine).create(
+        date_of_birth=datetime.datetime(2016, 10, 17)
+    )
+    lab_dao = LabDao(db_engine)
+    for day in range(5):
+        lab_dao.create(
+            patient_id=patient.id,
+            admission_number=0,
+            datetime=datetime.datetime(2020, 1, 1 + day),
+            name="GLUCOSE" if day else "SODIUM",
+            value=5.0 + day,
+            units="mmol/L",
+        )
+
+    response = client.post("/exports", json={"name": "GLUCOSE"})
+    assert response.status_code == 202
+    location = response.headers["Location"]
+    exporter.shutdown()
+    assert client.get(location).json() == {
+        "id": response.json()["id"],
+        "status": "done",
+        "rows": 4,
+        "total": 4,
+        "error": None,
+    }
+
+    response = client.get(f"{location}/data")
+    assert response.status_code == 200
+    assert response.headers["Accept-Ranges"] == "bytes"
+    lines = response.text.splitlines()
+    assert lines[0].split("\t")[0] == "PatientID"
+    assert sorted(line.split("\t")[3] for line in lines[1:]) == [
+        "6.0",
+        "7.0",
+        "8.0",
+        "9.0",
+    ]
+    data = response.content
+
+    response = client.get(f"{location}/data", headers={"Range": "bytes=10-"})
+    assert response.status_code == 206
+    assert response.content == data[10:]
+    assert response.headers["Content-Range"] == (
+        f"bytes 10-{len(data) - 1}/{len(data)}"
+    )
+    response = client.get(
+        f"{location}/data",
+        headers={"Range": "bytes=0-9", "If-Range": '"stale"'},
+    )
+    assert response.status_code == 200
+    response = client.get(
+        f"{location}/data", headers={"Range": f"bytes={len(data)}-"}
+    )
+    assert response.status_code == 416
+    assert response.headers["Content-Range"] == f"bytes */{len(data)}"
+
+
+def test_export_labs_404(tmp_path: Path, client: TestClient) -> None:
+    """Test read_export and read_export_data with unknown exports."""
+    exporter = Exporter(ExportStore(tmp_path))
+    app.dependency_overrides[get_exporter] = lambda: exporter
+    job = exporter.store.create()
+
+    assert client.get("/exports/..%2Fsecrets").status_code == 404
+    assert (
+        client.get(
+            "/exports/00000000-0000-0000-0000-000000000000/data"
+        ).status_code
+        == 404
+    )
+    assert client.get(f"/exports/{job.id}/data").status_code == 409
+
+
+def test_admissions(db_engine: Engine, client: TestClient) -> None:
+    """Test list_admissions, update_admission and list_admission_labs."""
+    patient = PatientDao(db_engine).create(
+        date_of_birth=datetime.datetime(2016, 10, 17)
+    )
+    for day, number in [(1, 1), (3, 1), (2, 1), (10, 2)]:
+        client.post(
+            f"/patients/{patient.id}/labs",
+            json={
+                "admission_number": number,
+                "datetime": f"2020-01-{day:02}T12:00:00",
+                "name": "GLUCOSE",
+                "value": day,
+                "units": "mmol/L",
+            },
+        )
+
+    response = client.get(f"/patients/{patient.id}/admissions")
+    assert response.json() == [
+        {
+            "patient_id": patient.id,
+            "number": 1,
+            "start": "2020-01-01T12:00:00",
+            "end": "2020-01-03T12:00:00",
+            "length_of_stay": 2.0,
+        },
+        {
+            "patient_id": patient.id,
+            "number": 2,
+            "start": "2020-01-10T12:00:00",
+            "end": "2020-01-10T12:00:00",
+            "length_of_stay": 0.0,
+        },
+    ]
+    response = client.put(
+        f"/patients/{patient.id}/admissions/2",
+        json={"start": "2020-01-09T00:00:00", "end": "2020-01-12T00:00:00"},
+    )
+    assert response.json()["length_of_stay"] == 3.0
+    assert (
+        client.get(f"/patients/{patient.id}/admissions/2").json()
+        == response.json()
+    )
+    # The admission's first lab stands in for its start.
+    response = client.put(
+        f"/patients/{patient.id}/admissions/2",
+        json={"start": None, "end": "2020-01-09T00:00:00"},
+    )
+    assert response.status_code == 422
+    assert (
+        client.get(f"/patients/{patient.id}/admissions/2").json()["end"]
+        == "2020-01-12T00:00:00"
+    )
+
+    response = client.get(f"/patients/{patient.id}/admissions/1/labs")
+    assert [lab["value"] for lab in response.json()] == [1.0, 2.0, 3.0]
+    assert (
+        client.get(f"/patients/{patient.id}/admissions/3/labs").status_code
+        == 404
+    )
+    assert client.get("/patients/foo/admissions").status_code == 404
+    assert (
+        client.put(
+            "/patients/foo/admissions/1", json={"start": None, "end": None}
+        ).status_code
+        == 404
+    )
+
+
+def test_search_lab_names(db_engine: Engine, client: TestClient) -> None:
+    """Test search_lab_names."""
+    patient = PatientDao(db_engine).create(
+        date_of_birth=datetime.datetime(2016, 10, 17)
+    )
+    for day, units in [(1, "mmol/L"), (2, "mmol/L"), (3, "mg/dL")]:
+        client.post(
+            f"/patients/{patient.id}/labs",
+            json={
+                "admission_number": 1,
+                "datetime": f"2020-01-{day:02}T12:00:00",
+                "name": "GLUCOSE",
+                "value": day,
+                "units": units,
+            },
+        )
+    LabNameDao(db_engine).refresh_counts()
+
+    response = client.get("/labs/names", params={"q": "glu"})
+    assert response.json() == [
+        {
+            "name": "GLUCOSE",
+            "labs": 3,
+            "units": [
+                {"units": "mmol/L", "labs": 2},
+                {"units": "mg/dL", "labs": 1},
+            ],
+        }
+    ]
+    assert client.get("/labs/names", params={"q": "ox"}).json() == []
+    assert client.get("/labs/names", params={"q": "g"}).status_code == 422
+
+
+def test_patient_filter(client: TestClient) -> None:
+    """Test unknown patients 404 through the patient filter."""
+    patient_filter = PatientFilter(sync_interval=60.0)
+    app.dependency_overrides[get_patient_filter] = lambda: patient_filter
+    try:
+        response = client.post(
+            "/patients",
+            json={
+                "date_of_birth": "2016-10-17T00:00:00",
+                "gender": "male",
+                "language": "English",
+                "marital_status": "married",
+                "race": "White",
+            },
+        )
+        patient_id = response.json()["id"]
+
+        assert client.get(f"/patients/{patient_id}").status_code == 200
+        assert client.get("/patients/foo").status_code == 404
+        assert client.get("/patients/foo/labs").status_code == 404
+        assert client.delete(f"/patients/{patient_id}").status_code == 204
+        assert client.get(f"/patients/{patient_id}").status_code == 404
+        # Deleted patients stay in the filter until its next sync.
+        assert patient_filter.negatives == 2
+        assert patient_filter.false_positives == 1
+        assert (
+            'ehr_api_patient_filter_lookups_total{result="negative"} 2'
+            in client.get("/metrics").text
+        )
+    finally:
+        # Other users of the app must not see this database's patients.
+        app.dependency_overrides.pop(get_patient_filter)
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_lab_windows(
+    tmp_path: Path, db_engine: Engine, client: TestClient, columnar: bool
+) -> None:
+    """Test read_lab_windows and compute_lab_windows."""
+    if columnar:
+        store = LabStore(tmp_path)
+        app.dependency_overrides[get_lab_store] = lambda: store
+    patient_dao = PatientDao(db_engine)
+    patients = [
+        patient_dao.create(date_of_birth=datetime.datetime(2016, 10, 17))
+        for _ in range(2)
+    ]
+    lab_dao = LabDao(db_engine)
+    for hours, value in [(0, 1.0), (24, 1.2), (36, 1.4), (72, 1.0)]:
+        lab_dao.create(
+            patient_id=patients[0].id,
+            admission_number=0,
+            datetime=datetime.datetime(2020, 1, 1)
+            + datetime.timedelta(hours=hours),
+            name="CREATININE",
+            value=value,
+            units="mg/dL",
+        )
+
+    response = client.get(
+        f"/patients/{patients[0].id}/labs/windows",
+        params={"name": "CREATININE", "window": 48, "threshold": 0.3},
+    )
+    assert response.status_code == 200
+    points = response.json()
+    assert [point["mean"] for point in points] == pytest.approx(
+        [1.0, 1.1, 1.2, 1.2]
+    )
+    assert [point["rise"] for point in points] == pytest.approx(
+        [0.0, 0.2, 0.4, 0.0]
+    )
+    assert [point["flagged"] for point in points] == [
+        False,
+        False,
+        True,
+        False,
+    ]
+    assert points[0]["slope"] is None
+    assert points[1]["slope"] == pytest.approx(0.2 / 24)
+
+    response = client.post(
+        "/labs/windows",
+        json={
+            "patient_ids": [patients[0].id, patients[1].id, "foo"],
+            "name": "CREATININE",
+            "window": 48,
+        },
+    )
+    assert response.status_code == 200
+    by_patient = response.json()
+    assert [point["maximum"] for point in by_patient[patients[0].id]] == [
+        1.0,
+        1.2,
+        1.4,
+        1.4,
+    ]
+    assert by_patient[patients[1].id] == by_patient["foo"] == []
+    assert (
+        client.get(
+            "/patients/foo/labs/windows", params={"name": "CREATININE"}
+        ).status_code
+        == 404
+    )
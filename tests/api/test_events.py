@@ -0,0 +1,82 @@
+"""Tests for events.py."""
+
+import asyncio
+import datetime
+
+from api.events import LabHub, OverflowPolicy, stream_events
+from api.models import Lab
+
+
+def make_lab(lab_id: str, patient_id: str = "Alice") -> Lab:
+    """Make an API lab."""
+    return Lab(
+        id=lab_id,
+        patient_id=patient_id,
+        admission_number=0,
+        datetime=datetime.datetime(2016, 10, 17),
+        name="lab_name",
+        value=0.0,
+        units="meters",
+    )
+
+
+def test_publish_filters_by_patient() -> None:
+    """Test publish() only delivers to matching subscribers."""
+
+    async def run() -> list[str | None]:
+        hub = LabHub()
+        subscription = hub.subscribe(patient_id="Alice")
+        hub.publish(make_lab("1", patient_id="Bob"))
+        hub.publish(make_lab("2", patient_id="Alice"))
+        lab = await subscription.get()
+        assert subscription.queue.empty()
+        return [lab.id if lab else None]
+
+    assert asyncio.run(run()) == ["2"]
+
+
+def test_publish_drop_oldest_keeps_newest() -> None:
+    """Test the drop_oldest overflow policy."""
+
+    async def run() -> tuple[list[str | None], int]:
+        hub = LabHub()
+        subscription = hub.subscribe(buffer_size=2)
+        for lab_id in ["1", "2", "3"]:
+            hub.publish(make_lab(lab_id))
+        labs = [await subscription.get(), await subscription.get()]
+        return [lab.id if lab else None for lab in labs], subscription.dropped
+
+    assert asyncio.run(run()) == (["2", "3"], 1)
+
+
+def test_publish_drop_newest_keeps_oldest() -> None:
+    """Test the drop_newest overflow policy."""
+
+    async def run() -> tuple[list[str | None], int]:
+        hub = LabHub()
+        subscription = hub.subscribe(
+            buffer_size=2, policy=OverflowPolicy.drop_newest
+        )
+        for lab_id in ["1", "2", "3"]:
+            hub.publish(make_lab(lab_id))
+        labs = [await subscription.get(), await subscription.get()]
+        return [lab.id if lab else None for lab in labs], subscription.dropped
+
+    assert asyncio.run(run()) == (["1", "2"], 1)
+
+
+def test_stream_events_disconnects_slow_consumer() -> None:
+    """Test the disconnect overflow policy ends the stream."""
+
+    async def run() -> list[str]:
+        hub = LabHub()
+        subscription = hub.subscribe(
+            buffer_size=1, policy=OverflowPolicy.disconnect
+        )
+        hub.publish(make_lab("1"))
+        hub.publish(make_lab("2"))
+        events = [event async for event in stream_events(hub, subscription)]
+        assert not hub.subscriptions
+        return events
+
+    assert asyncio.run(run()) == ['event: overflow\ndata: {"dropped": 1}\n\n']
@@ -0,0 +1,122 @@
+"""Tests for executor.py and analytics.py."""
+
+import asyncio
+import threading
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine
+
+from api import analytics
+from api.executor import Executor, OverloadedError
+from dao.lab_dao import LabAggregate, LabDao, LabPoint
+from dao.lab_store import LabStore
+from dao.models import Base
+from dao.patient_dao import PatientDao
+
+
+def test_run_threads() -> None:
+    """Test run, without worker processes."""
+    executor = Executor(0, {"add": 1})
+    try:
+        assert asyncio.run(executor.run("add", sum, [1, 2])) == 3
+    finally:
+        executor.shutdown()
+
+
+def test_run_overloaded() -> None:
+    """Test run refuses requests once its queue is full."""
+    executor = Executor(0, {"wait": 1}, queue_size=0)
+    release = threading.Event()
+
+    async def main() -> None:
+        running = asyncio.ensure_future(executor.run("wait", release.wait, 10))
+        await asyncio.sleep(0)
+        with pytest.raises(OverloadedError):
+            await executor.run("wait", release.wait, 10)
+        release.set()
+        assert await running
+
+    try:
+        asyncio.run(main())
+    finally:
+        executor.shutdown()
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_run_processes(tmp_path: Path, columnar: bool) -> None:
+    """Test analytics in worker processes, on a database file."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'labs.db'}")
+    Base.metadata.create_all(engine)
+    patient = PatientDao(engine).create(date_of_birth=datetime(2016, 10, 17))
+    lab_dao = LabDao(engine)
+    for day, value in enumerate([5.0, 9.0]):
+        lab_dao.create(
+            patient_id=patient.id,
+            admission_number=0,
+            datetime=datetime(2020, 1, 1 + day),
+            name="GLUCOSE",
+            value=value,
+            units="mmol/L",
+        )
+    store = LabStore(tmp_path / "store") if columnar else None
+    executor = Executor(1, {"aggregate": 1, "cohort": 1, "series": 1})
+
+    async def main() -> None:
+        assert await executor.run(
+            "aggregate",
+            analytics.aggregate,
+            engine,
+            store,
+            "GLUCOSE",
+            None,
+            None,
+            False,
+        ) == [LabAggregate("GLUCOSE", "mmol/L", 2, 7.0, 5.0, 9.0)]
+        cohort = await executor.run(
+            "cohort",
+            analytics.cohort,
+            engine,
+            store,
+            "GLUCOSE",
+            8.0,
+            None,
+            None,
+            None,
+            False,
+        )
+        assert analytics.unpack_cohort(cohort) == [patient.id]
+        series = await executor.run(
+            "series",
+            analytics.series,
+            engine,
+            store,
+            patient.id,
+            "GLUCOSE",
+            False,
+        )
+        assert [point.value for point in analytics.unpack_series(series)] == [
+            5.0,
+            9.0,
+        ]
+
+    try:
+        asyncio.run(main())
+    finally:
+        executor.shutdown()
+
+
+def test_pack_series() -> None:
+    """Test pack_series and unpack_series."""
+    points = [
+        LabPoint(datetime(2020, 1, 1, 12, 30), 5.5, "mmol/L"),
+        LabPoint(datetime(2020, 1, 2), 99.0, "mg/dL"),
+        LabPoint(datetime(2020, 1, 3), 6.0, "mmol/L"),
+    ]
+    packed = analytics.pack_series(points)
+    assert packed.unit_names == ["mmol/L", "mg/dL"]
+    assert analytics.unpack_series(packed) == points
+    assert analytics.unpack_series(analytics.pack_series([])) == []
+    assert analytics.unpack_cohort(b"a\nb") == ["a", "b"]
+    assert analytics.unpack_cohort(b"") == []
@@ -0,0 +1,243 @@
+"""Tests for exports.py."""
+
+import os
+import sqlite3
+import time
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+from sqlalchemy import Engine, create_engine
+from sqlalchemy.pool import StaticPool
+
+from api.executor import OverloadedError
+from api.exports import (
+    ByteRange,
+    Exporter,
+    ExportFilter,
+    ExportStatus,
+    ExportStore,
+    export_labs,
+    parse_range,
+    read_range,
+)
+from dao.lab_dao import LabDao
+from dao.models import Base
+from dao.patient_dao import PatientDao
+from loader import LAB_COLUMNS, LAB_PARSERS
+
+
+@pytest.fixture
+def db_engine() -> Engine:
+    """Generate database engine."""
+    database_path = "sqlite:///"
+    engine = create_engine(
+        database_path,
+        isolation_level="SERIALIZABLE",
+        # https://fastapi.tiangolo.com/tutorial/sql-databases/#note
+        # https://docs.sqlalchemy.org/en/20/dialects/sqlite.html#using-a-memory-database-in-multiple-threads
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    return engine
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 10])
+def test_export_labs(
+    tmp_path: Path, db_engine: Engine, chunk_size: int
+) -> None:
+    """Test export_labs writes labs in the loader's format."""
+    patient = PatientDao(db_engine).create(date_of_birth=datetime(2016, 1, 1))
+    lab_dao = LabDao(db_engine)
+    for day in range(3):
+        lab_dao.create(
+            patient_id=patient.id,
+            admission_number=day,
+            datetime=datetime(2020, 1, 1 + day, 8, 30, 15, 250000),
+            name="METABOLIC: GLUCOSE",
+            value=90.0 + day,
+            units="mg/dL",
+        )
+    store = ExportStore(tmp_path)
+
+    job = export_labs(
+        db_engine,
+        store,
+        store.create(),
+        ExportFilter(normalize=True),
+        chunk_size,
+    )
+    assert job.status == ExportStatus.done
+    assert job.rows == job.total == 3
+    assert store.read(job.id) == job
+    header, *lines = store.output_path(job.id).read_text().splitlines()
+    assert header.split("\t") == list(LAB_COLUMNS.values())
+    rows = sorted(
+        (
+            {
+                column: LAB_PARSERS[column](text)
+                for column, text in zip(
+                    LAB_COLUMNS, line.split("\t"), strict=True
+                )
+            }
+            for line in lines
+        ),
+        key=lambda row: row["datetime"],
+    )
+    assert [row["units"] for row in rows] == ["mmol/L"] * 3
+    assert [row["value"] for row in rows] == pytest.approx(
+        [90 / 18.016, 91 / 18.016, 92 / 18.016]
+    )
+    assert rows[0]["datetime"] == datetime(2020, 1, 1, 8, 30, 15, 250000)
+
+
+def test_export_labs_escapes(tmp_path: Path, db_engine: Engine) -> None:
+    """Test export_labs escapes tabs and line breaks in names and units."""
+    patient = PatientDao(db_engine).create(date_of_birth=datetime(2016, 1, 1))
+    name = "PANEL\tGLUCOSE\nFASTING \\ AM"
+    LabDao(db_engine).create(
+        patient_id=patient.id,
+        admission_number=0,
+        datetime=datetime(2020, 1, 1),
+        name=name,
+        value=90.0,
+        units="mg\r/dL",
+    )
+    store = ExportStore(tmp_path)
+
+    job = export_labs(db_engine, store, store.create(), ExportFilter(), 10)
+
+    _, line = store.output_path(job.id).read_text().splitlines()
+    fields = dict(zip(LAB_COLUMNS, line.split("\t"), strict=True))
+    assert LAB_PARSERS["name"](fields["name"]) == name
+    assert LAB_PARSERS["units"](fields["units"]) == "mg\r/dL"
+
+
+def test_export_labs_failed(tmp_path: Path) -> None:
+    """Test export_labs records errors."""
+    store = ExportStore(tmp_path)
+
+    job = export_labs(
+        create_engine("sqlite:///"), store, store.create(), ExportFilter(), 10
+    )
+    assert job.status == ExportStatus.failed
+    assert job.error is not None
+    assert not store.output_path(job.id).exists()
+
+
+def test_purge_finished(tmp_path: Path) -> None:
+    """Test ExportStore.purge deletes only jobs finished over ttl ago."""
+    store = ExportStore(tmp_path, ttl=60)
+    jobs = {
+        status: store.create()._replace(status=status)
+        for status in ExportStatus
+    }
+    for job in jobs.values():
+        store.write(job)
+        store.output_path(job.id).write_text("labs")
+        path = store.job_directory(job.id) / "job.json"
+        os.utime(path, (time.time() - 120,) * 2)
+    recent = store.create()._replace(status=ExportStatus.done)
+    store.write(recent)
+
+    assert store.purge() == 2
+
+    assert sorted(job.id for job in store.jobs()) == sorted(
+        [
+            jobs[ExportStatus.pending].id,
+            jobs[ExportStatus.running].id,
+            recent.id,
+        ]
+    )
+    assert not store.job_directory(jobs[ExportStatus.done].id).exists()
+
+
+def test_fail_interrupted(tmp_path: Path) -> None:
+    """Test ExportStore.fail_interrupted fails unfinished jobs."""
+    store = ExportStore(tmp_path)
+    running = store.create()._replace(status=ExportStatus.running, rows=5)
+    store.write(running)
+    partial = store.output_path(running.id).with_suffix(".part")
+    partial.write_text("labs")
+    pending = store.create()
+    done = store.create()._replace(status=ExportStatus.done)
+    store.write(done)
+
+    assert store.fail_interrupted() == 2
+
+    for job in [running, pending]:
+        failed = store.read(job.id)
+        assert failed is not None
+        assert failed.status == ExportStatus.failed
+        assert failed.rows == job.rows
+    assert store.read(done.id) == done
+    assert not partial.exists()
+
+
+def test_read_missing(tmp_path: Path) -> None:
+    """Test ExportStore.read with unknown and malformed ids."""
+    store = ExportStore(tmp_path)
+    assert store.read("00000000-0000-0000-0000-000000000000") is None
+    assert store.read("../job") is None
+
+
+@pytest.mark.parametrize(
+    ("header", "expected"),
+    [
+        ("bytes=0-9", ByteRange(0, 9)),
+        ("bytes=90-", ByteRange(90, 99)),
+        ("bytes=90-200", ByteRange(90, 99)),
+        ("bytes=-10", ByteRange(90, 99)),
+        ("bytes=-200", ByteRange(0, 99)),
+        ("bytes=9-0", None),
+        ("bytes=0-1,5-6", None),
+        ("items=0-9", None),
+        ("bytes=-", None),
+    ],
+)
+def test_parse_range(header: str, expected: ByteRange | None) -> None:
+    """Test parse_range."""
+    assert parse_range(header, 100) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=100-", "bytes=-0"])
+def test_parse_range_unsatisfiable(header: str) -> None:
+    """Test parse_range rejects ranges outside the file."""
+    with pytest.raises(ValueError):
+        parse_range(header, 100)
+
+
+def test_read_range(tmp_path: Path) -> None:
+    """Test read_range."""
+    path = tmp_path / "data"
+    path.write_bytes(bytes(range(256)))
+    assert b"".join(read_range(path, ByteRange(10, 209), 64)) == bytes(
+        range(10, 210)
+    )
+
+
+def test_exporter_refuses_over_queue(tmp_path: Path) -> None:
+    """Test Exporter refuses jobs beyond its workers and queue."""
+    path = tmp_path / "labs.db"
+    engine = create_engine(f"sqlite:///{path}", connect_args={"timeout": 10})
+    Base.metadata.create_all(engine)
+    exporter = Exporter(ExportStore(tmp_path), workers=1, queue_size=1)
+    # Jobs wait to read while another connection holds the database.
+    blocker = sqlite3.connect(path, isolation_level=None)
+    blocker.execute("BEGIN EXCLUSIVE")
+    try:
+        jobs = [exporter.start(engine, ExportFilter()) for _ in range(2)]
+        with pytest.raises(OverloadedError):
+            exporter.start(engine, ExportFilter())
+    finally:
+        blocker.execute("ROLLBACK")
+        blocker.close()
+        exporter.shutdown()
+
+    assert [exporter.store.read(job.id) for job in jobs] == [
+        job._replace(status=ExportStatus.done, total=0) for job in jobs
+    ]
+    exporter.start(engine, ExportFilter())
+    exporter.shutdown()
@@ -0,0 +1,114 @@
+"""Tests for instrumentation.py."""
+
+import time
+from collections.abc import Iterator
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import DBAPIError
+
+from api.instrumentation import (
+    Histogram,
+    Metrics,
+    RequestStats,
+    current_stats,
+    install_query_hooks,
+    timed_stream,
+)
+
+
+def test_histogram_render_cumulative() -> None:
+    """Test Histogram buckets are cumulative, with values on the bound."""
+    histogram = Histogram([0.1, 1.0])
+    for value in [0.05, 0.1, 0.5, 5.0]:
+        histogram.observe(value)
+
+    lines = histogram.render("latency", 'route="/"')
+
+    assert lines == [
+        'latency_bucket{route="/",le="0.1"} 2',
+        'latency_bucket{route="/",le="1.0"} 3',
+        'latency_bucket{route="/",le="+Inf"} 4',
+        'latency_sum{route="/"} 5.65',
+        'latency_count{route="/"} 4',
+    ]
+
+
+def test_metrics_render_by_route() -> None:
+    """Test Metrics labels series by method, route and status."""
+    metrics = Metrics()
+    stats = RequestStats()
+    stats.queries = 2
+    metrics.observe("GET", "/patients/{patient_id}", 200, stats)
+    metrics.observe("GET", "/patients/{patient_id}", 404, stats)
+
+    text = metrics.render()
+
+    assert "# TYPE ehr_api_request_duration_seconds histogram" in text
+    assert (
+        'ehr_api_request_duration_seconds_count{method="GET",'
+        'route="/patients/{patient_id}"} 2'
+    ) in text
+    assert (
+        'ehr_api_requests_total{method="GET",'
+        'route="/patients/{patient_id}",status="404"} 1'
+    ) in text
+    assert (
+        'ehr_api_db_queries_total{method="GET",'
+        'route="/patients/{patient_id}"} 4'
+    ) in text
+
+
+def test_server_timing_components() -> None:
+    """Test RequestStats.server_timing() names every component."""
+    stats = RequestStats()
+    stats.queries = 3
+    stats.rows = 7
+
+    timing = stats.server_timing()
+
+    assert timing.startswith('db;dur=0.000;desc="3 queries 7 rows"')
+    assert [part.split(";")[0] for part in timing.split(", ")] == [
+        "db",
+        "app",
+        "ser",
+        "total",
+    ]
+
+
+def test_timed_stream_counts_encoding() -> None:
+    """Test streamed bodies count as serialization, outside the header."""
+
+    def encode() -> Iterator[str]:
+        for chunk in ["[", "]"]:
+            time.sleep(0.01)
+            yield chunk
+
+    stats = RequestStats()
+    token = current_stats.set(stats)
+    try:
+        chunks = timed_stream(encode())
+    finally:
+        current_stats.reset(token)
+
+    assert list(chunks) == ["[", "]"]
+    assert stats.serialization_seconds() >= 0.02
+    assert "ser;" not in stats.server_timing()
+
+
+def test_query_hooks_forget_failed_queries() -> None:
+    """Test a failed query leaves no start time on its connection."""
+    install_query_hooks()
+    engine = create_engine("sqlite:///")
+    stats = RequestStats()
+    token = current_stats.set(stats)
+    try:
+        with engine.connect() as conn:
+            with pytest.raises(DBAPIError):
+                conn.execute(text("SELECT * FROM no_such_table"))
+            conn.execute(text("SELECT 1"))
+
+            assert not conn.info["query_start"]
+    finally:
+        current_stats.reset(token)
+    assert stats.queries == 1
@@ -0,0 +1,50 @@
+"""Tests for profiling.py."""
+
+import threading
+import time
+from pathlib import Path
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from api.profiling import ProfilingMiddleware, SamplingProfiler
+
+
+def busy_wait(seconds: float) -> None:
+    """Spin for a while."""
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def test_sampling_profiler_folds_stacks() -> None:
+    """Test SamplingProfiler samples the profiled thread."""
+    profiler = SamplingProfiler(threading.get_ident(), interval=0.001)
+
+    profiler.start()
+    busy_wait(0.05)
+    profiler.stop()
+
+    lines = profiler.folded().splitlines()
+    assert lines
+    assert any("busy_wait" in line for line in lines)
+    stack, count = lines[0].rsplit(" ", 1)
+    assert int(count) > 0
+
+
+def test_profiling_middleware_saves_profile(tmp_path: Path) -> None:
+    """Test requests with an X-Profile header are profiled."""
+    app = FastAPI()
+    app.add_middleware(ProfilingMiddleware, directory=tmp_path)
+
+    @app.get("/")
+    async def root() -> dict[str, str]:
+        busy_wait(0.02)
+        return {}
+
+    client = TestClient(app)
+
+    assert "X-Profile-Id" not in client.get("/").headers
+    response = client.get("/", headers={"X-Profile": "1"})
+    profile_id = response.headers["X-Profile-Id"]
+    assert (tmp_path / f"{profile_id}.folded").exists()
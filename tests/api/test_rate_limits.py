@@ -0,0 +1,137 @@
+"""Tests for rate_limits.py."""
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from api.rate_limits import (
+    RateLimiter,
+    RateLimitMiddleware,
+    RouteLimit,
+    TokenBucket,
+)
+
+
+class Clock:
+    """Clock that only moves when told to."""
+
+    def __init__(self) -> None:
+        """Initialize at 0."""
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        """Get the time."""
+        return self.now
+
+
+def test_token_bucket_refills() -> None:
+    """Test TokenBucket admits a burst, then refills at its rate."""
+    bucket = TokenBucket(rate=2.0, burst=4.0, now=0.0)
+
+    assert bucket.take(3.0, now=0.0) == 0.0
+    assert bucket.take(3.0, now=0.0) == 1.0  # 2 tokens short at 2/s
+    assert bucket.take(3.0, now=1.0) == 0.0
+    assert bucket.take(10.0, now=100.0) == 0.0  # capped to the burst
+
+
+def test_rate_limiter_weights_routes_by_cost() -> None:
+    """Test RateLimiter takes a route's cost from its client's bucket."""
+    clock = Clock()
+    limiter = RateLimiter(
+        rate=1.0,
+        burst=10.0,
+        routes={"GET /patients": RouteLimit(cost=5.0)},
+        clock=clock,
+    )
+
+    for _ in range(2):
+        assert limiter.acquire("alice", "GET /patients") is None
+        limiter.release("alice", "GET /patients")
+
+    assert limiter.acquire("alice", "GET /patients") == 5.0
+    assert limiter.acquire("alice", "GET /patients/{patient_id}") == 1.0
+    assert limiter.acquire("bob", "GET /patients") is None
+    clock.now = 1.0
+    assert limiter.acquire("alice", "GET /patients/{patient_id}") is None
+    assert (
+        'ehr_api_rate_limited_total{route="GET /patients",reason="rate"} 1'
+        in limiter.render()
+    )
+
+
+def test_rate_limiter_caps_concurrency() -> None:
+    """Test RateLimiter caps requests running per client and per route."""
+    limiter = RateLimiter(
+        rate=100.0,
+        burst=100.0,
+        routes={
+            "POST /exports": RouteLimit(client_concurrency=1, concurrency=2)
+        },
+    )
+
+    assert limiter.acquire("alice", "POST /exports") is None
+    assert limiter.acquire("alice", "POST /exports") == 1.0
+    assert limiter.acquire("bob", "POST /exports") is None
+    assert limiter.acquire("carol", "POST /exports") == 1.0
+    limiter.release("alice", "POST /exports")
+    assert limiter.acquire("carol", "POST /exports") is None
+    assert not limiter.running.get(("alice", "POST /exports"))
+
+
+def test_rate_limiter_forgets_least_recent_clients() -> None:
+    """Test RateLimiter keeps at most `max_clients` buckets."""
+    limiter = RateLimiter(rate=1.0, burst=1.0, max_clients=2)
+
+    for client in ["alice", "bob", "alice", "carol"]:
+        limiter.acquire(client, "GET /patients")
+
+    assert list(limiter.buckets) == ["alice", "carol"]
+
+
+def test_rate_limit_middleware() -> None:
+    """Test RateLimitMiddleware answers 429 with Retry-After per client."""
+    clock = Clock()
+    app = FastAPI()
+
+    @app.get("/patients/{patient_id}")
+    async def read_patient(patient_id: str) -> str:
+        return patient_id
+
+    app.add_middleware(
+        RateLimitMiddleware,
+        limiter=RateLimiter(rate=0.5, burst=2.0, clock=clock),
+    )
+    client = TestClient(app)
+
+    assert client.get("/patients/a").status_code == 200
+    assert client.get("/patients/b").status_code == 200
+    response = client.get("/patients/c")
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "2"
+    assert response.json() == {"detail": "Too many requests"}
+    # Only proxies may name their clients.
+    other = client.get("/patients/c", headers={"X-Client-Id": "other"})
+    assert other.status_code == 429
+    clock.now = 2.0
+    assert client.get("/patients/c").status_code == 200
+
+
+def test_rate_limit_middleware_trusted_proxies() -> None:
+    """Test RateLimitMiddleware tells apart clients of trusted proxies."""
+    app = FastAPI()
+
+    @app.get("/patients/{patient_id}")
+    async def read_patient(patient_id: str) -> str:
+        return patient_id
+
+    app.add_middleware(
+        RateLimitMiddleware,
+        limiter=RateLimiter(rate=0.5, burst=1.0, clock=Clock()),
+        trusted_proxies=["testclient"],
+    )
+    client = TestClient(app)
+
+    for client_id in ["alice", "bob"]:
+        headers = {"X-Client-Id": client_id}
+        assert client.get("/patients/a", headers=headers).status_code == 200
+        assert client.get("/patients/a", headers=headers).status_code == 429
+    assert client.get("/patients/a").status_code == 200
@@ -0,0 +1,55 @@
+"""Tests for data.py."""
+
+import random
+
+import pytest
+from sqlalchemy import Engine, create_engine
+from sqlalchemy.pool import StaticPool
+
+from benchmark.data import DataSpec, generate, lab_specs, make_labs
+from dao.lab_dao import LabDao
+from dao.models import Base
+
+
+@pytest.fixture
+def db_engine() -> Engine:
+    """Generate database engine."""
+    database_path = "sqlite:///"
+    engine = create_engine(
+        database_path,
+        isolation_level="SERIALIZABLE",
+        # https://fastapi.tiangolo.com/tutorial/sql-databases/#note
+        # https://docs.sqlalchemy.org/en/20/dialects/sqlite.html#using-a-memory-database-in-multiple-threads
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    return engine
+
+
+def test_lab_specs_pads_defaults() -> None:
+    """Test lab_specs() with more names than the defaults."""
+    specs = lab_specs(20)
+
+    assert len({spec.name for spec in specs}) == 20
+
+
+def test_make_labs_reproducible() -> None:
+    """Test make_labs() is deterministic for a seed."""
+    spec = DataSpec(labs_per_patient=10)
+
+    first = make_labs("Alice", spec, random.Random(1))
+    second = make_labs("Alice", spec, random.Random(1))
+
+    assert [(lab.id, lab.name, lab.value) for lab in first] == [
+        (lab.id, lab.name, lab.value) for lab in second
+    ]
+
+
+def test_generate_populates(db_engine: Engine) -> None:
+    """Test generate()."""
+    patients = generate(db_engine, DataSpec(patients=3, labs_per_patient=4))
+
+    assert len(patients) == 3
+    assert len(LabDao(db_engine).list()) == 12
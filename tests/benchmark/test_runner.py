@@ -0,0 +1,35 @@
+"""Tests for runner.py."""
+
+from benchmark.runner import compare, measure, percentile
+
+
+def test_percentile_nearest_rank() -> None:
+    """Test percentile()."""
+    values = [float(value) for value in range(1, 101)]
+
+    assert percentile(values, 0.5) == 50.0
+    assert percentile(values, 0.99) == 99.0
+    assert percentile(values, 0.0) == 1.0
+
+
+def test_measure_runs_warmup_and_iterations() -> None:
+    """Test measure() passes every iteration number once."""
+    seen: list[int] = []
+
+    result = measure(seen.append, iterations=3, warmup=2)
+
+    assert seen == [0, 1, 2, 3, 4]
+    assert result.iterations == 3
+    assert result.p50_ms <= result.p99_ms
+
+
+def test_compare_flags_regressions() -> None:
+    """Test compare()."""
+    baseline = {"fast": {"p50_ms": 1.0}, "slow": {"p50_ms": 1.0}}
+    current = {
+        "fast": {"p50_ms": 1.1},
+        "slow": {"p50_ms": 2.0},
+        "new": {"p50_ms": 5.0},
+    }
+
+    assert compare(baseline, current, tolerance=0.2) == {"slow": 1.0}
@@ -0,0 +1,19 @@
+"""Tests for startup.py."""
+
+from pathlib import Path
+
+from benchmark.startup import run_startup
+
+
+def test_run_startup_smoke(tmp_path: Path) -> None:
+    """Test every startup benchmark runs, including a two-worker server."""
+    results = run_startup(tmp_path, [2], iterations=1)
+
+    assert set(results) == {
+        "startup.python",
+        "startup.import_api",
+        "startup.setup.new",
+        "startup.setup.existing",
+        "startup.server.workers_2",
+    }
+    assert all(result.iterations == 1 for result in results.values())
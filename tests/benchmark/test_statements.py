@@ -0,0 +1,26 @@
+"""Tests for statements.py."""
+
+from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool
+
+from benchmark.data import DataSpec
+from benchmark.statements import VARIANTS, run_statements
+from dao.models import Base
+
+
+def test_run_statements_smoke() -> None:
+    """Test every variant of every statement runs against a tiny data set."""
+    engine = create_engine(
+        "sqlite:///",
+        isolation_level="SERIALIZABLE",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(engine)
+
+    results = run_statements(
+        engine, DataSpec(patients=2, labs_per_patient=3), iterations=2
+    )
+
+    assert "statements.patient.check.cached" in results
+    assert {name.rsplit(".", 1)[1] for name in results} == set(VARIANTS)
@@ -0,0 +1,32 @@
+"""Tests for suite.py."""
+
+from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool
+
+from benchmark.data import DataSpec
+from benchmark.suite import run_suite
+from dao.models import Base
+
+
+def test_run_suite_smoke() -> None:
+    """Test every benchmark runs against a tiny data set."""
+    engine = create_engine(
+        "sqlite:///",
+        isolation_level="SERIALIZABLE",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(engine)
+
+    results = run_suite(
+        engine,
+        DataSpec(patients=2, labs_per_patient=3),
+        iterations=2,
+        warmup=1,
+    )
+
+    assert "api.list_labs" in results
+    assert "api.compute_lab_windows" in results
+    assert "dao.lab.delete" in results
+    assert "dao.patient.delete" in results
+    assert all(result.iterations == 2 for result in results.values())
@@ -0,0 +1,141 @@
+"""Tests for admission_dao.py."""
+
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+from sqlalchemy import Engine, create_engine, delete
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+import loader
+from dao import NotFoundError
+from dao.admission_dao import AdmissionDao, backfill_admissions
+from dao.lab_dao import LabDao
+from dao.models import Admission, Base, Entity, Lab
+from dao.patient_dao import PatientDao
+
+
+@pytest.fixture
+def db_engine() -> Engine:
+    """Generate database engine."""
+    database_path = "sqlite:///"
+    engine = create_engine(
+        database_path,
+        isolation_level="SERIALIZABLE",
+        # https://fastapi.tiangolo.com/tutorial/sql-databases/#note
+        # https://docs.sqlalchemy.org/en/20/dialects/sqlite.html#using-a-memory-database-in-multiple-threads
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    return engine
+
+
+def lab(patient_id: str, number: int, day: int) -> Lab:
+    """Make a glucose lab taken on a day of January 2020."""
+    return Lab(
+        patient_id=patient_id,
+        admission_number=number,
+        datetime=datetime(2020, 1, day),
+        name="GLUCOSE",
+        value=float(day),
+        units="mmol/L",
+    )
+
+
+def bounds(admissions: list[Admission]) -> list[tuple[int, int, int]]:
+    """Get admissions' numbers and first and last lab days."""
+    return [
+        (
+            admission.number,
+            admission.first_lab.day if admission.first_lab else 0,
+            admission.last_lab.day if admission.last_lab else 0,
+        )
+        for admission in admissions
+    ]
+
+
+def test_labs_maintain_admissions(db_engine: Engine) -> None:
+    """Test creating and deleting labs keeps admissions up to date."""
+    patient = PatientDao(db_engine).create(date_of_birth=datetime(2016, 1, 1))
+    lab_dao = LabDao(db_engine)
+    dao = AdmissionDao(db_engine)
+
+    created = lab_dao.create(
+        patient.id, 1, datetime(2020, 1, 5), "GLUCOSE", 5.0, "mmol/L"
+    )
+    assert bounds(list(dao.list(patient.id))) == [(1, 5, 5)]
+    lab_dao.create_many(
+        [lab(patient.id, 1, 3), lab(patient.id, 1, 8), lab(patient.id, 2, 9)]
+    )
+    assert bounds(list(dao.list(patient.id))) == [(1, 3, 8), (2, 9, 9)]
+    lab_dao.create_many([lab(patient.id, 1, 4)], upsert=True)
+    assert bounds(list(dao.list(patient.id))) == [(1, 3, 8), (2, 9, 9)]
+    assert [
+        lab.datetime.day for lab in lab_dao.batch(patient.id, 1).records()
+    ] == [3, 4, 5, 8]
+
+    lab_dao.delete(created.id)
+    (last,) = lab_dao.batch(patient.id, 2).ids
+    lab_dao.delete(last)
+    assert bounds(list(dao.list(patient.id))) == [(1, 3, 8), (2, 0, 0)]
+
+    PatientDao(db_engine).delete(patient.id)
+    assert dao.list(patient.id) == []
+
+
+def test_loader_maintains_admissions(
+    tmp_path: Path, db_engine: Engine
+) -> None:
+    """Test loading labs creates their admissions."""
+    patient = PatientDao(db_engine).create(date_of_birth=datetime(2016, 1, 1))
+    path = tmp_path / "labs.txt"
+    path.write_text(
+        "\t".join(loader.LAB_COLUMNS.values())
+        + "\n"
+        + "".join(
+            f"{patient.id}\t1\tGLUCOSE\t5.0\tmmol/L\t2020-01-0{day}\n"
+            for day in [4, 2, 6]
+        )
+    )
+
+    loader.load(db_engine, Entity.lab, path, chunk_size=2)
+
+    assert bounds(list(AdmissionDao(db_engine).list(patient.id))) == [
+        (1, 2, 6)
+    ]
+
+
+def test_backfill_admissions(db_engine: Engine) -> None:
+    """Test backfill_admissions."""
+    patient = PatientDao(db_engine).create(date_of_birth=datetime(2016, 1, 1))
+    LabDao(db_engine).create_many(
+        [lab(patient.id, 1, 3), lab(patient.id, 1, 8), lab(patient.id, 2, 9)]
+    )
+    with Session(db_engine) as session, session.begin():
+        session.execute(delete(Admission))
+        backfill_admissions(session)
+
+    assert bounds(list(AdmissionDao(db_engine).list(patient.id))) == [
+        (1, 3, 8),
+        (2, 9, 9),
+    ]
+
+
+def test_update(db_engine: Engine) -> None:
+    """Test update and read."""
+    patient = PatientDao(db_engine).create(date_of_birth=datetime(2016, 1, 1))
+    LabDao(db_engine).create_many([lab(patient.id, 1, 3)])
+    dao = AdmissionDao(db_engine)
+
+    updated = dao.update(patient.id, 1, datetime(2020, 1, 2), None)
+    assert updated.start == datetime(2020, 1, 2)
+    assert updated.first_lab == datetime(2020, 1, 3)
+    assert dao.update(patient.id, 7, None, datetime(2020, 2, 1)).end == (
+        datetime(2020, 2, 1)
+    )
+    assert dao.read(patient.id, 7).first_lab is None
+    with pytest.raises(NotFoundError, match=r"No admission 8"):
+        dao.read(patient.id, 8)
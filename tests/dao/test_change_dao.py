@@ -0,0 +1,81 @@
+"""Tests for change_dao.py."""
+
+from datetime import datetime
+
+import pytest
+from sqlalchemy import Engine, create_engine
+from sqlalchemy.pool import StaticPool
+
+from dao.change_dao import ChangeDao
+from dao.lab_dao import LabDao
+from dao.models import Base, Entity, Operation
+from dao.patient_dao import PatientDao
+
+
+@pytest.fixture
+def db_engine() -> Engine:
+    """Generate database engine."""
+    database_path = "sqlite:///"
+    engine = create_engine(
+        database_path,
+        isolation_level="SERIALIZABLE",
+        # https://fastapi.tiangolo.com/tutorial/sql-databases/#note
+        # https://docs.sqlalchemy.org/en/20/dialects/sqlite.html#using-a-memory-database-in-multiple-threads
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    return engine
+
+
+def test_list_empty_table_empty(db_engine: Engine) -> None:
+    """Test list() with an empty table."""
+    dao = ChangeDao(db_engine)
+
+    assert dao.list() == []
+
+
+def test_list_records_creates_and_deletes(db_engine: Engine) -> None:
+    """Test list() after creating and deleting entities."""
+    patient_dao = PatientDao(db_engine)
+    lab_dao = LabDao(db_engine)
+    patient = patient_dao.create(date_of_birth=datetime(2016, 10, 17))
+    lab = lab_dao.create(
+        patient_id=patient.id,
+        admission_number=0,
+        datetime=datetime(2016, 10, 17),
+        name="lab_name",
+        value=0.0,
+        units="meters",
+    )
+    lab_dao.delete(lab.id)
+
+    changes = ChangeDao(db_engine).list()
+
+    assert [
+        (change.entity, change.entity_id, change.operation)
+        for change in changes
+    ] == [
+        (Entity.patient, patient.id, Operation.create),
+        (Entity.lab, lab.id, Operation.create),
+        (Entity.lab, lab.id, Operation.delete),
+    ]
+    assert [change.seq for change in changes] == sorted(
+        change.seq for change in changes
+    )
+
+
+def test_list_since_paginates(db_engine: Engine) -> None:
+    """Test list() with since and limit."""
+    patient_dao = PatientDao(db_engine)
+    for _ in range(3):
+        patient_dao.create(date_of_birth=datetime(2016, 10, 17))
+    dao = ChangeDao(db_engine)
+
+    first = dao.list(limit=2)
+    second = dao.list(since=first[-1].seq, limit=2)
+
+    assert len(first) == 2
+    assert len(second) == 1
+    assert second[0].seq > first[-1].seq
@@ -0,0 +1,144 @@
+"""Tests for idempotency_dao.py."""
+
+from datetime import datetime
+
+import pytest
+from sqlalchemy import Engine, create_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+from dao import ConflictError
+from dao.idempotency_dao import IdempotencyDao, KeyCache
+from dao.models import (
+    Base,
+    Gender,
+    IdempotencyRecord,
+    Language,
+    MaritalStatus,
+    Race,
+)
+from dao.patient_dao import PatientDao
+
+
+@pytest.fixture
+def db_engine() -> Engine:
+    """Generate database engine."""
+    database_path = "sqlite:///"
+    engine = create_engine(
+        database_path,
+        isolation_level="SERIALIZABLE",
+        # https://fastapi.tiangolo.com/tutorial/sql-databases/#note
+        # https://docs.sqlalchemy.org/en/20/dialects/sqlite.html#using-a-memory-database-in-multiple-threads
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    return engine
+
+
+class FakeClock:
+    """Manually advanced clock."""
+
+    def __init__(self) -> None:
+        """Initialize."""
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        """Get the time."""
+        return self.now
+
+
+def make_record(key: str) -> IdempotencyRecord:
+    """Make a record."""
+    return IdempotencyRecord(
+        scope="scope", key=key, fingerprint="", response=""
+    )
+
+
+def test_cache_expires_after_ttl() -> None:
+    """Test KeyCache evicts entries older than the TTL."""
+    clock = FakeClock()
+    cache = KeyCache(ttl=10, clock=clock)
+    cache.put(make_record("a"))
+
+    clock.now = 9
+    assert cache.get("scope", "a") is not None
+    clock.now = 10
+    assert cache.get("scope", "a") is None
+
+
+def test_cache_evicts_least_recently_used() -> None:
+    """Test KeyCache stays within its size bound."""
+    cache = KeyCache(max_size=2)
+    cache.put(make_record("a"))
+    cache.put(make_record("b"))
+    cache.get("scope", "a")
+    cache.put(make_record("c"))
+
+    assert cache.get("scope", "a") is not None
+    assert cache.get("scope", "b") is None
+    assert cache.get("scope", "c") is not None
+
+
+def test_read_missing_none(db_engine: Engine) -> None:
+    """Test read() for an unknown key."""
+    dao = IdempotencyDao(db_engine, KeyCache())
+
+    assert dao.read("scope", "key") is None
+
+
+def test_read_falls_back_to_database(db_engine: Engine) -> None:
+    """Test read() finds records created with a different cache."""
+    IdempotencyDao(db_engine, KeyCache()).create(
+        "scope", "key", "fingerprint", '{"id": "1"}'
+    )
+    cache = KeyCache()
+
+    record = IdempotencyDao(db_engine, cache).read("scope", "key")
+
+    assert record is not None
+    assert record.response == '{"id": "1"}'
+    assert cache.get("scope", "key") is record
+
+
+def test_create_recorded_key_rolls_back(db_engine: Engine) -> None:
+    """Test create() of a key already recorded rolls back its transaction."""
+    IdempotencyDao(db_engine, KeyCache()).create("scope", "key", "", "1")
+    cache = KeyCache()
+    dao = IdempotencyDao(db_engine, cache)
+
+    with Session(db_engine) as session:
+        PatientDao(db_engine)._create(
+            datetime(2000, 1, 1),
+            Gender.unknown,
+            Language.unknown,
+            MaritalStatus.unknown,
+            Race.unknown,
+            session,
+        )
+        with pytest.raises(ConflictError):
+            dao._create("scope", "key", "", "2", session)
+
+    assert PatientDao(db_engine).list() == []
+    assert cache.get("scope", "key") is None
+
+
+def test_create_replaces_expired(db_engine: Engine) -> None:
+    """Test create() of a key whose record expired."""
+    IdempotencyDao(db_engine, KeyCache()).create("scope", "key", "", "1")
+    cache = KeyCache(ttl=0)
+
+    IdempotencyDao(db_engine, cache).create("scope", "key", "", "2")
+
+    record = IdempotencyDao(db_engine, KeyCache()).read("scope", "key")
+    assert record is not None
+    assert record.response == "2"
+
+
+def test_purge_deletes_expired(db_engine: Engine) -> None:
+    """Test purge() deletes records older than the TTL."""
+    IdempotencyDao(db_engine, KeyCache()).create("scope", "key", "", "")
+
+    assert IdempotencyDao(db_engine, KeyCache(ttl=3600)).purge() == 0
+    assert IdempotencyDao(db_engine, KeyCache(ttl=0)).purge() == 1
@@ -0,0 +1,66 @@
+"""Tests for lab_catalogue.py."""
+
+import pytest
+from sqlalchemy import Engine, create_engine, func, select
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+from dao.lab_catalogue import LabCatalogueCache, catalogue_code
+from dao.models import Base, LabCatalogue
+
+
+@pytest.fixture
+def db_engine() -> Engine:
+    """Generate database engine."""
+    database_path = "sqlite:///"
+    engine = create_engine(
+        database_path,
+        isolation_level="SERIALIZABLE",
+        # https://fastapi.tiangolo.com/tutorial/sql-databases/#note
+        # https://docs.sqlalchemy.org/en/20/dialects/sqlite.html#using-a-memory-database-in-multiple-threads
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    return engine
+
+
+def test_catalogue_code_normalizes() -> None:
+    """Test catalogue_code()."""
+    assert catalogue_code("CBC: HEMOGLOBIN") == "CBC_HEMOGLOBIN"
+    assert catalogue_code(" cbc  hemoglobin ") == "CBC_HEMOGLOBIN"
+
+
+def test_resolve_creates_once(db_engine: Engine) -> None:
+    """Test resolve() creates an entry, then finds it in the cache."""
+    cache = LabCatalogueCache()
+    with Session(db_engine) as session:
+        created_id = cache.resolve("CBC: HEMOGLOBIN", "g/dL", session).id
+        assert cache.get("CBC: HEMOGLOBIN", "g/dL") is None
+        session.commit()
+
+    cached = cache.get("CBC: HEMOGLOBIN", "g/dL")
+    assert cached is not None
+    assert (cached.id, cached.code) == (created_id, "CBC_HEMOGLOBIN")
+    with Session(db_engine) as session:
+        resolved = cache.resolve("CBC: HEMOGLOBIN", "g/dL", session)
+        assert resolved.id == created_id
+        assert resolved in session
+        other = cache.resolve("CBC: HEMOGLOBIN", "mmol/L", session)
+        assert other.id != created_id
+        assert other.code == "CBC_HEMOGLOBIN"
+        session.commit()
+        assert session.scalar(select(func.count(LabCatalogue.id))) == 2
+
+
+def test_resolve_forgets_rolled_back_entries(db_engine: Engine) -> None:
+    """Test entries created in a rolled back transaction are not cached."""
+    cache = LabCatalogueCache()
+    with Session(db_engine) as session:
+        cache.resolve("CBC: HEMOGLOBIN", "g/dL", session)
+        # Found again in the same transaction, still not cached.
+        cache.resolve("CBC: HEMOGLOBIN", "g/dL", session)
+        session.rollback()
+
+    assert cache.get("CBC: HEMOGLOBIN", "g/dL") is None
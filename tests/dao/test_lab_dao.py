@@ -1,14 +1,18 @@
 """Tests for lab_dao.py."""
 
 from datetime import datetime
+from typing import Any
 
 import pytest
-from sqlalchemy import Engine, create_engine
+from sqlalchemy import Engine, create_engine, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
 from sqlalchemy.pool import StaticPool
 
-from dao import NotFoundError
+from dao import ConflictError, NotFoundError
+from dao.change_dao import ChangeDao
 from dao.lab_dao import LabDao
-from dao.models import Base
+from dao.models import Base, Lab, LabCatalogue, Operation
 
 
 @pytest.fixture
@@ -84,3 +88,339 @@ def test_list_succeeds(db_engine: Engine) -> None:
     retrieved = lab_dao.list()
 
     assert len(retrieved) == 2
+
+
+def test_create_duplicate_natural_key_raises(db_engine: Engine) -> None:
+    """Test create() with the natural key of an existing lab."""
+    lab_dao = LabDao(db_engine)
+    lab: dict[str, Any] = {
+        "patient_id": "Alice",
+        "admission_number": 0,
+        "datetime": datetime(2016, 10, 17),
+        "name": "lab_name",
+        "units": "meters",
+    }
+    lab_dao.create(**lab, value=0.0)
+
+    with pytest.raises(ConflictError):
+        lab_dao.create(**lab, value=1.0)
+
+
+def test_create_upsert_updates_existing(db_engine: Engine) -> None:
+    """Test create() in upsert mode."""
+    lab_dao = LabDao(db_engine)
+    lab: dict[str, Any] = {
+        "patient_id": "Alice",
+        "admission_number": 0,
+        "datetime": datetime(2016, 10, 17),
+        "name": "lab_name",
+        "units": "meters",
+    }
+    created = lab_dao.create(**lab, value=0.0)
+
+    updated = lab_dao.create(**lab, value=1.0, upsert=True)
+
+    assert updated.id == created.id
+    assert [(lab.id, lab.value) for lab in lab_dao.list()] == [
+        (created.id, 1.0)
+    ]
+    operations = [change.operation for change in ChangeDao(db_engine).list()]
+    assert operations == [Operation.create, Operation.update]
+
+
+def test_create_many_upsert_resolves_replays(db_engine: Engine) -> None:
+    """Test create_many() in upsert mode with new and re-sent labs."""
+    lab_dao = LabDao(db_engine)
+    existing = lab_dao.create(
+        patient_id="Alice",
+        admission_number=0,
+        datetime=datetime(2016, 10, 17),
+        name="lab_name",
+        value=0.0,
+        units="meters",
+    )
+
+    labs = lab_dao.create_many(
+        [
+            Lab(
+                patient_id="Alice",
+                admission_number=0,
+                datetime=datetime(2016, 10, 17),
+                name="lab_name",
+                value=value,
+                units="meters",
+            )
+            for value in [1.0, 2.0]
+        ]
+        + [
+            Lab(
+                patient_id="Alice",
+                admission_number=1,
+                datetime=datetime(2016, 10, 17),
+                name="lab_name",
+                value=3.0,
+                units="meters",
+            )
+        ],
+        upsert=True,
+    )
+
+    assert len(labs) == 2
+    assert sorted(
+        (lab.admission_number, lab.value) for lab in lab_dao.list()
+    ) == [
+        (0, 2.0),
+        (1, 3.0),
+    ]
+    assert existing.id in {lab.id for lab in labs}
+
+
+def test_create_many_duplicate_raises(db_engine: Engine) -> None:
+    """Test create_many() without upsert rejects repeated natural keys."""
+    lab_dao = LabDao(db_engine)
+    lab: dict[str, Any] = {
+        "patient_id": "Alice",
+        "admission_number": 0,
+        "datetime": datetime(2016, 10, 17),
+        "name": "lab_name",
+        "value": 0.0,
+        "units": "meters",
+    }
+    lab_dao.create(**lab)
+
+    with pytest.raises(ConflictError):
+        lab_dao.create_many([Lab(**lab)])
+    assert len(lab_dao.list()) == 1
+    other = {**lab, "datetime": datetime(2016, 10, 18)}
+    with pytest.raises(ConflictError):
+        lab_dao.create_many([Lab(**other), Lab(**other)])
+    assert len(lab_dao.list()) == 1
+
+
+def test_aggregate_groups_by_units(db_engine: Engine) -> None:
+    """Test aggregate()."""
+    lab_dao = LabDao(db_engine)
+    lab: dict[str, Any] = {
+        "patient_id": "Alice",
+        "admission_number": 0,
+        "name": "GLUCOSE",
+    }
+    lab_dao.create_many(
+        [
+            Lab(**lab, datetime=datetime(2020, 1, 1), value=5.0, units="a"),
+            Lab(**lab, datetime=datetime(2020, 1, 2), value=7.0, units="a"),
+            Lab(**lab, datetime=datetime(2020, 1, 3), value=9.0, units="b"),
+        ]
+    )
+
+    aggregates = lab_dao.aggregate("GLUCOSE", end=datetime(2020, 1, 3))
+
+    assert [tuple(aggregate) for aggregate in aggregates] == [
+        ("GLUCOSE", "a", 2, 6.0, 5.0, 7.0)
+    ]
+
+
+def test_create_shares_catalogue_entries(db_engine: Engine) -> None:
+    """Test labs with the same name and units share a catalogue entry."""
+    lab_dao = LabDao(db_engine)
+    labs = [
+        lab_dao.create(
+            patient_id="Alice",
+            admission_number=admission_number,
+            datetime=datetime(2016, 10, 17),
+            name="lab_name",
+            value=0.0,
+            units="meters",
+        )
+        for admission_number in range(2)
+    ]
+    labs += lab_dao.create_many(
+        [
+            Lab(
+                patient_id="Alice",
+                admission_number=2,
+                datetime=datetime(2016, 10, 17),
+                name="lab_name",
+                value=0.0,
+                units=units,
+            )
+            for units in ["meters", "feet"]
+        ]
+    )
+
+    assert [(lab.name, lab.units) for lab in labs] == [
+        ("lab_name", "meters"),
+        ("lab_name", "meters"),
+        ("lab_name", "meters"),
+        ("lab_name", "feet"),
+    ]
+    assert len({lab.catalogue_id for lab in labs}) == 2
+    assert {(lab.name, lab.units) for lab in lab_dao.list()} == {
+        ("lab_name", "meters"),
+        ("lab_name", "feet"),
+    }
+
+
+def test_aggregate_normalize_combines_units(db_engine: Engine) -> None:
+    """Test aggregate() and cohort() with normalized values."""
+    lab_dao = LabDao(db_engine)
+    lab: dict[str, Any] = {
+        "admission_number": 0,
+        "datetime": datetime(2020, 1, 1),
+        "name": "METABOLIC: GLUCOSE",
+    }
+    created = lab_dao.create(
+        **lab, patient_id="Alice", value=180.16, units="mg/dL"
+    )
+    lab_dao.create_many(
+        [Lab(**lab, patient_id="Bob", value=6.0, units="mmol/L")]
+    )
+
+    assert created.normalized_units == "mmol/L"
+    assert created.normalized_value == pytest.approx(10.0)
+    aggregates = lab_dao.aggregate("METABOLIC: GLUCOSE", normalize=True)
+    assert [
+        (aggregate.units, aggregate.labs, round(aggregate.maximum, 6))
+        for aggregate in aggregates
+    ] == [("mmol/L", 2, 10.0)]
+    assert lab_dao.cohort("METABOLIC: GLUCOSE", minimum=5) == ["Alice", "Bob"]
+    assert lab_dao.cohort("METABOLIC: GLUCOSE", minimum=8, normalize=True) == [
+        "Alice"
+    ]
+
+
+def test_batch(db_engine: Engine) -> None:
+    """Test batch() reads labs oldest first, sharing names and patients."""
+    lab_dao = LabDao(db_engine)
+    lab: dict[str, Any] = {"patient_id": "Alice", "name": "CBC: HEMOGLOBIN"}
+    lab_dao.create_many(
+        [
+            Lab(
+                **lab,
+                admission_number=2,
+                datetime=datetime(2020, 1, 3),
+                value=130.0,
+                units="g/L",
+            ),
+            Lab(
+                **lab,
+                admission_number=1,
+                datetime=datetime(2020, 1, 1),
+                value=12.0,
+                units="g/dL",
+            ),
+            Lab(
+                **lab,
+                admission_number=1,
+                datetime=datetime(2020, 1, 2),
+                value=120.0,
+                units="g/L",
+            ),
+        ]
+    )
+    lab_dao.create(
+        patient_id="Bob",
+        admission_number=1,
+        datetime=datetime(2020, 1, 1),
+        name="CBC: HEMOGLOBIN",
+        value=1.0,
+        units="g/L",
+    )
+
+    batch = lab_dao.batch("Alice")
+
+    assert len(batch) == 3
+    assert batch.patients == ["Alice"]
+    assert len(batch.entries) == 2
+    assert [
+        (lab.admission_number, lab.datetime, lab.value, lab.units)
+        for lab in batch.records()
+    ] == [
+        (1, datetime(2020, 1, 1), 12.0, "g/dL"),
+        (1, datetime(2020, 1, 2), 120.0, "g/L"),
+        (2, datetime(2020, 1, 3), 130.0, "g/L"),
+    ]
+    assert [
+        (lab.value, lab.units) for lab in batch.records(normalize=True)
+    ] == [(12.0, "g/dL"), (12.0, "g/dL"), (13.0, "g/dL")]
+    assert [lab.datetime for lab in lab_dao.batch("Alice", 2).records()] == [
+        datetime(2020, 1, 3)
+    ]
+
+
+def test_page(db_engine: Engine) -> None:
+    """Test page() reads labs in id order from after an id."""
+    lab_dao = LabDao(db_engine)
+    lab_dao.create_many(
+        [
+            Lab(
+                patient_id="Alice",
+                admission_number=1,
+                datetime=datetime(2020, 1, day),
+                name="lab_name",
+                value=float(day),
+                units="meters",
+            )
+            for day in range(1, 6)
+        ]
+    )
+    ids = sorted(lab.id for lab in lab_dao.list())
+
+    first = lab_dao.page(None, 3)
+    second = lab_dao.page(first.ids[-1], 3)
+
+    assert first.ids == ids[:3]
+    assert second.ids == ids[3:]
+    assert not lab_dao.page(ids[-1], 3)
+
+
+def test_new_lab_name_needs_catalogue_entry(db_engine: Engine) -> None:
+    """Test a lab given a name and units is only stored through LabDao."""
+    lab = Lab(
+        id="1",
+        patient_id="Alice",
+        admission_number=0,
+        datetime=datetime(2020, 1, 1),
+        name="GLUCOSE",
+        value=5.0,
+        normalized_value=5.0,
+        units="mmol/L",
+    )
+    assert (lab.name, lab.units) == ("GLUCOSE", "mmol/L")
+
+    with Session(db_engine) as session:
+        session.add(lab)
+        with pytest.raises(IntegrityError):
+            session.commit()
+        session.rollback()
+        assert not session.scalars(select(LabCatalogue)).all()
+
+    stored = LabDao(db_engine).create_many([lab])[0]
+    with pytest.raises(AttributeError):
+        stored.name = "OTHER"
+
+
+def test_query_lab_name(db_engine: Engine) -> None:
+    """Test a lab's name and units can be queried through its entry."""
+    LabDao(db_engine).create_many(
+        Lab(
+            patient_id="Alice",
+            admission_number=0,
+            datetime=datetime(2020, 1, 1),
+            name=name,
+            value=5.0,
+            units="mmol/L",
+        )
+        for name in ["GLUCOSE", "SODIUM"]
+    )
+
+    with Session(db_engine) as session:
+        labs = session.scalars(select(Lab).where(Lab.name == "GLUCOSE"))
+        assert [lab.name for lab in labs] == ["GLUCOSE"]
+        rows = session.execute(
+            select(Lab.name, Lab.units).select_from(Lab).order_by(Lab.name)
+        )
+        assert [tuple(row) for row in rows] == [
+            ("GLUCOSE", "mmol/L"),
+            ("SODIUM", "mmol/L"),
+        ]
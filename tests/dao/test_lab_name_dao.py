@@ -0,0 +1,138 @@
+"""Tests for lab_name_dao.py."""
+
+from datetime import datetime
+
+import pytest
+from sqlalchemy import Engine, create_engine, select
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+from dao.lab_dao import LabDao
+from dao.lab_name_dao import LabName, LabNameDao, LabUnits, search_terms
+from dao.models import Base, Lab, LabCount
+from dao.patient_dao import PatientDao
+
+
+@pytest.fixture
+def db_engine() -> Engine:
+    """Generate database engine."""
+    database_path = "sqlite:///"
+    engine = create_engine(
+        database_path,
+        isolation_level="SERIALIZABLE",
+        # https://fastapi.tiangolo.com/tutorial/sql-databases/#note
+        # https://docs.sqlalchemy.org/en/20/dialects/sqlite.html#using-a-memory-database-in-multiple-threads
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    return engine
+
+
+def create_labs(
+    engine: Engine, patient_id: str, labs: list[tuple[str, str]]
+) -> None:
+    """Create labs of (name, units) for a patient, a day apart."""
+    LabDao(engine).create_many(
+        Lab(
+            patient_id=patient_id,
+            admission_number=0,
+            datetime=datetime(2020, 1, day + 1),
+            name=name,
+            value=1.0,
+            units=units,
+        )
+        for day, (name, units) in enumerate(labs)
+    )
+
+
+def test_search_terms() -> None:
+    """Test search_terms() keeps words, in lower case."""
+    assert search_terms(" CBC: hem-o_x ") == ["cbc", "hem", "o", "x"]
+    assert search_terms('"*:()') == []
+
+
+def test_search_ranks_by_labs(db_engine: Engine) -> None:
+    """Test search() matches word prefixes, with the most labs first."""
+    patient = PatientDao(db_engine).create(date_of_birth=datetime(2000, 1, 1))
+    create_labs(
+        db_engine,
+        patient.id,
+        [
+            ("CBC: HEMOGLOBIN", "g/dL"),
+            ("CBC: HEMOGLOBIN", "g/dL"),
+            ("CBC: HEMOGLOBIN", "mmol/L"),
+            ("CBC: HEMATOCRIT", "%"),
+            ("CBC: HEMATOCRIT", "%"),
+            ("CBC: HEMATOCRIT", "%"),
+            ("CBC: HEMATOCRIT", "%"),
+            ("METABOLIC: GLUCOSE", "mg/dL"),
+        ],
+    )
+    lab_name_dao = LabNameDao(db_engine)
+    lab_name_dao.refresh_counts()
+
+    assert lab_name_dao.search("hem") == [
+        LabName("CBC: HEMATOCRIT", 4, [LabUnits("%", 4)]),
+        LabName(
+            "CBC: HEMOGLOBIN",
+            3,
+            [LabUnits("g/dL", 2), LabUnits("mmol/L", 1)],
+        ),
+    ]
+    assert [name.name for name in lab_name_dao.search("hemog cb")] == [
+        "CBC: HEMOGLOBIN"
+    ]
+    assert [name.name for name in lab_name_dao.search("c", limit=1)] == [
+        "CBC: HEMATOCRIT"
+    ]
+    assert lab_name_dao.search("lucose") == []
+    assert lab_name_dao.search("*") == []
+
+
+def test_refresh_counts(db_engine: Engine) -> None:
+    """Test refresh_counts follows upserts and deletes, and only then."""
+    patient_dao = PatientDao(db_engine)
+    lab_dao = LabDao(db_engine)
+    lab_name_dao = LabNameDao(db_engine)
+    alice = patient_dao.create(date_of_birth=datetime(2000, 1, 1))
+    bob = patient_dao.create(date_of_birth=datetime(2000, 1, 1))
+    create_labs(db_engine, alice.id, [("GLUCOSE", "mg/dL")] * 3)
+    create_labs(db_engine, bob.id, [("GLUCOSE", "mg/dL")] * 2)
+
+    lab_name_dao.refresh_counts()
+    assert lab_name_dao.search("glu")[0].labs == 5
+
+    # Re-sent labs update the existing ones.
+    lab = lab_dao.create(
+        patient_id=alice.id,
+        admission_number=0,
+        datetime=datetime(2020, 1, 1),
+        name="GLUCOSE",
+        value=2.0,
+        units="mg/dL",
+        upsert=True,
+    )
+    lab_name_dao.refresh_counts()
+    assert lab_name_dao.search("glu")[0].labs == 5
+    lab_dao.delete(lab.id)
+    patient_dao.delete(bob.id)
+    assert lab_name_dao.search("glu")[0].labs == 5
+    lab_name_dao.refresh_counts()
+    assert lab_name_dao.search("glu")[0].labs == 2
+
+
+def test_counts_backfilled(db_engine: Engine) -> None:
+    """Test counts and the index are filled when the counts are created."""
+    patient = PatientDao(db_engine).create(date_of_birth=datetime(2000, 1, 1))
+    create_labs(db_engine, patient.id, [("GLUCOSE", "mg/dL")] * 2)
+    Base.metadata.tables["lab_counts"].drop(db_engine)
+
+    Base.metadata.create_all(db_engine)
+
+    with Session(db_engine) as session:
+        assert session.scalars(select(LabCount.labs)).all() == [2]
+    assert LabNameDao(db_engine).search("gl") == [
+        LabName("GLUCOSE", 2, [LabUnits("mg/dL", 2)])
+    ]
@@ -0,0 +1,210 @@
+"""Tests for lab_store.py."""
+
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+from sqlalchemy import Engine, create_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+from dao.lab_dao import LabAggregate, LabDao, LabPoint
+from dao.lab_store import LabStore
+from dao.models import Base, Lab
+from dao.patient_dao import PatientDao
+
+
+@pytest.fixture
+def db_engine() -> Engine:
+    """Generate database engine."""
+    database_path = "sqlite:///"
+    engine = create_engine(
+        database_path,
+        isolation_level="SERIALIZABLE",
+        # https://fastapi.tiangolo.com/tutorial/sql-databases/#note
+        # https://docs.sqlalchemy.org/en/20/dialects/sqlite.html#using-a-memory-database-in-multiple-threads
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    return engine
+
+
+def create_labs(engine: Engine, patient_id: str, values: list[float]) -> None:
+    """Create glucose labs for a patient, a day apart."""
+    LabDao(engine).create_many(
+        Lab(
+            patient_id=patient_id,
+            admission_number=1,
+            datetime=datetime(2020, 1, 1 + day),
+            name="GLUCOSE",
+            value=value,
+            units="mmol/L" if value < 30 else "mg/dL",
+        )
+        for day, value in enumerate(values)
+    )
+
+
+def refresh(store: LabStore, engine: Engine) -> LabStore:
+    """Refresh a store."""
+    with Session(engine) as session:
+        store.refresh(session)
+    return store
+
+
+def test_queries_match_database(db_engine: Engine, tmp_path: Path) -> None:
+    """Test queries against the SQL implementations."""
+    create_labs(db_engine, "A", [5.0, 110.0, 7.0])
+    create_labs(db_engine, "B", [90.0, 4.0])
+    lab_dao = LabDao(db_engine)
+
+    store = refresh(LabStore(tmp_path), db_engine)
+
+    assert store.aggregate("GLUCOSE") == [
+        LabAggregate("GLUCOSE", "mg/dL", 2, 100.0, 90.0, 110.0),
+        LabAggregate("GLUCOSE", "mmol/L", 3, 16 / 3, 4.0, 7.0),
+    ]
+    assert store.aggregate("GLUCOSE") == lab_dao.aggregate("GLUCOSE")
+    start, end = datetime(2020, 1, 2), datetime(2020, 1, 3)
+    assert store.aggregate("GLUCOSE", start, end) == lab_dao.aggregate(
+        "GLUCOSE", start, end
+    )
+    assert store.aggregate("UNKNOWN") == []
+    assert store.series("A", "GLUCOSE") == [
+        LabPoint(datetime(2020, 1, 1), 5.0, "mmol/L"),
+        LabPoint(datetime(2020, 1, 2), 110.0, "mg/dL"),
+        LabPoint(datetime(2020, 1, 3), 7.0, "mmol/L"),
+    ]
+    assert store.series("A", "GLUCOSE") == lab_dao.series("A", "GLUCOSE")
+    assert store.cohort("GLUCOSE", minimum=100) == ["A"]
+    assert store.cohort("GLUCOSE", maximum=5) == lab_dao.cohort(
+        "GLUCOSE", maximum=5
+    )
+    assert store.cohort("GLUCOSE", 4, 4, end=datetime(2020, 1, 2)) == []
+
+
+def test_queries_normalize(db_engine: Engine, tmp_path: Path) -> None:
+    """Test queries of normalized values against the SQL implementations."""
+    LabDao(db_engine).create_many(
+        Lab(
+            patient_id=patient_id,
+            admission_number=1,
+            datetime=datetime(2020, 1, 1),
+            name="METABOLIC: GLUCOSE",
+            value=value,
+            units=units,
+        )
+        for patient_id, value, units in [
+            ("A", 90.08, "mg/dL"),
+            ("B", 7.0, "mmol/L"),
+        ]
+    )
+    lab_dao = LabDao(db_engine)
+
+    store = refresh(LabStore(tmp_path), db_engine)
+
+    name = "METABOLIC: GLUCOSE"
+    aggregates = store.aggregate(name, normalize=True)
+    assert aggregates == lab_dao.aggregate(name, normalize=True)
+    assert [(aggregate.units, aggregate.labs) for aggregate in aggregates] == [
+        ("mmol/L", 2)
+    ]
+    assert store.series("A", name, normalize=True) == lab_dao.series(
+        "A", name, normalize=True
+    )
+    assert store.cohort(name, maximum=6, normalize=True) == ["A"]
+
+
+def test_refresh_appends_created_labs(
+    db_engine: Engine, tmp_path: Path
+) -> None:
+    """Test refresh() appends labs created since the last refresh."""
+    create_labs(db_engine, "A", [5.0])
+    store = refresh(LabStore(tmp_path), db_engine)
+    generation = store.meta and store.meta["generation"]
+
+    create_labs(db_engine, "B", [6.0, 7.0])
+    refresh(store, db_engine)
+
+    assert store.meta is not None
+    assert store.meta["generation"] == generation
+    assert store.meta["rows"] == 3
+    assert store.cohort("GLUCOSE", minimum=6) == ["B"]
+
+
+def test_refresh_applies_deletes(db_engine: Engine, tmp_path: Path) -> None:
+    """Test refresh() marks deleted labs without rebuilding the snapshot."""
+    patient = PatientDao(db_engine).create(date_of_birth=datetime(2000, 1, 1))
+    create_labs(db_engine, patient.id, [5.0])
+    create_labs(db_engine, "B", [6.0])
+    store = refresh(LabStore(tmp_path), db_engine)
+
+    PatientDao(db_engine).delete(patient.id)
+    refresh(store, db_engine)
+
+    assert store.meta is not None
+    assert store.meta["generation"] == 1
+    assert store.meta["rows"] == 2
+    assert store.cohort("GLUCOSE") == ["B"]
+    assert store.aggregate("GLUCOSE") == LabDao(db_engine).aggregate("GLUCOSE")
+
+
+def test_refresh_applies_updates(db_engine: Engine, tmp_path: Path) -> None:
+    """Test refresh() overwrites the values of upserted labs in place."""
+    create_labs(db_engine, "A", [5.0, 6.0])
+    store = refresh(LabStore(tmp_path), db_engine)
+
+    LabDao(db_engine).create_many(
+        [
+            Lab(
+                patient_id="A",
+                admission_number=1,
+                datetime=datetime(2020, 1, 1),
+                name="GLUCOSE",
+                value=8.0,
+                units="mmol/L",
+            )
+        ],
+        upsert=True,
+    )
+    refresh(store, db_engine)
+
+    assert store.meta is not None
+    assert store.meta["generation"] == 1
+    assert store.meta["rows"] == 2
+    assert store.series("A", "GLUCOSE") == LabDao(db_engine).series(
+        "A", "GLUCOSE"
+    )
+    assert [point.value for point in store.series("A", "GLUCOSE")] == [
+        8.0,
+        6.0,
+    ]
+
+    # Another store finds the rows of labs from the files.
+    other = refresh(LabStore(tmp_path), db_engine)
+    lab_id = LabDao(db_engine).list()[0].id
+    LabDao(db_engine).delete(lab_id)
+    refresh(other, db_engine)
+    assert other.series("A", "GLUCOSE") == LabDao(db_engine).series(
+        "A", "GLUCOSE"
+    )
+    assert len(other.series("A", "GLUCOSE")) == 1
+
+
+def test_refresh_opens_existing_snapshot(
+    db_engine: Engine, tmp_path: Path
+) -> None:
+    """Test a store picks up a snapshot written by another one."""
+    create_labs(db_engine, "A", [5.0])
+    first = refresh(LabStore(tmp_path), db_engine)
+    create_labs(db_engine, "B", [6.0])
+    refresh(first, db_engine)
+    # Bytes from an interrupted append are ignored.
+    with (tmp_path / "1" / "value.bin").open("ab") as file:
+        file.write(b"garbage")
+
+    second = refresh(LabStore(tmp_path), db_engine)
+
+    assert second.meta == first.meta
+    assert second.cohort("GLUCOSE") == ["A", "B"]
@@ -0,0 +1,87 @@
+"""Tests for lab_windows.py."""
+
+import numpy as np
+import pytest
+
+from dao.lab_windows import HOUR, range_reduce, rolling
+
+
+def brute_force(
+    times: list[int], values: list[float], groups: list[int], window: int
+) -> list[list[float]]:
+    """Compute the window of each lab by looking at every other lab."""
+    rows = []
+    for i, (time, value, group) in enumerate(
+        zip(times, values, groups, strict=True)
+    ):
+        inside = [
+            values[j]
+            for j in range(i + 1)
+            if groups[j] == group and time - window < times[j]
+        ]
+        rows.append(
+            [
+                sum(inside) / len(inside),
+                min(inside),
+                max(inside),
+                value - inside[0],
+                value - min(inside),
+            ]
+        )
+    return rows
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_rolling_matches_brute_force(seed: int) -> None:
+    """Test rolling against a direct computation."""
+    rng = np.random.default_rng(seed)
+    groups = np.sort(rng.integers(0, 4, 200))
+    times = np.concatenate(
+        [
+            np.sort(rng.integers(0, 100 * HOUR, np.count_nonzero(groups == g)))
+            for g in range(4)
+        ]
+    )
+    values = rng.normal(1.0, 0.3, 200)
+    window = 24 * HOUR
+
+    stats = rolling(times, values, groups, window)
+
+    expected = np.array(
+        brute_force(times.tolist(), values.tolist(), groups.tolist(), window)
+    )
+    actual = np.column_stack(
+        [stats.mean, stats.minimum, stats.maximum, stats.delta, stats.rise]
+    )
+    np.testing.assert_allclose(actual, expected)
+
+
+def test_rolling_slope() -> None:
+    """Test slopes are per hour, and restart with each group."""
+    times = np.array([0, 2 * HOUR, 3 * HOUR, 0, 0], np.int64)
+    values = np.array([1.0, 2.0, 1.5, 7.0, 8.0])
+    groups = np.array([0, 0, 0, 1, 1])
+
+    slope = rolling(times, values, groups, 48 * HOUR).slope
+
+    np.testing.assert_allclose(slope, [np.nan, 0.5, -0.5, np.nan, np.nan])
+
+
+def test_rolling_empty() -> None:
+    """Test rolling with no labs."""
+    empty = np.empty(0, np.int64)
+    assert len(rolling(empty, np.empty(0), empty, HOUR).mean) == 0
+
+
+def test_range_reduce() -> None:
+    """Test range_reduce over ranges of every length."""
+    values = np.array([5.0, 3.0, 8.0, 1.0, 9.0, 2.0, 7.0])
+    starts = np.array([0, 0, 1, 0, 2, 5, 0])
+    np.testing.assert_array_equal(
+        range_reduce(values, starts, np.minimum),
+        [min(values[s : i + 1]) for i, s in enumerate(starts)],
+    )
+    np.testing.assert_array_equal(
+        range_reduce(values, starts, np.maximum),
+        [max(values[s : i + 1]) for i, s in enumerate(starts)],
+    )
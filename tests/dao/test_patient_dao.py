@@ -7,8 +7,10 @@ from sqlalchemy import Engine, create_engine
 from sqlalchemy.pool import StaticPool
 
 from dao import NotFoundError
-from dao.models import Base
-from dao.patient_dao import PatientDao
+from dao.change_dao import ChangeDao
+from dao.lab_dao import LabDao
+from dao.models import Base, Entity, Operation
+from dao.patient_dao import PatientDao, PatientRecord
 
 
 @pytest.fixture
@@ -47,12 +49,85 @@ def test_read_exists_succeeds(db_engine: Engine) -> None:
     assert retrieved.date_of_birth == created.date_of_birth
 
 
+def test_check(db_engine: Engine) -> None:
+    """Test check() passes for patients that exist and raises otherwise."""
+    dao = PatientDao(db_engine)
+    created = dao.create(date_of_birth=datetime(2016, 10, 17))
+
+    dao.check(created.id)
+    with pytest.raises(NotFoundError, match=r"No patient found"):
+        dao.check("does_not_exist")
+
+
 def test_list_succeeds(db_engine: Engine) -> None:
     """Test list()."""
     dao = PatientDao(db_engine)
-    _ = dao.create(date_of_birth=datetime(2016, 10, 17))
+    created = dao.create(date_of_birth=datetime(2016, 10, 17))
     _ = dao.create(date_of_birth=datetime(2019, 4, 2))
 
     retrieved = dao.list()
 
     assert len(retrieved) == 2
+    assert (
+        PatientRecord(
+            created.id,
+            created.gender,
+            created.date_of_birth,
+            created.language,
+            created.marital_status,
+            created.race,
+        )
+        in retrieved
+    )
+
+
+def test_delete_does_not_exist_raises(db_engine: Engine) -> None:
+    """Test delete() when the patient does not exist."""
+    dao = PatientDao(db_engine)
+
+    with pytest.raises(NotFoundError, match=r"No patient found"):
+        dao.delete("does_not_exist")
+
+
+def test_delete_removes_labs(db_engine: Engine) -> None:
+    """Test delete() removes the patient's labs and only theirs."""
+    dao = PatientDao(db_engine)
+    lab_dao = LabDao(db_engine)
+    alice = dao.create(date_of_birth=datetime(2016, 10, 17))
+    bob = dao.create(date_of_birth=datetime(2019, 4, 2))
+    for admission_number, patient_id in enumerate(
+        [alice.id, alice.id, bob.id]
+    ):
+        lab_dao.create(
+            patient_id=patient_id,
+            admission_number=admission_number,
+            datetime=datetime(2016, 10, 17),
+            name="lab_name",
+            value=0.0,
+            units="meters",
+        )
+
+    dao.delete(alice.id)
+
+    assert [patient.id for patient in dao.list()] == [bob.id]
+    assert [lab.patient_id for lab in lab_dao.list()] == [bob.id]
+    deletes = [
+        (change.entity, change.entity_id)
+        for change in ChangeDao(db_engine).list()
+        if change.operation == Operation.delete
+    ]
+    assert len(deletes) == 3
+    assert (Entity.patient, alice.id) in deletes
+
+
+def test_delete_many_counts_deleted(db_engine: Engine) -> None:
+    """Test delete_many() across several chunks."""
+    dao = PatientDao(db_engine)
+    ids = [
+        dao.create(date_of_birth=datetime(2016, 10, 17)).id for _ in range(3)
+    ]
+
+    deleted = dao.delete_many([*ids[:2], "does_not_exist"] * 300)
+
+    assert deleted == 2
+    assert [patient.id for patient in dao.list()] == ids[2:]
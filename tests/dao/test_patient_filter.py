@@ -0,0 +1,150 @@
+"""Tests for patient_filter.py."""
+
+from datetime import datetime
+from typing import Any
+
+import pytest
+from sqlalchemy import Engine, create_engine, event
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+from dao import NotFoundError
+from dao.models import Base
+from dao.patient_dao import PatientDao
+from dao.patient_filter import CountingBloomFilter, PatientFilter
+
+
+@pytest.fixture
+def db_engine() -> Engine:
+    """Generate database engine."""
+    database_path = "sqlite:///"
+    engine = create_engine(
+        database_path,
+        isolation_level="SERIALIZABLE",
+        # https://fastapi.tiangolo.com/tutorial/sql-databases/#note
+        # https://docs.sqlalchemy.org/en/20/dialects/sqlite.html#using-a-memory-database-in-multiple-threads
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    return engine
+
+
+def test_counting_bloom_filter() -> None:
+    """Test CountingBloomFilter has no false negatives and few positives."""
+    bloom = CountingBloomFilter(1000, 0.01)
+    keys = [f"patient-{i}" for i in range(1000)]
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+    false_positives = sum(f"other-{i}" in bloom for i in range(10_000))
+    assert false_positives < 300
+    assert 0 < bloom.error_rate() < 0.03
+
+    for key in keys[:500]:
+        bloom.remove(key)
+    assert all(key in bloom for key in keys[500:])
+    assert sum(key in bloom for key in keys[:500]) < 50
+
+
+class Clock:
+    """Clock that only moves when told to."""
+
+    def __init__(self) -> None:
+        """Initialize at 0."""
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        """Get the time."""
+        return self.now
+
+
+def count_queries(engine: Engine) -> list[str]:
+    """Record the statements executed on an engine."""
+    statements: list[str] = []
+
+    def record(conn: Any, cursor: Any, statement: str, *args: Any) -> None:
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    return statements
+
+
+def test_read_skips_unknown_patients(db_engine: Engine) -> None:
+    """Test PatientDao answers reads of unknown ids without a query."""
+    patient_filter = PatientFilter(clock=Clock())
+    dao = PatientDao(db_engine, patient_filter)
+    patient = dao.create(date_of_birth=datetime(2016, 10, 17))
+    assert dao.read(patient.id).id == patient.id
+
+    statements = count_queries(db_engine)
+    with pytest.raises(NotFoundError, match=r"No patient found"):
+        dao.read("does_not_exist")
+    assert not statements
+    assert patient_filter.negatives == 1
+
+    other = dao.create(date_of_birth=datetime(2019, 4, 2))
+    assert dao.read(other.id).id == other.id
+    dao.delete(patient.id)
+    with pytest.raises(NotFoundError):
+        dao.read(patient.id)
+    assert "ehr_api_patient_filter_lookups_total" in patient_filter.render()
+
+
+def test_build_reads_one_snapshot(db_engine: Engine) -> None:
+    """Test the filter reads the patient ids and last seq together."""
+    PatientDao(db_engine).create(date_of_birth=datetime(2016, 10, 17))
+    patient_filter = PatientFilter()
+
+    statements = count_queries(db_engine)
+    with Session(db_engine) as session:
+        assert patient_filter.build(session)
+    assert len(statements) == 1
+    assert patient_filter.last_seq == 1
+
+
+def test_read_sees_other_writers(db_engine: Engine) -> None:
+    """Test the filter catches up with other writers within the interval."""
+    clock = Clock()
+    patient_filter = PatientFilter(sync_interval=1.0, clock=clock)
+    dao = PatientDao(db_engine, patient_filter)
+    with pytest.raises(NotFoundError):
+        dao.read("does_not_exist")
+    patient = PatientDao(db_engine).create(date_of_birth=datetime(2016, 1, 1))
+    with pytest.raises(NotFoundError):
+        dao.read(patient.id)
+
+    clock.now += 1.0
+    assert dao.read(patient.id).id == patient.id
+    assert patient_filter.negatives == 2
+
+
+def test_filter_grows(db_engine: Engine) -> None:
+    """Test the filter is rebuilt larger once past its capacity."""
+    clock = Clock()
+    patient_filter = PatientFilter(min_capacity=4, clock=clock)
+    dao = PatientDao(db_engine, patient_filter)
+    with pytest.raises(NotFoundError):
+        dao.read("does_not_exist")
+    patients = [
+        dao.create(date_of_birth=datetime(2016, 1, 1)) for _ in range(10)
+    ]
+    assert all(dao.read(patient.id) for patient in patients)
+    assert patient_filter.created
+
+    clock.now += 1.0
+    assert all(dao.read(patient.id) for patient in patients)
+    assert not patient_filter.created
+    assert patient_filter.bloom is not None
+    assert patient_filter.bloom.capacity >= 10
+
+
+def test_lookups_during_build_pass_through(db_engine: Engine) -> None:
+    """Test lookups while another thread builds the filter do not wait."""
+    patient_filter = PatientFilter()
+    patient_filter.building = True
+
+    with Session(db_engine) as session:
+        assert patient_filter.might_contain("does_not_exist", session)
+    assert patient_filter.bloom is None
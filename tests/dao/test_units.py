@@ -0,0 +1,38 @@
+"""Tests for units.py."""
+
+import pytest
+
+from dao.units import Conversion, UnitRegistry, normalize, registry
+
+
+def test_conversion_matches_units_case_insensitively() -> None:
+    """Test UnitRegistry.conversion()."""
+    conversion = registry.conversion("METABOLIC_GLUCOSE", " MG/DL ")
+
+    assert conversion.units == "mmol/L"
+    assert 90 * conversion.factor == pytest.approx(5.0, abs=0.01)
+
+
+def test_conversion_unknown_units_are_normalized() -> None:
+    """Test units without a conversion are their own normalized units."""
+    assert registry.conversion("METABOLIC_GLUCOSE", "furlongs") == Conversion(
+        "furlongs"
+    )
+    assert registry.conversion("UNKNOWN", "mg/dL") == Conversion("mg/dL")
+
+
+def test_register_adds_conversion() -> None:
+    """Test UnitRegistry.register()."""
+    units = UnitRegistry({})
+
+    units.register("LENGTH", "Feet", Conversion("m", 0.3048))
+
+    assert units.conversion("LENGTH", "feet") == Conversion("m", 0.3048)
+
+
+def test_normalize_applies_factors_and_offsets() -> None:
+    """Test normalize()."""
+    assert normalize([212.0, 1.0], [5 / 9, 2.0], [-160 / 9, 0.5]) == [
+        pytest.approx(100.0),
+        2.5,
+    ]
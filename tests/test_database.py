@@ -0,0 +1,241 @@
+"""Tests for database.py."""
+
+import logging
+import os
+import subprocess
+import sys
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+import pytest
+from sqlalchemy import Engine, create_engine, delete, event, text
+from sqlalchemy.exc import DBAPIError
+
+from dao.change_dao import ChangeDao
+from dao.lab_dao import LabDao
+from dao.lab_name_dao import LabNameDao
+from dao.models import Base, Operation, SchemaVersion
+from dao.patient_dao import PatientDao
+from database import SchemaError, SlowQueryLog, schema_digest, setup
+
+
+def test_slow_query_log_records_plan(caplog: pytest.LogCaptureFixture) -> None:
+    """Test SlowQueryLog logs queries over the threshold with a plan."""
+    slow_query_log = SlowQueryLog(threshold=0.0)
+    engine = setup("sqlite:///", slow_query_log)
+
+    with (
+        caplog.at_level(logging.WARNING, logger="database"),
+        engine.connect() as conn,
+    ):
+        conn.execute(
+            text("SELECT * FROM patients WHERE id = :id"), {"id": "Alice"}
+        )
+
+    entry = slow_query_log.entries[-1]
+    assert entry["statement"] == "SELECT * FROM patients WHERE id = ?"
+    assert "Alice" not in entry["parameters_digest"]
+    assert "patients" in entry["plan"]
+    assert any("Slow query" in message for message in caplog.messages)
+
+
+def test_slow_query_log_ignores_fast_queries() -> None:
+    """Test SlowQueryLog skips queries under the threshold."""
+    slow_query_log = SlowQueryLog(threshold=60.0)
+    engine = setup("sqlite:///", slow_query_log)
+
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+    assert not slow_query_log.entries
+
+
+def test_slow_query_log_forgets_failed_queries() -> None:
+    """Test SlowQueryLog keeps no start time for a failed query."""
+    slow_query_log = SlowQueryLog(threshold=60.0)
+    engine = setup("sqlite:///", slow_query_log)
+
+    with engine.connect() as conn:
+        with pytest.raises(DBAPIError):
+            conn.execute(text("SELECT * FROM no_such_table"))
+        conn.execute(text("SELECT 1"))
+
+        assert not conn.info["slow_query_start"]
+
+
+def test_setup_skips_current_schema(tmp_path: Path) -> None:
+    """Test setup leaves a database set up with the current schema alone."""
+    url = f"sqlite:///{tmp_path / 'test.db'}"
+    engine = setup(url)
+    with engine.connect() as conn:
+        assert conn.scalar(text("SELECT digest FROM schema_version")) == (
+            schema_digest(engine)
+        )
+    engine.dispose()
+
+    statements: list[str] = []
+
+    def record(*args: Any) -> None:
+        statements.append(args[2])
+
+    event.listen(Engine, "before_cursor_execute", record)
+    try:
+        setup(url).dispose()
+    finally:
+        event.remove(Engine, "before_cursor_execute", record)
+
+    assert len(statements) == 1
+    assert "schema_version" in statements[0]
+
+
+def test_setup_updates_changed_schema(tmp_path: Path) -> None:
+    """Test setup creates missing indexes if the schema digest differs."""
+    url = f"sqlite:///{tmp_path / 'test.db'}"
+    engine = setup(url)
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX ix_labs_catalogue_id"))
+        conn.execute(delete(SchemaVersion))
+    engine.dispose()
+
+    engine = setup(url)
+
+    with engine.connect() as conn:
+        assert conn.scalar(
+            text(
+                "SELECT count(*) FROM sqlite_master"
+                " WHERE name = 'ix_labs_catalogue_id'"
+            )
+        )
+
+
+@pytest.mark.skipif(
+    "EHR_API_TEST_POSTGRES_URL" not in os.environ,
+    reason="set EHR_API_TEST_POSTGRES_URL to a scratch PostgreSQL database",
+)
+def test_setup_postgres() -> None:
+    """Test the schema and lab name search on PostgreSQL, set up twice."""
+    url = os.environ["EHR_API_TEST_POSTGRES_URL"]
+    Base.metadata.drop_all(create_engine(url))
+    setup(url).dispose()
+    with setup(url).begin() as conn:
+        conn.execute(delete(SchemaVersion))
+
+    engine = setup(url)
+
+    patient = PatientDao(engine).create(date_of_birth=datetime(2000, 1, 1))
+    LabDao(engine).create(
+        patient_id=patient.id,
+        admission_number=0,
+        datetime=datetime(2020, 1, 1),
+        name="CBC: HEMOGLOBIN",
+        value=13.5,
+        units="g/dL",
+    )
+    LabNameDao(engine).refresh_counts()
+    assert LabNameDao(engine).search("hem cb")[0].labs == 1
+    Base.metadata.drop_all(engine)
+    engine.dispose()
+
+
+def test_setup_rejects_mismatched_tables(tmp_path: Path) -> None:
+    """Test setup fails, leaving the schema unrecorded, on altered tables."""
+    url = f"sqlite:///{tmp_path / 'test.db'}"
+    engine = setup(url)
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE patients ADD COLUMN nickname VARCHAR"))
+        conn.execute(text("ALTER TABLE labs DROP COLUMN normalized_value"))
+        conn.execute(delete(SchemaVersion))
+    engine.dispose()
+
+    with pytest.raises(SchemaError) as error:
+        setup(url)
+
+    assert "labs.normalized_value is missing" in str(error.value)
+    assert "patients.nickname is unexpected" in str(error.value)
+    engine = create_engine(url)
+    with engine.connect() as conn:
+        assert conn.scalar(text("SELECT count(*) FROM schema_version")) == 0
+    engine.dispose()
+
+
+def test_setup_migrates_legacy_labs(tmp_path: Path) -> None:
+    """Test setup moves labs with their own name and units to the catalogue."""
+    url = f"sqlite:///{tmp_path / 'test.db'}"
+    engine = create_engine(url)
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "CREATE TABLE patients (id VARCHAR PRIMARY KEY, gender"
+                " VARCHAR(7), date_of_birth DATETIME, language VARCHAR(9),"
+                " marital_status VARCHAR(9), race VARCHAR(16))"
+            )
+        )
+        conn.execute(
+            text(
+                "CREATE TABLE labs (id VARCHAR PRIMARY KEY, patient_id"
+                " VARCHAR REFERENCES patients (id), admission_number INTEGER,"
+                " datetime DATETIME, name VARCHAR, value FLOAT, units VARCHAR)"
+            )
+        )
+        conn.execute(
+            text(
+                "INSERT INTO patients VALUES ('A', 'male',"
+                " '2000-01-01 00:00:00.000000', 'english', 'single', 'white')"
+            )
+        )
+        conn.execute(
+            text(
+                "INSERT INTO labs VALUES"
+                " ('1', 'A', 1, '2020-01-01 00:00:00.000000',"
+                " 'METABOLIC: GLUCOSE', 90.08, 'mg/dL'),"
+                " ('2', 'A', 1, '2020-01-01 00:00:00.000000',"
+                " 'METABOLIC: GLUCOSE', 90.08, 'mg/dL'),"
+                " ('3', 'A', 1, '2020-01-02 00:00:00.000000',"
+                " 'CBC: HEMOGLOBIN', 13.2, 'g/dL')"
+            )
+        )
+    engine.dispose()
+
+    engine = setup(url)
+
+    labs = sorted(LabDao(engine).list(), key=lambda lab: lab.id)
+    assert [(lab.id, lab.name, lab.units) for lab in labs] == [
+        ("1", "METABOLIC: GLUCOSE", "mg/dL"),
+        ("3", "CBC: HEMOGLOBIN", "g/dL"),
+    ]
+    glucose = LabDao(engine).read("1")
+    assert glucose.normalized_units == "mmol/L"
+    assert glucose.normalized_value == pytest.approx(90.08 / 18.016)
+    assert LabNameDao(engine).search("glu")[0].labs == 1
+    assert [
+        (change.entity_id, change.operation)
+        for change in ChangeDao(engine).list()
+    ] == [("2", Operation.delete)]
+    with engine.connect() as conn:
+        assert conn.scalar(text("SELECT count(*) FROM admissions")) == 1
+    engine.dispose()
+
+
+def test_import_api_defers_optional_modules() -> None:
+    """Test importing the API leaves modules only some requests need."""
+    deferred = [
+        "loader",
+        "multiprocessing",
+        "concurrent.futures.process",
+        "sqlalchemy.dialects.postgresql",
+    ]
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, api.api;"
+            f"print([m for m in {deferred!r} if m in sys.modules])",
+        ],
+        cwd=Path(__file__).parents[1] / "src",
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    assert result.stdout.strip() == "[]"
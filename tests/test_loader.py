@@ -0,0 +1,169 @@
+"""Tests for loader.py."""
+
+from pathlib import Path
+
+import pytest
+from sqlalchemy import Engine, create_engine
+from sqlalchemy.pool import StaticPool
+
+from dao import ConflictError
+from dao.change_dao import ChangeDao
+from dao.lab_dao import LabDao
+from dao.lab_name_dao import LabNameDao
+from dao.models import Base, Entity, Gender, Operation, Race
+from dao.patient_dao import PatientDao
+from loader import enum_parser, load, read_chunks
+
+PATIENTS = (
+    "PatientID\tPatientGender\tPatientDateOfBirth\tPatientRace\t"
+    "PatientMaritalStatus\tPatientLanguage\t"
+    "PatientPopulationPercentageBelowPoverty\n"
+    "A\tMale\t1947-12-28 02:45:40.547\tUnknown\tMarried\tIcelandic\t18.08\n"
+    "B\tFemale\t1952-01-18 19:51:12.917\tAfrican American\tSeparated\t"
+    "English\t13.03\n"
+)
+LABS = (
+    "PatientID\tAdmissionID\tLabName\tLabValue\tLabUnits\tLabDateTime\n"
+    "A\t1\tURINALYSIS: RED BLOOD CELLS\t1.8\trbc/hpf\t"
+    "1992-07-01 01:36:17.910\n"
+    "A\t1\tMETABOLIC: GLUCOSE\t103.3\tmg/dL\t1992-06-30 09:35:52.383\n"
+    "B\t2\tCBC: HEMOGLOBIN\t13.2\tgm/dl\t1992-06-30 09:35:52.383\n"
+)
+
+
+@pytest.fixture
+def db_engine() -> Engine:
+    """Generate database engine."""
+    database_path = "sqlite:///"
+    engine = create_engine(
+        database_path,
+        isolation_level="SERIALIZABLE",
+        # https://fastapi.tiangolo.com/tutorial/sql-databases/#note
+        # https://docs.sqlalchemy.org/en/20/dialects/sqlite.html#using-a-memory-database-in-multiple-threads
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    return engine
+
+
+def write(tmp_path: Path, name: str, content: str) -> Path:
+    """Write a file."""
+    path = tmp_path / name
+    path.write_text(content)
+    return path
+
+
+def test_enum_parser_matches_names_and_values() -> None:
+    """Test enum_parser()."""
+    parse = enum_parser(Race)
+
+    assert parse("African American") == Race.african_american
+    assert parse("WHITE") == Race.white
+    with pytest.raises(ValueError, match="invalid Race 'Martian'"):
+        parse("Martian")
+
+
+def test_read_chunks_numbers_lines(tmp_path: Path) -> None:
+    """Test read_chunks() splits lines after the header."""
+    chunks = list(read_chunks(write(tmp_path, "labs.txt", LABS), 2))
+
+    assert [(chunk.first_line, len(chunk.lines)) for chunk in chunks] == [
+        (2, 2),
+        (4, 1),
+    ]
+    assert chunks[0].header[0] == "PatientID"
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_load_patients_and_labs(
+    db_engine: Engine, tmp_path: Path, workers: int
+) -> None:
+    """Test load() inserts parsed rows and records them as changes."""
+    patients = load(
+        db_engine,
+        Entity.patient,
+        write(tmp_path, "patients.txt", PATIENTS),
+        workers=workers,
+    )
+    labs = load(
+        db_engine,
+        Entity.lab,
+        write(tmp_path, "labs.txt", LABS),
+        chunk_size=2,
+        workers=workers,
+    )
+
+    assert (patients.loaded, labs.loaded) == (2, 3)
+    patient = PatientDao(db_engine).read("A")
+    assert patient.gender == Gender.male
+    assert patient.race == Race.unknown
+    assert sorted(lab.value for lab in LabDao(db_engine).list()) == [
+        1.8,
+        13.2,
+        103.3,
+    ]
+    assert len(ChangeDao(db_engine).list()) == 5
+    glucose = LabDao(db_engine).series("A", "METABOLIC: GLUCOSE", True)
+    assert glucose[0].units == "mmol/L"
+    assert glucose[0].value == pytest.approx(103.3 / 18.016)
+    assert LabNameDao(db_engine).search("glucose")[0].labs == 1
+
+
+def test_load_invalid_line_raises(db_engine: Engine, tmp_path: Path) -> None:
+    """Test load() rejects a file with an invalid line."""
+    path = write(tmp_path, "labs.txt", LABS + "A\tone\tX\t1\tu\t2000-01-01\n")
+
+    with pytest.raises(ValueError, match="line 5"):
+        load(db_engine, Entity.lab, path)
+
+
+def test_load_skip_invalid_counts(db_engine: Engine, tmp_path: Path) -> None:
+    """Test load() skips invalid lines when asked to."""
+    path = write(
+        tmp_path, "labs.txt", LABS + "A\tone\tX\t1\tu\t2000-01-01\nA\t1\n"
+    )
+    skipped: list[str] = []
+
+    stats = load(
+        db_engine, Entity.lab, path, skip_invalid=True, report=skipped.append
+    )
+
+    assert (stats.loaded, stats.rejected) == (3, 2)
+    assert any("line 6: too few columns" in message for message in skipped)
+
+
+def test_load_again_conflicts_unless_upsert(
+    db_engine: Engine, tmp_path: Path
+) -> None:
+    """Test reloading a file."""
+    path = write(tmp_path, "labs.txt", LABS)
+    load(db_engine, Entity.lab, path)
+
+    with pytest.raises(ConflictError):
+        load(db_engine, Entity.lab, path)
+    stats = load(db_engine, Entity.lab, path, upsert=True)
+
+    assert stats.loaded == 3
+    assert len(LabDao(db_engine).list()) == 3
+    operations = [change.operation for change in ChangeDao(db_engine).list()]
+    assert operations.count(Operation.update) == 3
+
+
+def test_load_patients_again_logs_updates(
+    db_engine: Engine, tmp_path: Path
+) -> None:
+    """Test reloading patients with upsert logs them as updated."""
+    path = write(tmp_path, "patients.txt", PATIENTS)
+    load(db_engine, Entity.patient, path)
+
+    load(db_engine, Entity.patient, path, upsert=True)
+
+    changes = ChangeDao(db_engine).list()
+    assert [change.operation for change in changes] == [
+        Operation.create,
+        Operation.create,
+        Operation.update,
+        Operation.update,
+    ]